@@ -0,0 +1,190 @@
+# benchmarks/bench_memoria_fallback.py
+"""
+Recall do embedder local (sem OPENAI_API_KEY) em trechos de roleplay em português.
+
+Cada consulta é uma paráfrase curta de um fragmento da memória (mesmo assunto,
+outras palavras/flexões/acentos). Além dos 24 pares escritos à mão, gera --synthetic
+fatos a partir de modelos (personagem × objeto × lugar...) com paráfrases sem acento
+e com outros verbos; todos competem no mesmo índice, então cada fato tem centenas de
+vizinhos com o mesmo vocabulário. Compara o fallback antigo (bytes do SHA-256
+repetidos) com o fallback por n-gramas com hashing (core.memoria_longa._embed_fallback).
+
+Uso:
+    python benchmarks/bench_memoria_fallback.py [--synthetic 5000] [--queries 300] [--seed 7]
+"""
+from __future__ import annotations
+import argparse
+import hashlib
+import math
+import random
+import sys
+import time
+import unicodedata
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from core.memoria_longa import _UserIndex, _embed_fallback  # noqa: E402
+
+FRAGMENTS = [
+    "Nerith guardou a espada élfica dentro do baú de carvalho no quarto.",
+    "Mary trabalha como enfermeira no plantão noturno do hospital.",
+    "Laura dança na boate aos sábados e odeia o gerente do clube.",
+    "Adelle recebeu a missão de infiltrar a mansão dos Rocha.",
+    "Janio prometeu levar Mary para jantar no restaurante Partido Alto.",
+    "A cafeteria Oregon fecha às dez; o capuccino de lá é o favorito de Laura.",
+    "Nerith tem medo de tempestades desde a queda do portal.",
+    "Mary e Janio se conheceram na praia de Camburi, perto do posto 6.",
+    "Adelle usa uma pistola silenciada e nunca deixa impressões digitais.",
+    "O chalé na Rota do Lagarto fica em Domingos Martins, nas montanhas.",
+    "Laura tem uma filha pequena chamada Sofia que mora com a avó.",
+    "Nerith aprendeu a cozinhar pão com a vizinha do andar de baixo.",
+    "Mary está juntando dinheiro para comprar um apartamento na Enseada do Suá.",
+    "Adelle descobriu que o irmão trabalha para os Rocha.",
+    "Janio deu um colar de prata para Nerith no aniversário dela.",
+    "Laura machucou o tornozelo durante o ensaio no palco.",
+    "Mary odeia acordar cedo e sempre chega atrasada na academia.",
+    "O portal élfico só abre nas noites de lua cheia.",
+    "Adelle escondeu os documentos roubados no cofre do escritório.",
+    "Nerith ficou com ciúmes quando Janio conversou com a vizinha.",
+    "Laura quer largar a boate e abrir um salão de beleza.",
+    "Mary adotou um gato laranja chamado Biscoito.",
+    "Janio trabalha como engenheiro em uma empresa de Vitória.",
+    "Adelle e Janio combinaram um código secreto: 'chuva de março'.",
+]
+
+QUERIES = [
+    ("onde está guardada a espada elfica?", 0),
+    ("mary é enfermeira, trabalha de noite", 1),
+    ("laura dança no clube aos sábados", 2),
+    ("missão de infiltração na mansão Rocha", 3),
+    ("jantar no Partido Alto com o Janio", 4),
+    ("capuccino favorito na cafeteria oregon", 5),
+    ("nerith tem medo de tempestade", 6),
+    ("como mary e janio se conheceram em camburi", 7),
+    ("pistola silenciada da Adelle", 8),
+    ("chalé nas montanhas em domingos martins", 9),
+    ("a filha da Laura, Sofia", 10),
+    ("nerith cozinhando pão", 11),
+    ("mary quer comprar apartamento", 12),
+    ("o irmão de adelle trabalha para os rocha", 13),
+    ("colar de prata de aniversário", 14),
+    ("tornozelo machucado no ensaio", 15),
+    ("mary atrasada na academia", 16),
+    ("quando o portal abre? lua cheia", 17),
+    ("documentos roubados no cofre", 18),
+    ("ciúmes da vizinha", 19),
+    ("laura quer abrir salão de beleza", 20),
+    ("gato chamado biscoito", 21),
+    ("janio engenheiro em vitoria", 22),
+    ("código secreto chuva de março", 23),
+]
+
+
+NAMES = ["Nerith", "Mary", "Laura", "Adelle", "Janio", "Sofia", "Biscoito", "o irmão de Adelle",
+         "a vizinha", "o gerente do clube", "a avó de Laura", "o capitão Rocha"]
+OBJECTS = ["a espada élfica", "o colar de prata", "o diário de capa azul", "a chave do chalé",
+           "o celular quebrado", "a carta lacrada", "o anel de noivado", "a pistola silenciada",
+           "o mapa do portal", "a caixa de música", "o vestido vermelho", "o pen drive criptografado",
+           "a foto antiga", "o frasco de perfume", "o caderno de receitas", "a máscara de veludo"]
+PLACES = ["no baú de carvalho", "na gaveta da cozinha", "no cofre do escritório", "embaixo da cama",
+          "no porta-luvas do carro", "na mochila da academia", "atrás do quadro da sala",
+          "no armário do hospital", "no camarim da boate", "na estante do chalé",
+          "dentro do vaso da varanda", "no bolso do casaco"]
+CITIES = ["Vitória", "Vila Velha", "Domingos Martins", "Guarapari", "Serra", "Cariacica",
+          "Linhares", "Colatina", "Aracruz", "Anchieta"]
+JOBS = ["enfermeira", "engenheiro", "dançarina", "detetive", "cozinheira", "professora",
+        "fotógrafo", "advogada", "mecânico", "bibliotecária"]
+FEARS = ["tempestades", "altura", "cachorros grandes", "hospitais", "escuro", "mar aberto",
+         "multidões", "elevadores"]
+DAYS = ["segunda", "terça", "quarta", "quinta", "sexta", "sábado", "domingo"]
+
+# (fragmento, paráfrase da consulta); a consulta troca verbos/artigos e perde acentos e maiúsculas
+TEMPLATES = [
+    ("{n} guardou {o} {p}.", "onde {n} deixou {o}? {p}"),
+    ("{n} perdeu {o} em {c} na {d}-feira.", "{o} que {n} perdeu em {c}"),
+    ("{n} trabalha como {j} em {c} desde o ano passado.", "{n} é {j} em {c}?"),
+    ("{n} tem pavor de {f} e evita falar disso.", "{n} sente medo de {f}"),
+    ("{n} escondeu {o} {p} antes da viagem para {c}.", "{o} escondido {p}, viagem a {c}"),
+    ("{n} marcou de encontrar {m} em {c} no {d}.", "encontro de {n} com {m} em {c}"),
+]
+
+
+def _plain(text: str) -> str:
+    nfkd = unicodedata.normalize("NFKD", text)
+    return "".join(ch for ch in nfkd if not unicodedata.combining(ch)).lower()
+
+
+def _synthetic_pairs(n: int, rng: random.Random):
+    """n fatos distintos gerados pelos modelos, com a paráfrase de cada um."""
+    seen, out = set(), []
+    while len(out) < n:
+        frag, query = rng.choice(TEMPLATES)
+        nome, outro = rng.sample(NAMES, 2)
+        slots = {"n": nome, "m": outro, "o": rng.choice(OBJECTS), "p": rng.choice(PLACES),
+                 "c": rng.choice(CITIES), "j": rng.choice(JOBS), "f": rng.choice(FEARS),
+                 "d": rng.choice(DAYS)}
+        text = frag.format(**slots)
+        if text in seen:
+            continue
+        seen.add(text)
+        text = text[0].upper() + text[1:]
+        out.append((text, _plain(query.format(**slots))))
+    return out
+
+
+def _legacy_fallback(text: str, dim: int = 256):
+    h = hashlib.sha256(text.encode("utf-8")).digest()
+    base = (list(h) * math.ceil(dim / len(h)))[:dim]
+    return [x / 255.0 for x in base]
+
+
+def _evaluate(name: str, fn, fragments, query_sets, k: int = 10) -> None:
+    idx = _UserIndex.from_docs(
+        {"texto": t, "tags": [], "ts": float(i), "hash": f"h{i}", "vec": fn(t)}
+        for i, t in enumerate(fragments)
+    )
+    for label, queries in query_sets:
+        hits1 = hits3 = hits10 = 0
+        rr = 0.0
+        t0 = time.perf_counter()
+        for q, gold in queries:
+            ranked = [int(d["hash"][1:]) for d in idx.search(fn(q), k, nprobe=0)]
+            pos = ranked.index(gold) if gold in ranked else None
+            if pos is not None:
+                hits1 += pos < 1
+                hits3 += pos < 3
+                hits10 += 1
+                rr += 1.0 / (pos + 1)  # MRR@k: fora do top-k conta 0
+        ms = (time.perf_counter() - t0) * 1000.0 / len(queries)
+        n = float(len(queries))
+        print(f"{name:>16} | {label:>9} | {hits1 / n:>9.3f} | {hits3 / n:>9.3f} | "
+              f"{hits10 / n:>10.3f} | {rr / n:>6.3f} | {ms:>8.3f}")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--synthetic", type=int, default=5000, help="fatos gerados além dos 24 escritos à mão")
+    ap.add_argument("--queries", type=int, default=300, help="paráfrases geradas avaliadas")
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+
+    rng = random.Random(args.seed)
+    pairs = _synthetic_pairs(args.synthetic, rng)
+    fragments = list(FRAGMENTS) + [t for t, _ in pairs]
+    base = len(FRAGMENTS)
+    sampled = rng.sample(range(len(pairs)), min(args.queries, len(pairs)))
+    query_sets = [("manuais", QUERIES),
+                  ("geradas", [(pairs[i][1], base + i) for i in sampled])]
+
+    print(f"fragmentos={len(fragments)} consultas={len(QUERIES)}+{len(query_sets[1][1])}")
+    print(f"{'embedder':>16} | {'consultas':>9} | {'recall@1':>9} | {'recall@3':>9} | "
+          f"{'recall@10':>10} | {'MRR':>6} | {'ms/query':>8}")
+    _evaluate("sha256 (antigo)", _legacy_fallback, fragments, query_sets)
+    _evaluate("n-gramas hash", _embed_fallback, fragments, query_sets)
+
+
+if __name__ == "__main__":
+    main()
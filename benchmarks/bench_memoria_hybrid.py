@@ -0,0 +1,100 @@
+# benchmarks/bench_memoria_hybrid.py
+"""
+Latência e qualidade da busca híbrida (BM25 + vetor) da memória longa.
+
+Gera N fragmentos sintéticos em português (vocabulário de roleplay + nomes
+próprios raros), mede o tempo de _UserIndex.hybrid (RRF e ponderada, com e sem
+filtro de tag) e o acerto@k para consultas por palavra-chave ("lembra da Elysarix")
+contra a busca só vetorial com o embedder local. Acima de LORE_ANN_MIN_ROWS o
+lado vetorial usa o IVF (modo default em produção).
+
+Uso:
+    python benchmarks/bench_memoria_hybrid.py [--n 50000] [--k 5] [--queries 100]
+"""
+from __future__ import annotations
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from core.memoria_longa import _UserIndex, _embed_fallback  # noqa: E402
+
+_VOCAB = (
+    "espada portal floresta taverna beijo lua noite praia vestido sangue missão cofre "
+    "colar ciúmes tempestade chalé montanha café hospital boate palco segredo carta "
+    "vizinha ensaio anel dragão mercado navio porto jardim biblioteca chave sonho"
+).split()
+_VERBS = "guardou encontrou perdeu prometeu escondeu lembrou viu comprou roubou sonhou".split()
+_WHO = ["Nerith", "Mary", "Laura", "Adelle", "Janio"]
+
+
+def _name(i: int) -> str:
+    syl = ["ly", "sa", "rix", "tho", "vel", "mae", "dra", "quen", "zor", "ith"]
+    return "".join(syl[(i // 10 ** j) % 10] for j in range(3)).capitalize() + f"{i % 97}"
+
+
+def _corpus(n: int, rng: np.random.Generator):
+    for i in range(n):
+        w = rng.choice(_VOCAB, 3, replace=False)
+        yield {
+            "texto": f"{_WHO[i % 5]} {rng.choice(_VERBS)} {w[0]} perto de {w[1]} com {_name(i)}; {w[2]}.",
+            "tags": [_WHO[i % 5].lower()],
+            "ts": time.time() - float(rng.integers(0, 365 * 86400)),
+            "hash": f"h{i}",
+        }
+
+
+def _ms(fn, reps: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(reps):
+        fn()
+    return (time.perf_counter() - t0) * 1000.0 / reps
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=50_000)
+    ap.add_argument("--k", type=int, default=5)
+    ap.add_argument("--queries", type=int, default=100)
+    args = ap.parse_args()
+
+    rng = np.random.default_rng(11)
+    docs = list(_corpus(args.n, rng))
+    t0 = time.perf_counter()
+    vecs = [_embed_fallback(d["texto"]) for d in docs]
+    emb_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    idx = _UserIndex.from_docs(dict(d, vec=v) for d, v in zip(docs, vecs))
+    print(f"N={args.n} embed={emb_s:.1f}s build={(time.perf_counter() - t0):.1f}s")
+
+    targets = rng.choice(args.n, args.queries, replace=False)
+    queries = [(f"lembra da {_name(int(i))}", int(i)) for i in targets]
+    qvecs = [_embed_fallback(q) for q, _ in queries]
+
+    print(f"{'modo':>22} | {'ms/query':>8} | {'acerto@k':>8}")
+    tag_of = lambda gold: [_WHO[gold % 5].lower()]  # noqa: E731
+    modes = (
+        ("vetor (exato)", lambda q, v, g: idx.search(v, args.k, nprobe=0)),
+        ("híbrido rrf (exato)", lambda q, v, g: idx.hybrid(q, v, args.k, nprobe=0)),
+        ("híbrido weighted", lambda q, v, g: idx.hybrid(q, v, args.k, nprobe=0, fusion="weighted")),
+        ("híbrido rrf + tag", lambda q, v, g: idx.hybrid(q, v, args.k, allow_tags=tag_of(g), nprobe=0)),
+        ("híbrido rrf (IVF)", lambda q, v, g: idx.hybrid(q, v, args.k)),
+    )
+    idx.hybrid(queries[0][0], qvecs[0], args.k)  # treina o IVF fora da medição
+    for name, fn in modes:
+        hits = 0
+        t0 = time.perf_counter()
+        for (q, gold), v in zip(queries, qvecs):
+            hits += any(d["hash"] == f"h{gold}" for d in fn(q, v, gold))
+        ms = (time.perf_counter() - t0) * 1000.0 / len(queries)
+        print(f"{name:>22} | {ms:>8.3f} | {hits / float(len(queries)):>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# benchmarks/bench_memoria_topk.py
+"""
+Benchmark do top-K da memória longa (core.memoria_longa).
+
+Compara o índice vetorizado (_UserIndex.search) com o ranqueamento legado
+(_cosine em Python puro sobre um lote de 400 docs) para 1k, 10k e 100k fragmentos.
+
+Uso:
+    python benchmarks/bench_memoria_topk.py [--dim 256] [--k 5] [--reps 50] [--legacy]
+"""
+from __future__ import annotations
+import argparse
+import math
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from core.memoria_longa import _UserIndex  # noqa: E402
+
+
+def _cosine(a, b) -> float:
+    """Cosseno em Python puro, como o topk legado fazia por documento (linha de base)."""
+    if not a or not b or len(a) != len(b):
+        return 0.0
+    dot = sum(x*y for x, y in zip(a, b))
+    na = math.sqrt(sum(x*x for x in a))
+    nb = math.sqrt(sum(x*x for x in b))
+    return (dot / (na * nb + 1e-9))
+
+
+def _synthetic_docs(n: int, dim: int, rng: np.random.Generator):
+    vecs = rng.standard_normal((n, dim)).astype(np.float32)
+    tags = (["nerith", "chat"], ["laura", "chat"], ["adelle", "mission"])
+    for i in range(n):
+        yield {
+            "usuario_key": "bench::user",
+            "texto": f"fragmento {i}",
+            "tags": list(tags[i % len(tags)]),
+            "ts": float(i),
+            "hash": f"h{i}",
+            "vec": vecs[i],
+        }
+
+
+def _ms(fn, reps: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(reps):
+        fn()
+    return (time.perf_counter() - t0) * 1000.0 / reps
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--dim", type=int, default=256)
+    ap.add_argument("--k", type=int, default=5)
+    ap.add_argument("--reps", type=int, default=50)
+    ap.add_argument("--legacy", action="store_true", help="inclui o loop _cosine legado (lento)")
+    args = ap.parse_args()
+
+    rng = np.random.default_rng(42)
+    print(f"dim={args.dim} k={args.k} reps={args.reps}")
+    print(f"{'N':>8} | {'build ms':>9} | {'topk ms':>8} | {'topk+tag ms':>11} | {'legado@400 ms':>13}")
+    for n in (1_000, 10_000, 100_000):
+        docs = list(_synthetic_docs(n, args.dim, rng))
+        t0 = time.perf_counter()
+        idx = _UserIndex.from_docs(docs)
+        build_ms = (time.perf_counter() - t0) * 1000.0
+        q = rng.standard_normal(args.dim).astype(np.float32)
+
+        t_all = _ms(lambda: idx.search(q, args.k, nprobe=0), args.reps)
+        t_tag = _ms(lambda: idx.search(q, args.k, allow_tags=["nerith"], nprobe=0), args.reps)
+
+        legacy = "—"
+        if args.legacy:
+            q_list = q.tolist()
+            batch = [(d, d["vec"].tolist()) for d in docs[:400]]
+
+            def _legacy():
+                scored = [(_cosine(q_list, v), d) for d, v in batch]
+                scored.sort(key=lambda t: t[0], reverse=True)
+                return scored[:args.k]
+
+            legacy = f"{_ms(_legacy, max(1, args.reps // 10)):.2f}"
+
+        print(f"{n:>8} | {build_ms:>9.1f} | {t_all:>8.3f} | {t_tag:>11.3f} | {legacy:>13}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# benchmarks/bench_memoria_vecstore.py
+"""
+Relatório do armazenamento binário de vetores da memória longa.
+
+Para cada dimensão (1536 = OpenAI, 256 = fallback) compara lista BSON de
+doubles com os formatos empacotados (f32/f16/i8): bytes por documento,
+bytes transferidos ao carregar o índice do usuário (N docs), custo de decodificação
+e mudança de ranking (recall@k contra a lista original).
+
+Uso:
+    python benchmarks/bench_memoria_vecstore.py [--n 5000] [--k 10] [--queries 100]
+"""
+from __future__ import annotations
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from core.memoria_longa import _bson_len, _normalize, _pack_vec, _unpack_vec  # noqa: E402
+
+
+def _topk(mat: np.ndarray, q: np.ndarray, k: int) -> set:
+    scores = mat @ q
+    return set(np.argpartition(-scores, k - 1)[:k].tolist())
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=5000)
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--queries", type=int, default=100)
+    args = ap.parse_args()
+
+    rng = np.random.default_rng(3)
+    for dim in (1536, 256):
+        topics = rng.standard_normal((100, dim)).astype(np.float32)
+        vecs = topics[rng.integers(0, 100, args.n)] + 0.6 * rng.standard_normal((args.n, dim)).astype(np.float32)
+        queries = topics[rng.integers(0, 100, args.queries)] + 0.6 * rng.standard_normal((args.queries, dim))
+        queries = np.stack([_normalize(q) for q in queries])
+        ref = np.stack([_normalize(v) for v in vecs])
+        exact = [_topk(ref, q, args.k) for q in queries]
+
+        base = _bson_len(vecs[0].astype(np.float64).tolist())
+        print(f"\ndim={dim} N={args.n} k={args.k}")
+        print(f"{'formato':>8} | {'bytes/doc':>9} | {'MB/carga':>11} | {'economia':>8} | {'decode ms':>9} | {'recall@k':>8}")
+        print(f"{'lista':>8} | {base:>9} | {base * args.n / 1e6:>11.2f} | {'—':>8} | {'—':>9} | {1.0:>8.4f}")
+        for fmt in ("f32", "f16", "i8"):
+            packed = [_pack_vec(v, fmt)[0] for v in vecs]
+            size = _bson_len(packed[0]) + _bson_len(fmt)
+            t0 = time.perf_counter()
+            mat = np.stack([_normalize(_unpack_vec(b, fmt)) for b in packed])
+            dec_ms = (time.perf_counter() - t0) * 1000.0
+            recall = sum(len(_topk(mat, q, args.k) & e) for q, e in zip(queries, exact)) / float(args.k * len(queries))
+            print(f"{fmt:>8} | {size:>9} | {size * args.n / 1e6:>11.2f} | {1 - size / base:>8.1%} | "
+                  f"{dec_ms:>9.1f} | {recall:>8.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# benchmarks/bench_startup.py
+"""
+Custo de import no cold start (python -X importtime), comparado a um orçamento versionado.
+
+Importa, num processo novo, os módulos que o main.py carrega antes da 1ª renderização
+(startup_modules em startup_budget.json) e soma o tempo cumulativo de cada um.
+Lista os N imports mais caros e os pacotes pesados (httpx, pymongo, PIL, huggingface_hub...)
+que entraram no boot — com os imports tardios eles só devem aparecer com --all.
+
+Uso:
+    python benchmarks/bench_startup.py [--top 15] [--reps 3] [--all] [--update]
+    Códigos de saída: 1 = mediana acima de first_render_ms; 2 = algum import falhou
+    (medição inválida: o tempo não inclui o módulo); 3 = orçamento ainda não medido
+    (first_render_ms null — rode --update num ambiente com todas as dependências).
+"""
+from __future__ import annotations
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+ROOT = Path(__file__).resolve().parents[1]
+BUDGET_FILE = Path(__file__).with_name("startup_budget.json")
+
+LAZY_PACKAGES = ("httpx", "pymongo", "PIL", "huggingface_hub", "tiktoken", "redis", "openai")
+
+
+def _load_budget() -> Dict:
+    return json.loads(BUDGET_FILE.read_text(encoding="utf-8"))
+
+
+def _env() -> Dict[str, str]:
+    env = dict(os.environ)
+    env.setdefault("DB_BACKEND", "memory")
+    env.setdefault("TRACE_ENABLED", "0")
+    return env
+
+
+def _run_once(modules: List[str]) -> Tuple[float, Dict[str, int], List[str]]:
+    """(total_ms, {módulo: cumulativo_us}, falhas) de um processo novo."""
+    code = (
+        "import importlib, sys\n"
+        f"for m in {modules!r}:\n"
+        "    try:\n"
+        "        importlib.import_module(m)\n"
+        "    except Exception as e:\n"
+        "        print(f'FAIL {m}: {type(e).__name__}: {e}')\n"
+    )
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT,
+                          capture_output=True, text=True, env=_env())
+    cum: Dict[str, int] = {}
+    total_us = 0
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cum_us, raw = line[len("import time:"):].split("|", 2)
+        name = raw.strip()
+        cum[name] = int(cum_us)
+        if len(raw) - len(raw.lstrip()) == 1:  # nível 0: soma sem contar aninhados duas vezes
+            total_us += int(cum_us)
+    fails = [ln for ln in proc.stdout.splitlines() if ln.startswith("FAIL ")]
+    return total_us / 1000.0, cum, fails
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--top", type=int, default=15)
+    ap.add_argument("--reps", type=int, default=3)
+    ap.add_argument("--all", action="store_true", help="inclui também os módulos carregados sob demanda")
+    ap.add_argument("--update", action="store_true", help="grava a mediana atual (+20%%) como novo orçamento")
+    args = ap.parse_args()
+
+    budget = _load_budget()
+    modules = list(budget["startup_modules"]) + (list(budget.get("on_demand_modules", [])) if args.all else [])
+
+    totals: List[float] = []
+    last: Dict[str, int] = {}
+    fails: List[str] = []
+    for _ in range(max(1, args.reps)):
+        total, last, fails = _run_once(modules)
+        totals.append(total)
+    med = statistics.median(totals)
+
+    print(f"módulos={len(modules)} reps={len(totals)} mediana={med:.1f} ms (min {min(totals):.1f})")
+    for f in fails:
+        print(f"  {f}")
+    print(f"\ntop {args.top} (cumulativo, ms):")
+    for name, us in sorted(last.items(), key=lambda kv: -kv[1])[: args.top]:
+        print(f"  {us / 1000.0:8.1f}  {name}")
+    heavy = sorted({n.split(".", 1)[0] for n in last} & set(LAZY_PACKAGES))
+    print(f"\npacotes pesados no boot: {', '.join(heavy) if heavy else '—'}")
+
+    if args.update:
+        if fails:
+            print("imports falharam: instale as dependências antes de atualizar o orçamento")
+            sys.exit(2)
+        budget["first_render_ms"] = round(med * 1.2)
+        BUDGET_FILE.write_text(json.dumps(budget, indent=2, ensure_ascii=False) + "\n", encoding="utf-8")
+        print(f"orçamento atualizado: {budget['first_render_ms']} ms")
+        return
+    if fails:
+        print("medição inválida: imports falharam (instale as dependências)")
+        sys.exit(2)
+    if budget.get("first_render_ms") is None:
+        print("orçamento ainda não medido: rode com --update num ambiente completo")
+        sys.exit(3)
+    limit = float(budget["first_render_ms"])
+    status = "OK" if med <= limit else "ESTOUROU"
+    print(f"orçamento first_render_ms={limit:.0f} → {status}")
+    if med > limit and not args.all:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# benchmarks/check_cache_redis.py
+"""
+Verificação do backend "redis" do core.cache contra o Redis falso (benchmarks/fake_redis.py).
+
+Duas "réplicas" (make_cache com clientes ligados ao mesmo FakeRedisServer):
+- L2: o que a réplica A carrega, a B lê do Redis sem chamar o loader (hit no L2);
+- payload JSON: datetime/bytes/acentos voltam iguais; pickle gravado por terceiros é
+  recusado (miss + erro), nunca desserializado;
+- invalidação versionada: bump_version em A torna obsoletas as entradas do dono no L2
+  e, via pub/sub, no L1 da B; outros donos seguem válidos;
+- Redis fora do ar: operações viram miss e o L2 é pulado até REDIS_RETRY_S.
+
+Uso:
+    python benchmarks/check_cache_redis.py
+    Código de saída 1 se alguma verificação falhar.
+"""
+from __future__ import annotations
+import pickle
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, List, Tuple
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from core.cache import RedisCache, make_cache  # noqa: E402
+from fake_redis import FakeRedis, FakeRedisServer  # noqa: E402
+
+RESULTS: List[Tuple[str, bool, str]] = []
+
+
+def check(name: str, ok: bool, detail: str = "") -> None:
+    RESULTS.append((name, bool(ok), detail))
+
+
+def _wait(cond: Callable[[], bool], timeout: float = 2.0) -> bool:
+    t0 = time.time()
+    while time.time() - t0 < timeout:
+        if cond():
+            return True
+        time.sleep(0.01)
+    return cond()
+
+
+def main() -> None:
+    server = FakeRedisServer()
+    a, _ = make_cache(backend="redis", redis_client=FakeRedis(server))
+    b, _ = make_cache(backend="redis", redis_client=FakeRedis(server))
+    check("backend em camadas", type(a).__name__ == "TieredCache", type(a).__name__)
+
+    # ---- L2 compartilhado ----
+    value = {"ts": datetime(2026, 1, 2, 3, 4, 5, tzinfo=timezone.utc), "raw": b"\x00\x01",
+             "texto": "ação", "hist": [{"role": "user", "content": "oi"}]}
+    loads = []
+    a.get_or_load("facts:u1", lambda: loads.append("a") or value, owner="u1")
+    got = b.get_or_load("facts:u1", lambda: loads.append("b") or {}, owner="u1")
+    check("L2 hit entre réplicas", loads == ["a"] and b.stats()["l2"]["hits"] == 1, f"loaders={loads}")
+    check("payload JSON fiel", got == value, repr(got))
+    a.get_or_load("facts:u2", lambda: {"x": 1}, owner="u2")
+    b.get("facts:u2")
+
+    # ---- pickle de terceiros é recusado ----
+    evil = RedisCache(FakeRedis(server), prefix=a.l2.prefix)
+    server.data[evil._key("evil")] = (pickle.dumps(("u1", 0, {"x": 1})), None)
+    errs = evil.stats()["errors"]
+    check("pickle recusado", evil.get_entry("evil") is None and evil.stats()["errors"] == errs + 1)
+
+    # ---- invalidação versionada + broadcast ----
+    time.sleep(0.05)  # a thread do barramento da B já assinou o canal
+    a.bump_version("u1")
+    check("L1 da réplica B invalidado via pub/sub", _wait(lambda: b.l1.version("u1") == 1),
+          f"versão L1 em B={b.l1.version('u1')}")
+    check("entrada do dono obsoleta no L2", b.l2.get_entry("facts:u1") is None)
+    check("outro dono intacto", b.get("facts:u2") == {"x": 1})
+    fresh = b.get_or_load("facts:u1", lambda: {"novo": True}, owner="u1")
+    check("recarrega após bump", fresh == {"novo": True}, repr(fresh))
+
+    # ---- Redis fora do ar ----
+    down = FakeRedis(server)
+    l2 = RedisCache(down, prefix=a.l2.prefix, retry_s=60)
+    down.fail = True
+    miss = l2.get_entry("facts:u2")
+    calls = down.calls
+    l2.get_entry("facts:u2")
+    check("fora do ar vira miss", miss is None and l2.stats()["errors"] == 1)
+    check("L2 pulado durante o retry", down.calls == calls and l2.stats()["skipped"] >= 1)
+
+    width = max(len(n) for n, _, _ in RESULTS)
+    for name, ok, detail in RESULTS:
+        print(f"{'OK ' if ok else 'FALHOU'} {name:<{width}} {detail if not ok else ''}".rstrip())
+    if not all(ok for _, ok, _ in RESULTS):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+# benchmarks/fake_redis.py
+"""
+Redis falso em memória para exercitar o backend "redis" do core.cache sem servidor.
+
+- FakeRedisServer: o "servidor" (chaves com expiração + canais pub/sub); vários
+  FakeRedis(server) ligados ao mesmo servidor simulam réplicas da app.
+- FakeRedis: só o que RedisCache/RedisInvalidationBus usam — ping, get, set(ex=),
+  incr, delete, publish, pubsub(ignore_subscribe_messages=) com subscribe/listen/close.
+- Valores voltam como bytes (como o redis-py sem decode_responses).
+- fail=True faz toda operação levantar ConnectionError (Redis fora do ar).
+
+Uso: make_cache(backend="redis", redis_client=FakeRedis(server)).
+"""
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+
+def _b(v: Any) -> bytes:
+    if isinstance(v, bytes):
+        return v
+    return str(v).encode("utf-8")
+
+
+class FakeRedisServer:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data: Dict[str, Tuple[bytes, Optional[float]]] = {}  # chave -> (valor, expira_em)
+        self.channels: Dict[str, List["FakePubSub"]] = {}
+
+    def _live(self, key: str) -> Optional[bytes]:
+        ent = self.data.get(key)
+        if ent is None:
+            return None
+        if ent[1] is not None and ent[1] <= time.time():
+            self.data.pop(key, None)
+            return None
+        return ent[0]
+
+
+class FakePubSub:
+    def __init__(self, server: FakeRedisServer, ignore_subscribe_messages: bool = False):
+        self.server = server
+        self.ignore_subscribe_messages = ignore_subscribe_messages
+        self._q: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue()
+        self._channels: List[str] = []
+
+    def subscribe(self, *channels: str) -> None:
+        with self.server.lock:
+            for ch in channels:
+                self.server.channels.setdefault(ch, []).append(self)
+                self._channels.append(ch)
+                if not self.ignore_subscribe_messages:
+                    self._q.put({"type": "subscribe", "channel": _b(ch), "data": len(self._channels)})
+
+    def listen(self) -> Iterator[Dict[str, Any]]:
+        while True:
+            msg = self._q.get()
+            if msg is None:
+                return
+            yield msg
+
+    def close(self) -> None:
+        with self.server.lock:
+            for ch in self._channels:
+                subs = self.server.channels.get(ch) or []
+                if self in subs:
+                    subs.remove(self)
+        self._q.put(None)
+
+
+class FakeRedis:
+    def __init__(self, server: Optional[FakeRedisServer] = None):
+        self.server = server or FakeRedisServer()
+        self.fail = False
+        self.calls = 0
+
+    def _op(self) -> None:
+        self.calls += 1
+        if self.fail:
+            raise ConnectionError("fake redis: fora do ar")
+
+    def ping(self) -> bool:
+        self._op()
+        return True
+
+    def get(self, key: str) -> Optional[bytes]:
+        self._op()
+        with self.server.lock:
+            return self.server._live(key)
+
+    def set(self, key: str, value: Any, ex: Optional[int] = None) -> bool:
+        self._op()
+        with self.server.lock:
+            self.server.data[key] = (_b(value), time.time() + ex if ex else None)
+        return True
+
+    def incr(self, key: str) -> int:
+        self._op()
+        with self.server.lock:
+            n = int(self.server._live(key) or 0) + 1
+            self.server.data[key] = (_b(n), None)
+            return n
+
+    def delete(self, *keys: str) -> int:
+        self._op()
+        with self.server.lock:
+            return sum(1 for k in keys if self.server.data.pop(k, None) is not None)
+
+    def publish(self, channel: str, message: Any) -> int:
+        self._op()
+        with self.server.lock:
+            subs = list(self.server.channels.get(channel) or [])
+        for ps in subs:
+            ps._q.put({"type": "message", "channel": _b(channel), "data": _b(message)})
+        return len(subs)
+
+    def pubsub(self, ignore_subscribe_messages: bool = False) -> FakePubSub:
+        self._op()
+        return FakePubSub(self.server, ignore_subscribe_messages=ignore_subscribe_messages)
@@ -3,16 +3,22 @@ from __future__ import annotations
 
 import re, time, random, json
 from typing import List, Dict, Tuple, Any
-import streamlit as st
 
 # ===== Base =====
-from core.common.base_service import BaseCharacter
+from core.common.base_service import BaseCharacter, REPLY_SECONDS, REPLY_ERRORS
+from core.session import session_state
 from core.service_router import route_chat_strict
+from core.jobs import notify
 from core.repositories import (
-    save_interaction, get_history_docs,
-    get_facts, get_fact, set_fact
+    save_interaction,
+    get_fact, set_fact,
+    get_facts_cached, get_history_docs_cached, invalidate_user,
 )
 from core.tokens import toklen
+from core.tracing import span, traced
+from core.usage import purpose
+from core import metrics
+
 
 # ===== LORE (opcional; tolerante à ausência) =====
 try:
@@ -78,53 +84,21 @@ def _safe_max_output(win: int, prompt_tokens: int) -> int:
 # =========================
 # Cache leve (facts/history)
 # =========================
-CACHE_TTL = int(st.secrets.get("CACHE_TTL", 30))  # segundos
-_cache_facts: Dict[str, Dict] = {}
-_cache_history: Dict[str, List[Dict]] = {}
-_cache_ts: Dict[str, float] = {}
-
-def _purge_expired_cache():
-    now = time.time()
-    for k in list(_cache_facts.keys()):
-        if now - _cache_ts.get(f"facts_{k}", 0) >= CACHE_TTL:
-            _cache_facts.pop(k, None)
-            _cache_ts.pop(f"facts_{k}", None)
-    for k in list(_cache_history.keys()):
-        if now - _cache_ts.get(f"hist_{k}", 0) >= CACHE_TTL:
-            _cache_history.pop(k, None)
-            _cache_ts.pop(f"hist_{k}", None)
-
+# (core.cache: LRU+TTL compartilhado entre personagens, invalidado pelos repositórios)
 def clear_user_cache(user_key: str):
-    _cache_facts.pop(user_key, None)
-    _cache_ts.pop(f"facts_{user_key}", None)
-    _cache_history.pop(user_key, None)
-    _cache_ts.pop(f"hist_{user_key}", None)
+    invalidate_user(user_key)
 
 def cached_get_facts(user_key: str) -> Dict:
-    _purge_expired_cache()
-    now = time.time()
-    if user_key in _cache_facts and (now - _cache_ts.get(f"facts_{user_key}", 0) < CACHE_TTL):
-        return _cache_facts[user_key]
     try:
-        f = get_facts(user_key) or {}
+        return get_facts_cached(user_key) or {}
     except Exception:
-        f = {}
-    _cache_facts[user_key] = f
-    _cache_ts[f"facts_{user_key}"] = now
-    return f
+        return {}
 
 def cached_get_history(user_key: str) -> List[Dict]:
-    _purge_expired_cache()
-    now = time.time()
-    if user_key in _cache_history and (now - _cache_ts.get(f"hist_{user_key}", 0) < CACHE_TTL):
-        return _cache_history[user_key]
     try:
-        docs = get_history_docs(user_key) or []
+        return get_history_docs_cached(user_key) or []
     except Exception:
-        docs = []
-    _cache_history[user_key] = docs
-    _cache_ts[f"hist_{user_key}"] = now
-    return docs
+        return []
 
 # =========================
 # Robustez de chamada (retry + fallback)
@@ -159,9 +133,9 @@ def _robust_chat_call(
             }
             if tools:
                 payload["tools"] = tools
-            if st.session_state.get("json_mode_on", False):
+            if session_state().get("json_mode_on", False):
                 payload["response_format"] = {"type": "json_object"}
-            adapter_id = (st.session_state.get("together_lora_id") or "").strip()
+            adapter_id = (session_state().get("together_lora_id") or "").strip()
             if adapter_id and (model or '').startswith('together/'):
                 payload["adapter_id"] = adapter_id
             return route_chat_strict(model, payload)
@@ -183,9 +157,9 @@ def _robust_chat_call(
                 }
                 if tools:
                     payload_fb["tools"] = tools
-                if st.session_state.get("json_mode_on", False):
+                if session_state().get("json_mode_on", False):
                     payload_fb["response_format"] = {"type": "json_object"}
-                adapter_id = (st.session_state.get("together_lora_id") or "").strip()
+                adapter_id = (session_state().get("together_lora_id") or "").strip()
                 if adapter_id and (fb or '').startswith('together/'):
                     payload_fb["adapter_id"] = adapter_id
                 return route_chat_strict(fb, payload_fb)
@@ -237,7 +211,7 @@ TOOLS: List[Dict] = [
 # =========================
 
 def _current_user_key() -> str:
-    uid = str(st.session_state.get("user_id", "") or "").strip()
+    uid = str(session_state().get("user_id", "") or "").strip()
     return f"{uid}::adelle" if uid else "anon::adelle"
 
 # Preferências do usuário (estilo de missão)
@@ -313,7 +287,7 @@ def _mem_drop_warn(report: dict) -> None:
             msg.append(f"**{summarized}** turnos antigos **resumidos**")
         if trimmed:
             msg.append(f"**{trimmed}** turnos verbatim **podados**")
-        st.info(
+        notify("info",
             f"⚠️ Memória ajustada: {' e '.join(msg)}. (histórico: {hist_tokens}/{hist_budget} tokens). "
             "Peça um **‘recap curto’** se notar lacunas.",
             icon="⚠️",
@@ -369,8 +343,13 @@ def _build_system_block(
 class AdelleService(BaseCharacter):
     id: str = "adelle"
     display_name: str = "Adelle"
+    state_keys = BaseCharacter.state_keys + (
+        "adelle_attr_idx", "momento_atual", "ultra_ia_on", "ultra_critic_model",
+    )
 
     # ===== API =====
+    @metrics.timed(REPLY_SECONDS, REPLY_ERRORS, character="adelle")
+    @traced("adelle.reply", root=True)
     def reply(self, user: str, model: str) -> str:
         prompt = self._get_user_prompt()
         if not prompt:
@@ -392,8 +371,8 @@ class AdelleService(BaseCharacter):
 
         # Foco sensorial rotativo
         pool = ["olhar (desafio)", "postura (poder)", "voz (controle)", "toque (teste)", "respiração (tensão)", "silêncio (pressão)"]
-        idx = (int(st.session_state.get("adelle_attr_idx", -1)) + 1) % len(pool)
-        st.session_state["adelle_attr_idx"] = idx
+        idx = (int(session_state().get("adelle_attr_idx", -1)) + 1) % len(pool)
+        session_state()["adelle_attr_idx"] = idx
         foco = pool[idx]
 
         # NSFW hint
@@ -421,14 +400,16 @@ class AdelleService(BaseCharacter):
             entities_line=entities_line,
             evidence=evidence,
             prefs_line=_prefs_line(prefs),
-            scene_time=st.session_state.get("momento_atual", ""),
+            scene_time=session_state().get("momento_atual", ""),
         )
 
         # LORE (memória longa)
         lore_msgs: List[Dict[str, str]] = []
         try:
             q = (prompt or "") + "\n" + (rolling or "")
-            top = lore_topk(usuario_key, q, k=4, allow_tags=["adelle", "mission"])  # tags de missão
+            with span("adelle.lore", k=4) as sp:
+                top = lore_topk(usuario_key, q, k=4, allow_tags=["adelle", "mission"])  # tags de missão
+                sp.set(hits=len(top or []))
             if top:
                 lore_text = " | ".join(d.get("texto", "") for d in top if d.get("texto"))
                 if lore_text:
@@ -437,12 +418,13 @@ class AdelleService(BaseCharacter):
             pass
 
                 # Histórico (com orçamento)
-        verbatim_ultimos = int(st.session_state.get("verbatim_ultimos", 10))
-        hist_msgs = self._montar_historico(usuario_key, history_boot, model, verbatim_ultimos=verbatim_ultimos)
+        verbatim_ultimos = int(session_state().get("verbatim_ultimos", 10))
+        with span("adelle.history", verbatim=verbatim_ultimos):
+            hist_msgs = self._montar_historico(usuario_key, history_boot, model, verbatim_ultimos=verbatim_ultimos)
 
         # ⚠️ Aviso visual de poda/resumo após montar histórico
         try:
-            _mem_drop_warn(st.session_state.get("_mem_drop_report", {}))
+            _mem_drop_warn(session_state().get("_mem_drop_report", {}))
         except Exception:
             pass
 
@@ -487,7 +469,7 @@ class AdelleService(BaseCharacter):
 
 
         # Tool-calling
-        tools_to_use = TOOLS if st.session_state.get("tool_calling_on", False) else None
+        tools_to_use = TOOLS if session_state().get("tool_calling_on", False) else None
         fallbacks = [
             "together/Qwen/Qwen2.5-72B-Instruct",
             "together/meta-llama/Meta-Llama-3.1-405B-Instruct-Turbo",
@@ -501,10 +483,12 @@ class AdelleService(BaseCharacter):
         provider = "primary"
         while iteration < max_iterations:
             iteration += 1
-            data, used_model, provider = _robust_chat_call(
-                model, messages, max_tokens=max_out, temperature=temperature, top_p=0.95,
-                fallback_models=fallbacks, tools=tools_to_use
-            )
+            with span("adelle.completion", iteration=iteration, max_tokens=max_out), \
+                    purpose("main" if iteration == 1 else "tool-iteration"):
+                data, used_model, provider = _robust_chat_call(
+                    model, messages, max_tokens=max_out, temperature=temperature, top_p=0.95,
+                    fallback_models=fallbacks, tools=tools_to_use
+                )
             msg = (data.get("choices", [{}])[0].get("message", {}) or {})
             texto = (msg.get("content", "") or "").strip()
             tool_calls = msg.get("tool_calls", [])
@@ -518,17 +502,20 @@ class AdelleService(BaseCharacter):
                 func_args_str = tc.get("function", {}).get("arguments", "{}")
                 try:
                     func_args = json.loads(func_args_str) if func_args_str else {}
-                    result = self._exec_tool_call(func_name, func_args, usuario_key)
+                    with span("adelle.tool", tool=func_name, iteration=iteration):
+                        result = self._exec_tool_call(func_name, func_args, usuario_key)
                     messages.append({"role": "tool", "tool_call_id": tool_id, "content": result})
                 except Exception as e:
                     messages.append({"role": "tool", "tool_call_id": tool_id, "content": f"ERRO: {e}"})
 
         # Ultra IA (opcional)
         try:
-            if bool(st.session_state.get("ultra_ia_on", False)) and texto:
-                critic_model = st.session_state.get("ultra_critic_model", model) or model
-                notes = critic_review(critic_model, system_block, prompt, texto)
-                texto = polish(model, system_block, prompt, texto, notes)
+            if bool(session_state().get("ultra_ia_on", False)) and texto:
+                critic_model = session_state().get("ultra_critic_model", model) or model
+                with span("adelle.critic", model=critic_model):
+                    notes = critic_review(critic_model, system_block, prompt, texto)
+                with span("adelle.polish", model=model):
+                    texto = polish(model, system_block, prompt, texto, notes)
         except Exception:
             pass
 
@@ -550,21 +537,22 @@ class AdelleService(BaseCharacter):
         except Exception:
             pass
         try:
-            lore_save(usuario_key, f"[USER] {prompt}\n[ADELLE] {texto}", tags=["adelle", "mission"])
+            with span("adelle.lore_save"):
+                lore_save(usuario_key, f"[USER] {prompt}\n[ADELLE] {texto}", tags=["adelle", "mission"])
         except Exception:
             pass
 
         try:
-            st.session_state["suggestion_placeholder"] = self._suggest_placeholder(texto, local_atual)
-            st.session_state["last_assistant_message"] = texto
+            session_state()["suggestion_placeholder"] = self._suggest_placeholder(texto, local_atual)
+            session_state()["last_assistant_message"] = texto
         except Exception:
             pass
 
         try:
             if provider == "synthetic-fallback":
-                st.info("⚠️ Provedor instável. Resposta em fallback — pode continuar normalmente.")
+                notify("info", "⚠️ Provedor instável. Resposta em fallback — pode continuar normalmente.")
             elif used_model and model not in used_model:
-                st.caption(f"↪️ Failover automático: **{used_model}**.")
+                notify("caption", f"↪️ Failover automático: **{used_model}**.")
         except Exception:
             pass
 
@@ -573,7 +561,7 @@ class AdelleService(BaseCharacter):
     # ===== Tools =====
     def _exec_tool_call(self, name: str, args: dict, usuario_key: str) -> str:
         try:
-            user_display = st.session_state.get("user_id", "") or ""
+            user_display = session_state().get("user_id", "") or ""
             if name == "get_mission_briefing":
                 return self._build_memory_pin(usuario_key, user_display)
             if name == "set_fact":
@@ -609,10 +597,10 @@ class AdelleService(BaseCharacter):
 
     def _get_user_prompt(self) -> str:
         return (
-            st.session_state.get("chat_input")
-            or st.session_state.get("user_input")
-            or st.session_state.get("last_user_message")
-            or st.session_state.get("prompt")
+            session_state().get("chat_input")
+            or session_state().get("user_input")
+            or session_state().get("last_user_message")
+            or session_state().get("prompt")
             or ""
         ).strip()
 
@@ -653,6 +641,8 @@ class AdelleService(BaseCharacter):
         except Exception:
             return ""
 
+    @traced("adelle.rolling_summary")
+    @purpose("summary")
     def _update_rolling_summary_v2(self, usuario_key: str, model: str, user_prompt: str, assistant_response: str) -> None:
         try:
             current_summary = self._get_rolling_summary(usuario_key)
@@ -696,7 +686,7 @@ SUMÁRIO ATUALIZADO:"""
 
         docs = cached_get_history(usuario_key)
         if not docs:
-            st.session_state["_mem_drop_report"] = {}
+            session_state()["_mem_drop_report"] = {}
             return history_boot[:]
 
         pares: List[Dict[str, str]] = []
@@ -716,7 +706,7 @@ SUMÁRIO ATUALIZADO:"""
                 pares.append({"role": "assistant", "content": a})
 
         if not pares:
-            st.session_state["_mem_drop_report"] = {}
+            session_state()["_mem_drop_report"] = {}
             return history_boot[:]
 
         keep = max(0, verbatim_ultimos * 2)  # pares user/assistant
@@ -739,7 +729,7 @@ SUMÁRIO ATUALIZADO:"""
                 verbatim = []
             msgs = verbatim[:]
 
-        st.session_state["_mem_drop_report"] = {
+        session_state()["_mem_drop_report"] = {
             "summarized_pairs": 0,           # fácil evoluir p/ resumo em camada
             "trimmed_pairs": trimmed_pairs,
             "hist_tokens": _hist_tokens(msgs),
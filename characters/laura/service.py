@@ -2,16 +2,22 @@ from __future__ import annotations
 
 import time, random, json
 from typing import List, Dict, Tuple
-import streamlit as st
 
 # ====== Imports Base ======
-from core.common.base_service import BaseCharacter
+from core.common.base_service import BaseCharacter, REPLY_SECONDS, REPLY_ERRORS
+from core.session import session_state
 from core.service_router import route_chat_strict
+from core.jobs import notify
 from core.repositories import (
-    save_interaction, get_history_docs,
-    get_facts, get_fact, set_fact, last_event
+    save_interaction,
+    get_fact, set_fact, last_event,
+    get_facts_cached, get_history_docs_cached, invalidate_user,
 )
 from core.tokens import toklen
+from core.tracing import span, traced
+from core.usage import purpose
+from core import metrics
+
 
 # ====== LORE (opcional, com fallback no-op) ======
 try:
@@ -70,53 +76,21 @@ def _safe_max_output(win: int, prompt_tokens: int) -> int:
 # =========================
 # Cache leve (facts/history)
 # =========================
-CACHE_TTL = int(st.secrets.get("CACHE_TTL", 30))  # segundos
-_cache_facts: Dict[str, Dict] = {}
-_cache_history: Dict[str, List[Dict]] = {}
-_cache_ts: Dict[str, float] = {}
-
-def _purge_expired_cache():
-    now = time.time()
-    for k in list(_cache_facts.keys()):
-        if now - _cache_ts.get(f"facts_{k}", 0) >= CACHE_TTL:
-            _cache_facts.pop(k, None)
-            _cache_ts.pop(f"facts_{k}", None)
-    for k in list(_cache_history.keys()):
-        if now - _cache_ts.get(f"hist_{k}", 0) >= CACHE_TTL:
-            _cache_history.pop(k, None)
-            _cache_ts.pop(f"hist_{k}", None)
-
+# (core.cache: LRU+TTL compartilhado entre personagens, invalidado pelos repositórios)
 def clear_user_cache(user_key: str):
-    _cache_facts.pop(user_key, None)
-    _cache_ts.pop(f"facts_{user_key}", None)
-    _cache_history.pop(user_key, None)
-    _cache_ts.pop(f"hist_{user_key}", None)
+    invalidate_user(user_key)
 
 def cached_get_facts(user_key: str) -> Dict:
-    _purge_expired_cache()
-    now = time.time()
-    if user_key in _cache_facts and (now - _cache_ts.get(f"facts_{user_key}", 0) < CACHE_TTL):
-        return _cache_facts[user_key]
     try:
-        f = get_facts(user_key) or {}
+        return get_facts_cached(user_key) or {}
     except Exception:
-        f = {}
-    _cache_facts[user_key] = f
-    _cache_ts[f"facts_{user_key}"] = now
-    return f
+        return {}
 
 def cached_get_history(user_key: str) -> List[Dict]:
-    _purge_expired_cache()
-    now = time.time()
-    if user_key in _cache_history and (now - _cache_ts.get(f"hist_{user_key}", 0) < CACHE_TTL):
-        return _cache_history[user_key]
     try:
-        docs = get_history_docs(user_key) or []
+        return get_history_docs_cached(user_key) or []
     except Exception:
-        docs = []
-    _cache_history[user_key] = docs
-    _cache_ts[f"hist_{user_key}"] = now
-    return docs
+        return []
 
 # =========================
 # Robustez de chamada (retry + fallback)
@@ -151,9 +125,9 @@ def _robust_chat_call(
             }
             if tools:
                 payload["tools"] = tools
-            if st.session_state.get("json_mode_on", False):
+            if session_state().get("json_mode_on", False):
                 payload["response_format"] = {"type": "json_object"}
-            adapter_id = (st.session_state.get("together_lora_id") or "").strip()
+            adapter_id = (session_state().get("together_lora_id") or "").strip()
             if adapter_id and (model or '').startswith('together/'):
                 payload["adapter_id"] = adapter_id
             return route_chat_strict(model, payload)
@@ -175,9 +149,9 @@ def _robust_chat_call(
                 }
                 if tools:
                     payload_fb["tools"] = tools
-                if st.session_state.get("json_mode_on", False):
+                if session_state().get("json_mode_on", False):
                     payload_fb["response_format"] = {"type": "json_object"}
-                adapter_id = (st.session_state.get("together_lora_id") or "").strip()
+                adapter_id = (session_state().get("together_lora_id") or "").strip()
                 if adapter_id and (fb or '').startswith('together/'):
                     payload_fb["adapter_id"] = adapter_id
                 return route_chat_strict(fb, payload_fb)
@@ -231,7 +205,7 @@ TOOLS: List[Dict[str, Any]] = [
 # =========================
 
 def _current_user_key() -> str:
-    uid = str(st.session_state.get("user_id", "") or "").strip()
+    uid = str(session_state().get("user_id", "") or "").strip()
     return f"{uid}::laura" if uid else "anon::laura"
 
 def _compact_user_evidence(docs: List[Dict], max_chars: int = 320) -> str:
@@ -252,8 +226,13 @@ def _compact_user_evidence(docs: List[Dict], max_chars: int = 320) -> str:
 class LauraService(BaseCharacter):
     id: str = "laura"
     display_name: str = "Laura"
+    state_keys = BaseCharacter.state_keys + (
+        "laura_attr_idx",
+    )
 
     # ===== API =====
+    @metrics.timed(REPLY_SECONDS, REPLY_ERRORS, character="laura")
+    @traced("laura.reply", root=True)
     def reply(self, user: str, model: str) -> str:
         prompt = self._get_user_prompt()
         if not prompt:
@@ -276,9 +255,9 @@ class LauraService(BaseCharacter):
             "pele/calor", "respiração/ritmo", "quadris/curvas",
             "coxas grossas/toque", "bumbum/postura", "seios/decote"
         ]
-        idx = int(st.session_state.get("laura_attr_idx", -1))
+        idx = int(session_state().get("laura_attr_idx", -1))
         idx = (idx + 1) % len(pool)
-        st.session_state["laura_attr_idx"] = idx
+        session_state()["laura_attr_idx"] = idx
         foco = pool[idx]
 
         # NSFW por usuário
@@ -351,7 +330,9 @@ class LauraService(BaseCharacter):
         lore_msgs: List[Dict[str, str]] = []
         try:
             q = (prompt or "") + "\n" + (memoria_pin or "")
-            top = lore_topk(usuario_key, q, k=3, allow_tags=None)
+            with span("laura.lore", k=3) as sp:
+                top = lore_topk(usuario_key, q, k=3, allow_tags=None)
+                sp.set(hits=len(top or []))
             if top:
                 lore_text = " | ".join(d.get("texto", "") for d in top if d.get("texto"))
                 if lore_text:
@@ -360,10 +341,11 @@ class LauraService(BaseCharacter):
             pass
 
         # Histórico com orçamento por modelo
-        hist_msgs = self._montar_historico(
-            usuario_key, history_boot, model,
-            verbatim_ultimos=int(st.session_state.get("verbatim_ultimos", 10))
-        )
+        with span("laura.history"):
+            hist_msgs = self._montar_historico(
+                usuario_key, history_boot, model,
+                verbatim_ultimos=int(session_state().get("verbatim_ultimos", 10))
+            )
 
         # Messages finais
         messages: List[Dict] = (
@@ -384,7 +366,7 @@ class LauraService(BaseCharacter):
         temperature = 0.7
 
         # Tool-Calling (opcional via UI)
-        tools_to_use = TOOLS if st.session_state.get("tool_calling_on", False) else None
+        tools_to_use = TOOLS if session_state().get("tool_calling_on", False) else None
         fallbacks = [
             "together/Qwen/Qwen2.5-72B-Instruct",
             "together/meta-llama/Meta-Llama-3.1-405B-Instruct-Turbo",
@@ -397,10 +379,12 @@ class LauraService(BaseCharacter):
         texto = ""
         while iteration < max_iterations:
             iteration += 1
-            data, used_model, provider = _robust_chat_call(
-                model, messages, max_tokens=max_out, temperature=temperature, top_p=0.95,
-                fallback_models=fallbacks, tools=tools_to_use
-            )
+            with span("laura.completion", iteration=iteration, max_tokens=max_out), \
+                    purpose("main" if iteration == 1 else "tool-iteration"):
+                data, used_model, provider = _robust_chat_call(
+                    model, messages, max_tokens=max_out, temperature=temperature, top_p=0.95,
+                    fallback_models=fallbacks, tools=tools_to_use
+                )
             msg = (data.get("choices", [{}])[0].get("message", {}) or {})
             texto = (msg.get("content", "") or "").strip()
             tool_calls = msg.get("tool_calls", [])
@@ -415,7 +399,8 @@ class LauraService(BaseCharacter):
                 func_args_str = tc.get("function", {}).get("arguments", "{}")
                 try:
                     func_args = json.loads(func_args_str) if func_args_str else {}
-                    result = self._exec_tool_call(func_name, func_args, usuario_key)
+                    with span("laura.tool", tool=func_name, iteration=iteration):
+                        result = self._exec_tool_call(func_name, func_args, usuario_key)
                     messages.append({"role": "tool", "tool_call_id": tool_id, "content": result})
                 except Exception as e:
                     messages.append({"role": "tool", "tool_call_id": tool_id, "content": f"ERRO: {e}"})
@@ -426,19 +411,20 @@ class LauraService(BaseCharacter):
         except Exception:
             pass
         try:
-            lore_save(usuario_key, f"[USER] {prompt}\n[LAURA] {texto}", tags=["laura", "chat"])
+            with span("laura.lore_save"):
+                lore_save(usuario_key, f"[USER] {prompt}\n[LAURA] {texto}", tags=["laura", "chat"])
         except Exception:
             pass
         try:
-            st.session_state["suggestion_placeholder"] = self._suggest_placeholder(texto, local_atual)
-            st.session_state["last_assistant_message"] = texto
+            session_state()["suggestion_placeholder"] = self._suggest_placeholder(texto, local_atual)
+            session_state()["last_assistant_message"] = texto
         except Exception:
             pass
         try:
             if provider == "synthetic-fallback":
-                st.info("⚠️ Provedor instável. Resposta em fallback — pode continuar normalmente.")
+                notify("info", "⚠️ Provedor instável. Resposta em fallback — pode continuar normalmente.")
             elif used_model and "together/" in used_model:
-                st.caption(f"↪️ Failover automático: **{used_model}**.")
+                notify("caption", f"↪️ Failover automático: **{used_model}**.")
         except Exception:
             pass
 
@@ -447,7 +433,7 @@ class LauraService(BaseCharacter):
     # ===== utils =====
     def _exec_tool_call(self, name: str, args: dict, usuario_key: str) -> str:
         try:
-            user_display = st.session_state.get("user_id", "") or ""
+            user_display = session_state().get("user_id", "") or ""
             if name == "get_memory_pin":
                 return self._build_memory_pin(usuario_key, user_display)
             if name == "set_fact":
@@ -470,10 +456,10 @@ class LauraService(BaseCharacter):
 
     def _get_user_prompt(self) -> str:
         return (
-            st.session_state.get("chat_input")
-            or st.session_state.get("user_input")
-            or st.session_state.get("last_user_message")
-            or st.session_state.get("prompt")
+            session_state().get("chat_input")
+            or session_state().get("user_input")
+            or session_state().get("last_user_message")
+            or session_state().get("prompt")
             or ""
         ).strip()
 
@@ -517,13 +503,13 @@ class LauraService(BaseCharacter):
     ) -> List[Dict[str, str]]:
         """
         Histórico híbrido: resumo do miolo antigo + últimos N turnos verbatim.
-        Preenche st.session_state["_mem_drop_report"] para habilitar o banner ⚠️.
+        Preenche session_state()["_mem_drop_report"] para habilitar o banner ⚠️.
         """
         hist_budget, _, _ = _budget_slices(model)
 
         docs = cached_get_history(usuario_key)
         if not docs:
-            st.session_state["_mem_drop_report"] = {}
+            session_state()["_mem_drop_report"] = {}
             return history_boot[:]
 
         # 1) Constrói pares user/assistant a partir de múltiplas chaves
@@ -544,7 +530,7 @@ class LauraService(BaseCharacter):
                 pares.append({"role": "assistant", "content": a})
 
         if not pares:
-            st.session_state["_mem_drop_report"] = {}
+            session_state()["_mem_drop_report"] = {}
             return history_boot[:]
 
         # 2) Mantém últimos N turnos verbatim (≈ 2N mensagens)
@@ -577,9 +563,10 @@ class LauraService(BaseCharacter):
                     {"role": "system", "content": resumo_prompt},
                     {"role": "user", "content": resumo_src},
                 ]
-                resp, _, _ = _robust_chat_call(
-                    model=model, messages=messages_sum, max_tokens=220, temperature=0.2, top_p=0.9
-                )
+                with purpose("summary"):
+                    resp, _, _ = _robust_chat_call(
+                        model=model, messages=messages_sum, max_tokens=220, temperature=0.2, top_p=0.9
+                    )
                 resumo_txt = (resp.get("choices", [{}])[0].get("message", {}) or {}).get("content", "").strip()
             except Exception:
                 resumo_txt = ""
@@ -598,7 +585,7 @@ class LauraService(BaseCharacter):
             msgs.pop(0)
             trimmed_pairs += 1
 
-        st.session_state["_mem_drop_report"] = {
+        session_state()["_mem_drop_report"] = {
             "summarized_pairs": summarized_pairs,
             "trimmed_pairs": trimmed_pairs,
             "hist_tokens": _tok(msgs),
@@ -3,25 +3,33 @@ from .persona import get_persona
 import re
 import time
 import random
-from typing import List, Dict, Tuple, Any
+from typing import List, Dict, Tuple, Any, Optional
 import streamlit as st
 import logging
 from core.nsfw import nsfw_enabled
 from core.memoria_longa import topk as lore_topk, save_fragment as lore_save
 from core.ultra import critic_review, polish
-from core.common.base_service import BaseCharacter
+from core.common.base_service import BaseCharacter, REPLY_SECONDS, REPLY_ERRORS
+from core.session import session_state
+from core.jobs import notify
 from core.service_router import route_chat_strict, list_models
 from core.repositories import (
-    save_interaction, get_history_docs,
-    get_facts, get_fact, last_event, set_fact
+    save_interaction,
+    get_fact, last_event, set_fact,
+    get_facts_cached, get_history_docs_cached, invalidate_user,
 )
 from core.tokens import toklen
+from core.facts_snapshot import FactsSnapshot
+from core.tracing import span, traced
+from core.usage import purpose
+from core import metrics
 import json
 from characters.registry import _SERVICE_CACHE
 
 logger = logging.getLogger(__name__)
 
 
+
 def _log_error(context: str, exc: Exception) -> None:
     """
     Loga erros de forma padronizada, tanto em log interno quanto (opcionalmente)
@@ -38,8 +46,8 @@ def _log_error(context: str, exc: Exception) -> None:
 
     # Feedback visual opcional em modo debug
     try:
-        if st.session_state.get("mary_debug_errors"):
-            st.error(msg)
+        if session_state().get("mary_debug_errors"):
+            notify("error", msg)
     except Exception:
         # Se o Streamlit não estiver pronto ou fora de contexto, ignora
         pass
@@ -127,8 +135,8 @@ def _current_user_key() -> str:
     Isso precisa bater com o que o main.py usa em save_interaction / set_fact.
     """
     uid = (
-        st.session_state.get("user_id")
-        or st.session_state.get("usuario")
+        session_state().get("user_id")
+        or session_state().get("usuario")
         or ""
     )
     uid = str(uid).strip() or "anon"
@@ -137,46 +145,29 @@ def _current_user_key() -> str:
 
 def cached_get_facts(usuario_key: str) -> Dict[str, Any]:
     """
-    Cache leve em session_state para facts da Mary.
+    Facts da Mary via cache compartilhado (core.cache: LRU+TTL, invalidado por set_fact).
     """
-    cache_key = f"facts::{usuario_key}"
-    if cache_key in st.session_state:
-        return st.session_state[cache_key]
     try:
-        f = get_facts(usuario_key) or {}
+        return get_facts_cached(usuario_key) or {}
     except Exception:
-        f = {}
-    st.session_state[cache_key] = f
-    return f
+        return {}
 
 
 def clear_user_cache(usuario_key: str):
     """
     Limpa cache leve para forçar reload de facts/histórico após alterações.
     """
-    fk = f"facts::{usuario_key}"
-    if fk in st.session_state:
-        del st.session_state[fk]
-
-    hk = f"history::{usuario_key}"
-    if hk in st.session_state:
-        del st.session_state[hk]
+    invalidate_user(usuario_key)
 
 
 def cached_get_history(usuario_key: str):
     """
-    Cache para histórico bruto (docs do Mongo) usando
-    a mesma chave interna "<user_id>::mary".
+    Histórico bruto (docs do Mongo) via cache compartilhado, mesma chave "<user_id>::mary".
     """
-    hk = f"history::{usuario_key}"
-    if hk in st.session_state:
-        return st.session_state[hk]
     try:
-        docs = get_history_docs(usuario_key) or []
+        return get_history_docs_cached(usuario_key) or []
     except Exception:
-        docs = []
-    st.session_state[hk] = docs
-    return docs
+        return []
 
 
 # ==============================================
@@ -203,9 +194,9 @@ def _prefs_line(prefs: Dict[str, str]) -> str:
     )
 
 
-def _enabled(usuario_key: str) -> bool:
+def _enabled(usuario_key: str, snap: Optional[FactsSnapshot] = None) -> bool:
     try:
-        v = get_fact(usuario_key, "_on", False)
+        v = snap.get("_on", False) if snap is not None else get_fact(usuario_key, "_on", False)
     except Exception:
         v = False
     if isinstance(v, bool):
@@ -264,6 +255,8 @@ def _budget_slices(model_id: str) -> Tuple[int, int, int]:
 # ==============================================
 # 5) Summarizer auxiliar para históricos longos
 # ==============================================
+@traced("mary.llm_summarize")
+@purpose("summary")
 def _llm_summarize(model_id: str, text: str) -> str:
     """
     Usa o mesmo roteador de LLMs para gerar um resumo curto.
@@ -554,7 +547,7 @@ def _mem_drop_warn(report: Dict[str, Any]):
     hist_tokens = report.get("hist_tokens", 0)
     hist_budget = report.get("hist_budget", 0)
     if summarized or trimmed:
-        st.caption(
+        notify("caption",
             f"🧠 Memória ajustada: {summarized} pares antigos resumidos, {trimmed} blocos verbatim podados. "
             f"(histórico: {hist_tokens}/{hist_budget} tokens). Se notar esquecimentos, peça um 'recap curto' "
             "ou fixe fatos na Memória Canônica."
@@ -622,7 +615,7 @@ def _robust_chat_call(
         data, used_model, prov = route_chat_strict(model, body)
         return data, used_model, prov
     except Exception as e:
-        st.warning(f"⚠️ Modelo principal falhou ({model}): {e}")
+        notify("warning", f"⚠️ Modelo principal falhou ({model}): {e}")
 
     for fb in fallback_models:
         try:
@@ -630,7 +623,7 @@ def _robust_chat_call(
             data, used_model, prov = route_chat_strict(fb, body)
             return data, used_model, prov
         except Exception as e:
-            st.warning(f"⚠️ Fallback falhou ({fb}): {e}")
+            notify("warning", f"⚠️ Fallback falhou ({fb}): {e}")
 
     return {
         "choices": [{
@@ -659,11 +652,12 @@ def _detect_thematic_tags_from_prompt(prompt: str) -> List[str]:
     return tags
 
 
-def _get_thematic_memories_for_tags(usuario_key: str, tags: List[str]) -> str:
+def _get_thematic_memories_for_tags(usuario_key: str, tags: List[str],
+                                    snap: Optional[FactsSnapshot] = None) -> str:
     if not tags:
         return ""
     try:
-        f = cached_get_facts(usuario_key) or {}
+        f = snap.facts if snap is not None else (cached_get_facts(usuario_key) or {})
     except Exception:
         f = {}
     blocos = []
@@ -787,10 +781,14 @@ Beijo teu pescoço devagar e sussurro: 'Que delícia, amor... você me deixa lou
 class MaryService(BaseCharacter):
     id: str = "mary"
     display_name: str = "Mary"
+    state_keys = BaseCharacter.state_keys + (
+        "mary_attr_idx", "momento_atual", "ultra_ia_on", "ultra_critic_model", "usuario",
+        "last_saved_mary_event_key", "last_saved_mary_event_val", "mary_debug_errors",
+    )
 
     def _exec_tool_call(self, name: str, args: dict, usuario_key: str) -> str:
         try:
-            user_display = st.session_state.get("user_id", "") or ""
+            user_display = session_state().get("user_id", "") or ""
 
             if name == "get_memory_pin":
                 return self._build_memory_pin(usuario_key, user_display)
@@ -854,6 +852,8 @@ class MaryService(BaseCharacter):
 
 
 
+    @metrics.timed(REPLY_SECONDS, REPLY_ERRORS, character="mary")
+    @traced("mary.reply", root=True)
     def reply(self, user: str, model: str) -> str:
         prompt = self._get_user_prompt()
         if not prompt:
@@ -881,9 +881,6 @@ class MaryService(BaseCharacter):
             "/reset histórico mary",
         ):
             try:
-                hk = f"history::{usuario_key}"
-                st.session_state[hk] = []
-
                 set_fact(
                     usuario_key,
                     "mary.rs.v2",
@@ -900,7 +897,7 @@ class MaryService(BaseCharacter):
                 clear_user_cache(usuario_key)
 
                 hist_budget, meta_budget, safety_budget = _budget_slices(model)
-                st.session_state["_mem_drop_report"] = {
+                session_state()["_mem_drop_report"] = {
                     "summarized_pairs": 0,
                     "trimmed_pairs": 0,
                     "hist_tokens": 0,
@@ -1000,31 +997,31 @@ class MaryService(BaseCharacter):
                # === Persona + memórias base ===
         persona_text, history_boot = self._load_persona()
 
-        try:
-            f_all = cached_get_facts(usuario_key) or {}
-        except Exception:
-            f_all = {}
-        prefs = _read_prefs(f_all)
-        memoria_pin = self._build_memory_pin(usuario_key, user)
+        # Snapshot do turno: facts (1 find_one) + eventos (1 find), repassado a todos os helpers
+        with span("mary.context"):
+            snap = FactsSnapshot.load(usuario_key)
+            f_all = snap.facts
+            prefs = _read_prefs(f_all)
+            memoria_pin = self._build_memory_pin(usuario_key, user, snap=snap)
 
-        # Memória temática por tags (ciúme, gravidez, etc.)
-        thematic_tags = _detect_thematic_tags_from_prompt(prompt)
-        thematic_block = _get_thematic_memories_for_tags(usuario_key, thematic_tags)
+            # Memória temática por tags (ciúme, gravidez, etc.)
+            thematic_tags = _detect_thematic_tags_from_prompt(prompt)
+            thematic_block = _get_thematic_memories_for_tags(usuario_key, thematic_tags, snap=snap)
 
         # Foco sensorial rotativo
         pool = [
             "cabelo", "olhos", "lábios/boca", "mãos/toque", "respiração",
             "perfume", "pele/temperatura", "quadril/coxas", "voz/timbre", "sorriso"
         ]
-        idx = int(st.session_state.get("mary_attr_idx", -1))
+        idx = int(session_state().get("mary_attr_idx", -1))
         idx = (idx + 1) % len(pool)
-        st.session_state["mary_attr_idx"] = idx
+        session_state()["mary_attr_idx"] = idx
         foco = pool[idx]
 
         # ==== NSFW (core/nsfw.py) + botão do sidebar ====
-        local_atual = self._safe_get_local(usuario_key)
+        local_atual = self._safe_get_local(usuario_key, snap)
         try:
-            nsfw_on = bool(nsfw_enabled(usuario_key, local_atual))
+            nsfw_on = bool(nsfw_enabled(usuario_key, local_atual, snapshot=snap))
         except Exception:
             nsfw_on = True  # fallback: libera se der erro
 
@@ -1050,7 +1047,7 @@ class MaryService(BaseCharacter):
             persona_text = f"{persona_text}\n\n{SAFE_SENSUAL_PROMPT}"
         # ==== FIM BLOCO NSFW ====
 
-        rolling = self._get_rolling_summary(usuario_key)
+        rolling = self._get_rolling_summary(usuario_key, snap)
         entities_line = _entities_to_line(f_all)
 
         try:
@@ -1068,7 +1065,7 @@ class MaryService(BaseCharacter):
             entities_line=entities_line,
             evidence=evidence,
             prefs_line=_prefs_line(prefs),
-            scene_time=st.session_state.get("momento_atual", "")
+            scene_time=session_state().get("momento_atual", "")
         )
 
         entities_line = _entities_to_line(f_all)
@@ -1088,7 +1085,7 @@ class MaryService(BaseCharacter):
             entities_line=entities_line,
             evidence=evidence,
             prefs_line=_prefs_line(prefs),
-            scene_time=st.session_state.get("momento_atual", "")
+            scene_time=session_state().get("momento_atual", "")
         )
 
 
@@ -1096,7 +1093,9 @@ class MaryService(BaseCharacter):
         lore_msgs: List[Dict[str, str]] = []
         try:
             q = (prompt or "") + "\n" + (rolling or "")
-            top = lore_topk(usuario_key, q, k=4, allow_tags=None)
+            with span("mary.lore", k=4) as sp:
+                top = lore_topk(usuario_key, q, k=4, allow_tags=None)
+                sp.set(hits=len(top or []))
             if top:
                 lore_text = " | ".join(d.get("texto", "") for d in top if d.get("texto"))
                 if lore_text:
@@ -1104,13 +1103,14 @@ class MaryService(BaseCharacter):
         except Exception:
             pass
 
-        verbatim_ultimos = int(st.session_state.get("verbatim_ultimos", 30))
-        hist_msgs = self._montar_historico(
-            usuario_key,
-            history_boot,
-            model,
-            verbatim_ultimos=verbatim_ultimos,
-        )
+        verbatim_ultimos = int(session_state().get("verbatim_ultimos", 30))
+        with span("mary.history", verbatim=verbatim_ultimos):
+            hist_msgs = self._montar_historico(
+                usuario_key,
+                history_boot,
+                model,
+                verbatim_ultimos=verbatim_ultimos,
+            )
 
         eventos_block = ""
         try:
@@ -1164,7 +1164,7 @@ class MaryService(BaseCharacter):
 
 
         try:
-            _mem_drop_warn(st.session_state.get("_mem_drop_report", {}))
+            _mem_drop_warn(session_state().get("_mem_drop_report", {}))
         except Exception as e:
             _log_error("reply.mem_drop_warn", e)
 
@@ -1189,7 +1189,7 @@ class MaryService(BaseCharacter):
             "anthropic/claude-3.5-haiku",
         ]
         tools_to_use = None
-        if st.session_state.get("tool_calling_on", False):
+        if session_state().get("tool_calling_on", False):
             tools_to_use = TOOLS
 
         max_iterations = 3
@@ -1202,24 +1202,27 @@ class MaryService(BaseCharacter):
         while iteration < max_iterations:
             iteration += 1
 
-            data, used_model, provider = _robust_chat_call(
-                model,
-                messages,
-                max_tokens=max_out,
-                temperature=temperature,
-                top_p=0.95,
-                fallback_models=fallbacks,
-                tools=tools_to_use,
-            )
+            with span("mary.completion", iteration=iteration, max_tokens=max_out) as sp, \
+                    purpose("main" if iteration == 1 else "tool-iteration"):
+                data, used_model, provider = _robust_chat_call(
+                    model,
+                    messages,
+                    max_tokens=max_out,
+                    temperature=temperature,
+                    top_p=0.95,
+                    fallback_models=fallbacks,
+                    tools=tools_to_use,
+                )
+                sp.set(model=used_model, provider=provider)
 
             msg = (data.get("choices", [{}])[0].get("message", {}) or {})
             texto = (msg.get("content", "") or "").strip()
             tool_calls = msg.get("tool_calls", [])
 
-            if not tool_calls or not st.session_state.get("tool_calling_on", False):
+            if not tool_calls or not session_state().get("tool_calling_on", False):
                 break
 
-            st.caption(f"🔧 Executando {len(tool_calls)} ferramenta(s)...")
+            notify("caption", f"🔧 Executando {len(tool_calls)} ferramenta(s)...")
 
             messages.append({
                 "role": "assistant",
@@ -1234,7 +1237,8 @@ class MaryService(BaseCharacter):
 
                 try:
                     func_args = json.loads(func_args_str) if func_args_str else {}
-                    result = self._exec_tool_call(func_name, func_args, usuario_key)
+                    with span("mary.tool", tool=func_name, iteration=iteration):
+                        result = self._exec_tool_call(func_name, func_args, usuario_key)
 
                     messages.append({
                         "role": "tool",
@@ -1242,7 +1246,7 @@ class MaryService(BaseCharacter):
                         "content": result,
                     })
 
-                    st.caption(f"  ✓ {func_name}: {result[:50]}...")
+                    notify("caption", f"  ✓ {func_name}: {result[:50]}...")
 
                 except Exception as e:
                     _log_error(f"tool_exec::{func_name}", e)
@@ -1252,16 +1256,18 @@ class MaryService(BaseCharacter):
                         "tool_call_id": tool_id,
                         "content": error_msg,
                     })
-                    st.warning(f"⚠️ {error_msg}")
+                    notify("warning", f"⚠️ {error_msg}")
 
-        if iteration >= max_iterations and st.session_state.get("tool_calling_on", False):
-            st.warning("⚠️ Limite de iterações de Tool Calling atingido. Resposta pode estar incompleta.")
+        if iteration >= max_iterations and session_state().get("tool_calling_on", False):
+            notify("warning", "⚠️ Limite de iterações de Tool Calling atingido. Resposta pode estar incompleta.")
 
         try:
-            if bool(st.session_state.get("ultra_ia_on", False)) and texto:
-                critic_model = st.session_state.get("ultra_critic_model", model) or model
-                notes = critic_review(critic_model, system_block, prompt, texto)
-                texto = polish(model, system_block, prompt, texto, notes)
+            if bool(session_state().get("ultra_ia_on", False)) and texto:
+                critic_model = session_state().get("ultra_critic_model", model) or model
+                with span("mary.critic", model=critic_model):
+                    notes = critic_review(critic_model, system_block, prompt, texto)
+                with span("mary.polish", model=model):
+                    texto = polish(model, system_block, prompt, texto, notes)
         except Exception as e:
             _log_error("reply.ultra_ia", e)
 
@@ -1289,7 +1295,7 @@ class MaryService(BaseCharacter):
         plow = prompt.lower()
 
         if any(t in plow for t in mem_triggers):
-            st.caption(
+            notify("caption",
                 "🧠 O sistema antigo de gravação automática foi desativado. "
                 "Agora Mary decide quando usar a ferramenta `save_event` "
                 "para registrar eventos realmente importantes na memória fixa."
@@ -1301,27 +1307,27 @@ class MaryService(BaseCharacter):
             _log_error("reply.extract_and_store_entities", e)
 
         try:
-            self._update_rolling_summary_v2(usuario_key, model, prompt, texto)
+            self._update_rolling_summary_v2(usuario_key, model, prompt, texto, snap=snap)
         except Exception as e:
             _log_error("reply.update_rolling_summary_v2", e)
 
 
         try:
             ph = self._suggest_placeholder(texto, local_atual)
-            st.session_state["suggestion_placeholder"] = ph
-            st.session_state["last_assistant_message"] = texto
+            session_state()["suggestion_placeholder"] = ph
+            session_state()["last_assistant_message"] = texto
         except Exception:
-            st.session_state["suggestion_placeholder"] = ""
+            session_state()["suggestion_placeholder"] = ""
 
         try:
             if provider == "synthetic-fallback":
-                st.info("⚠️ Provedor instável. Resposta em fallback — pode continuar normalmente.")
+                notify("info", "⚠️ Provedor instável. Resposta em fallback — pode continuar normalmente.")
             elif used_model and "together/" in used_model:
-                st.caption(f"↪️ Failover automático: **{used_model}**.")
+                notify("caption", f"↪️ Failover automático: **{used_model}**.")
         except Exception:
             pass
 
-        if st.session_state.get("json_mode_on", False):
+        if session_state().get("json_mode_on", False):
             try:
                 payload = {
                     "role": "assistant",
@@ -1339,22 +1345,25 @@ class MaryService(BaseCharacter):
 
     def _get_user_prompt(self) -> str:
         return (
-            st.session_state.get("chat_input")
-            or st.session_state.get("user_input")
-            or st.session_state.get("last_user_message")
-            or st.session_state.get("prompt")
+            session_state().get("chat_input")
+            or session_state().get("user_input")
+            or session_state().get("last_user_message")
+            or session_state().get("prompt")
             or ""
         ).strip()
 
-    def _safe_get_local(self, usuario_key: str) -> str:
+    def _safe_get_local(self, usuario_key: str, snap: Optional[FactsSnapshot] = None) -> str:
         try:
+            if snap is not None:
+                return str(snap.get("local_cena_atual", "") or "")
             return get_fact(usuario_key, "local_cena_atual", "") or ""
         except Exception:
             return ""
 
-    def _build_memory_pin(self, usuario_key: str, user_display: str) -> str:
+    def _build_memory_pin(self, usuario_key: str, user_display: str,
+                          snap: Optional[FactsSnapshot] = None) -> str:
         try:
-            f = cached_get_facts(usuario_key) or {}
+            f = snap.facts if snap is not None else (cached_get_facts(usuario_key) or {})
         except Exception:
             f = {}
 
@@ -1440,7 +1449,7 @@ class MaryService(BaseCharacter):
             blocos.append(f"entidades=({ent_line})")
 
         try:
-            ev = last_event(usuario_key, "primeira_vez")
+            ev = snap.last_event("primeira_vez") if snap is not None else last_event(usuario_key, "primeira_vez")
         except Exception:
             ev = None
         if ev:
@@ -1473,7 +1482,7 @@ class MaryService(BaseCharacter):
 
         docs = cached_get_history(usuario_key)
         if not docs:
-            st.session_state["_mem_drop_report"] = {}
+            session_state()["_mem_drop_report"] = {}
             return history_boot[:]
 
         pares: List[Dict[str, str]] = []
@@ -1486,7 +1495,7 @@ class MaryService(BaseCharacter):
                 pares.append({"role": "assistant", "content": a})
 
         if not pares:
-            st.session_state["_mem_drop_report"] = {}
+            session_state()["_mem_drop_report"] = {}
             return history_boot[:]
 
         keep = max(0, verbatim_ultimos * 2)
@@ -1531,7 +1540,7 @@ class MaryService(BaseCharacter):
             msgs = [m for m in msgs if m["role"] == "system"] + verbatim
 
         hist_tokens = _hist_tokens(msgs)
-        st.session_state["_mem_drop_report"] = {
+        session_state()["_mem_drop_report"] = {
             "summarized_pairs": summarized_pairs,
             "trimmed_pairs": trimmed_pairs,
             "hist_tokens": hist_tokens,
@@ -1541,16 +1550,17 @@ class MaryService(BaseCharacter):
         return msgs if msgs else history_boot[:]
 
     # ===== Rolling summary helpers =====
-    def _get_rolling_summary(self, usuario_key: str) -> str:
+    def _get_rolling_summary(self, usuario_key: str, snap: Optional[FactsSnapshot] = None) -> str:
         try:
-            f = cached_get_facts(usuario_key) or {}
+            f = snap.facts if snap is not None else (cached_get_facts(usuario_key) or {})
             return str(f.get("mary.rs.v2", "") or f.get("mary.rolling_summary", "") or "")
         except Exception:
             return ""
 
-    def _should_update_summary(self, usuario_key: str, last_user: str, last_assistant: str) -> bool:
+    def _should_update_summary(self, usuario_key: str, last_user: str, last_assistant: str,
+                               snap: Optional[FactsSnapshot] = None) -> bool:
         try:
-            f = cached_get_facts(usuario_key)
+            f = snap.facts if snap is not None else cached_get_facts(usuario_key)
             last_summary = f.get("mary.rs.v2", "")
             last_update_ts = float(f.get("mary.rs.v2.ts", 0))
             now = time.time()
@@ -1564,18 +1574,21 @@ class MaryService(BaseCharacter):
         except Exception:
             return True
 
+    @traced("mary.rolling_summary")
+    @purpose("summary")
     def _update_rolling_summary_v2(
         self,
         usuario_key: str,
         model: str,
         last_user: str,
-        last_assistant: str
+        last_assistant: str,
+        snap: Optional[FactsSnapshot] = None,
     ) -> None:
-        if not self._should_update_summary(usuario_key, last_user, last_assistant):
+        if not self._should_update_summary(usuario_key, last_user, last_assistant, snap=snap):
             return
 
         try:
-            f = cached_get_facts(usuario_key) or {}
+            f = snap.facts if snap is not None else (cached_get_facts(usuario_key) or {})
             resumo_anterior = str(f.get("mary.rs.v2", "") or "")
             ts_anterior = float(f.get("mary.rs.v2.ts", 0) or 0)
         except Exception:
@@ -1617,9 +1630,13 @@ class MaryService(BaseCharacter):
                 .get("message", {}) or {}
             ).get("content", "").strip()
             if resumo_novo:
-                set_fact(usuario_key, "mary.rs.v2", resumo_novo, {"fonte": "auto_summary"})
-                set_fact(usuario_key, "mary.rs.v2.ts", time.time(), {"fonte": "auto_summary"})
-                clear_user_cache(usuario_key)
+                if snap is not None:
+                    snap.set("mary.rs.v2", resumo_novo, {"fonte": "auto_summary"})
+                    snap.set("mary.rs.v2.ts", time.time(), {"fonte": "auto_summary"})
+                else:
+                    set_fact(usuario_key, "mary.rs.v2", resumo_novo, {"fonte": "auto_summary"})
+                    set_fact(usuario_key, "mary.rs.v2.ts", time.time(), {"fonte": "auto_summary"})
+                    clear_user_cache(usuario_key)
         except Exception:
             return
 
@@ -1669,20 +1686,20 @@ class MaryService(BaseCharacter):
 
         json_on = container.checkbox(
             "JSON Mode",
-            value=bool(st.session_state.get("json_mode_on", False))
+            value=bool(session_state().get("json_mode_on", False))
         )
         tool_on = container.checkbox(
             "Tool-Calling",
-            value=bool(st.session_state.get("tool_calling_on", False))
+            value=bool(session_state().get("tool_calling_on", False))
         )
-        st.session_state["json_mode_on"] = json_on
-        st.session_state["tool_calling_on"] = tool_on
+        session_state()["json_mode_on"] = json_on
+        session_state()["tool_calling_on"] = tool_on
 
         lora = container.text_input(
             "Adapter ID (Together LoRA) — opcional",
-            value=st.session_state.get("together_lora_id", "")
+            value=session_state().get("together_lora_id", "")
         )
-        st.session_state["together_lora_id"] = lora
+        session_state()["together_lora_id"] = lora
 
         if ent and ent != "—":
             container.caption(f"Entidades salvas: {ent}")
@@ -1711,8 +1728,8 @@ class MaryService(BaseCharacter):
 
             eventos = _collect_mary_events_from_facts(f_all)
 
-            last_key = st.session_state.get("last_saved_mary_event_key", "")
-            last_val = st.session_state.get("last_saved_mary_event_val", "")
+            last_key = session_state().get("last_saved_mary_event_key", "")
+            last_val = session_state().get("last_saved_mary_event_val", "")
             if last_key:
                 short = last_key.replace("mary.evento.", "")
                 if short not in eventos:
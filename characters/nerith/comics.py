@@ -3,11 +3,12 @@
 # ============================================================
 from __future__ import annotations
 import os, io, re
-from typing import Callable, List, Dict, Tuple, Optional
-from PIL import Image
-from huggingface_hub import InferenceClient
+from typing import TYPE_CHECKING, Callable, List, Dict, Tuple, Optional
 import streamlit as st
 
+if TYPE_CHECKING:  # Pillow/huggingface_hub só carregam ao gerar um quadrinho
+    from huggingface_hub import InferenceClient
+
 # ============================================================
 # PROVIDERS (Modelos disponíveis)
 # ============================================================
@@ -115,6 +116,8 @@ def _get_hf_token() -> str:
     return tok.strip()
 
 def get_client(provider: str) -> InferenceClient:
+    from huggingface_hub import InferenceClient
+
     pv = (provider or "").strip().lower()
     token = _get_hf_token()
     if pv in ("huggingface-nscale", "nscale", "hf-nscale"):
@@ -443,6 +446,8 @@ def render_comic_button(
                 )
 
         # Renderização
+        from PIL import Image
+
         img = Image.open(io.BytesIO(img_data)) if isinstance(img_data, (bytes, bytearray)) else img_data
         ui.image(img, caption=f"Preset: {preset_name}", use_column_width=True)
 
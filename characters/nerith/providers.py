@@ -1,9 +1,11 @@
 # characters/nerith/providers.py
 from __future__ import annotations
 import os
-from typing import Dict, Tuple, Optional
+from typing import TYPE_CHECKING, Dict, Tuple, Optional
 import streamlit as st
-from huggingface_hub import InferenceClient
+
+if TYPE_CHECKING:
+    from huggingface_hub import InferenceClient
 
 # ==========================
 # Catálogo de provedores/modelos
@@ -107,6 +109,8 @@ def get_client(provider: Optional[str]) -> InferenceClient:
     - "fal-ai": usa token HF normal (router faz o proxy)
     - default ("huggingface"): token normal
     """
+    from huggingface_hub import InferenceClient
+
     pv = (provider or "").lower().strip()
     token = _get_hf_token()
     if pv in ("huggingface-nscale", "nscale", "hf-nscale"):
@@ -1,6 +1,5 @@
 # characters/nerith/sdxl_nscale.py
 
-from huggingface_hub import InferenceClient
 import os
 import time
 import pathlib
@@ -14,6 +13,7 @@ def generate_sdxl_nscale(
     Gera imagem usando SDXL via HuggingFace (provider=nscale).
     Funciona 100% remoto, incluindo no Streamlit Cloud.
     """
+    from huggingface_hub import InferenceClient
 
     client = InferenceClient(
         provider="nscale",
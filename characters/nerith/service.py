@@ -4,17 +4,23 @@ from __future__ import annotations
 from .comics import render_comic_button
 import re, time, random, json
 from typing import List, Dict, Tuple, Optional
-import streamlit as st
 
 # ==== Núcleo do projeto (mantém seus imports originais) ====
-from core.common.base_service import BaseCharacter
+from core.common.base_service import BaseCharacter, REPLY_SECONDS, REPLY_ERRORS
+from core.session import session_state
 from core.service_router import route_chat_strict
-from core.memoria_longa import topk as lore_topk, save_fragment as lore_save
+from core.jobs import notify
+from core.memoria_longa import topk as lore_topk, hybrid_topk as lore_hybrid, save_fragment as lore_save
 from core.ultra import critic_review, polish
 from core.repositories import (
-    save_interaction, get_history_docs, get_facts, get_fact, last_event, set_fact
+    save_interaction, get_fact, last_event, set_fact,
+    get_facts_cached, get_history_docs_cached, invalidate_user,
 )
 from core.tokens import toklen
+from core.tracing import span, traced
+from core.usage import purpose
+from core import metrics
+
 
 # ==== Janela/Orçamento por modelo ====
 MODEL_WINDOWS = {
@@ -67,47 +73,21 @@ except Exception:
         return txt, history_boot
 
 # ==== CACHE LEVE ====
-CACHE_TTL = int(st.secrets.get("CACHE_TTL", 30))
-_cache_facts: Dict[str, Dict] = {}
-_cache_history: Dict[str, List[Dict]] = {}
-_cache_ts: Dict[str, float] = {}
-
-def _purge_expired_cache():
-    now = time.time()
-    for k in list(_cache_facts.keys()):
-        if now - _cache_ts.get(f"facts_{k}", 0) >= CACHE_TTL:
-            _cache_facts.pop(k, None); _cache_ts.pop(f"facts_{k}", None)
-    for k in list(_cache_history.keys()):
-        if now - _cache_ts.get(f"hist_{k}", 0) >= CACHE_TTL:
-            _cache_history.pop(k, None); _cache_ts.pop(f"hist_{k}", None)
-
+# (core.cache: LRU+TTL compartilhado entre personagens, invalidado pelos repositórios)
 def clear_user_cache(user_key: str):
-    _cache_facts.pop(user_key, None); _cache_ts.pop(f"facts_{user_key}", None)
-    _cache_history.pop(user_key, None); _cache_ts.pop(f"hist_{user_key}", None)
+    invalidate_user(user_key)
 
 def cached_get_facts(user_key: str) -> Dict:
-    _purge_expired_cache()
-    now = time.time()
-    if user_key in _cache_facts and (now - _cache_ts.get(f"facts_{user_key}", 0) < CACHE_TTL):
-        return _cache_facts[user_key]
     try:
-        f = get_facts(user_key) or {}
+        return get_facts_cached(user_key) or {}
     except Exception:
-        f = {}
-    _cache_facts[user_key] = f; _cache_ts[f"facts_{user_key}"] = now
-    return f
+        return {}
 
 def cached_get_history(user_key: str) -> List[Dict]:
-    _purge_expired_cache()
-    now = time.time()
-    if user_key in _cache_history and (now - _cache_ts.get(f"hist_{user_key}", 0) < CACHE_TTL):
-        return _cache_history[user_key]
     try:
-        docs = get_history_docs(user_key) or []
+        return get_history_docs_cached(user_key) or []
     except Exception:
-        docs = []
-    _cache_history[user_key] = docs; _cache_ts[f"hist_{user_key}"] = now
-    return docs
+        return []
 
 # ==== Preferências (opcional) ====
 def _read_prefs(facts: Dict) -> Dict:
@@ -138,6 +118,8 @@ def _heuristic_summarize(texto: str, max_bullets: int = 10) -> str:
     sent = [s.strip() for s in sent if s.strip()]
     return " • " + "\n • ".join(sent[:max_bullets])
 
+@traced("nerith.llm_summarize")
+@purpose("summary")
 def _llm_summarize(model: str, user_chunk: str) -> str:
     seed = ("Resuma em 6–10 frases telegráficas; fatos duráveis (decisões, nomes, locais, relação/rumo). "
             "Proibido diálogo literal.")
@@ -195,9 +177,9 @@ def _robust_chat_call(
                 "temperature": temperature, "top_p": top_p
             }
             if tools: payload["tools"] = tools
-            if st.session_state.get("json_mode_on", False):
+            if session_state().get("json_mode_on", False):
                 payload["response_format"] = {"type": "json_object"}
-            adapter_id = (st.session_state.get("together_lora_id") or "").strip()
+            adapter_id = (session_state().get("together_lora_id") or "").strip()
             if adapter_id and (model or "").startswith("together/"):
                 payload["adapter_id"] = adapter_id
             return route_chat_strict(model, payload)
@@ -214,9 +196,9 @@ def _robust_chat_call(
                     "temperature": temperature, "top_p": top_p
                 }
                 if tools: payload_fb["tools"] = tools
-                if st.session_state.get("json_mode_on", False):
+                if session_state().get("json_mode_on", False):
                     payload_fb["response_format"] = {"type": "json_object"}
-                adapter_id = (st.session_state.get("together_lora_id") or "").strip()
+                adapter_id = (session_state().get("together_lora_id") or "").strip()
                 if adapter_id and (fb or "").startswith("together/"):
                     payload_fb["adapter_id"] = adapter_id
                 return route_chat_strict(fb, payload_fb)
@@ -247,7 +229,7 @@ def _mem_drop_warn(report: dict) -> None:
         if summarized: msg.append(f"**{summarized}** turnos antigos **resumidos**")
         if trimmed:    msg.append(f"**{trimmed}** pares verbatim **podados**")
         txt = " e ".join(msg)
-        st.info(f"⚠️ Memória ajustada: {txt}. (histórico: {hist_tokens}/{hist_budget} tokens).", icon="⚠️")
+        notify("info", f"⚠️ Memória ajustada: {txt}. (histórico: {hist_tokens}/{hist_budget} tokens).", icon="⚠️")
 
 # ==== Tools (opcional) ====
 TOOLS = [
@@ -279,7 +261,7 @@ TOOLS = [
 
 # ==== User key ====
 def _current_user_key() -> str:
-    uid = str(st.session_state.get("user_id", "") or "").strip()
+    uid = str(session_state().get("user_id", "") or "").strip()
     return f"{uid}::nerith" if uid else "anon::nerith"
 
 
@@ -287,6 +269,11 @@ def _current_user_key() -> str:
 class NerithService(BaseCharacter):
     id: str = "nerith"
     display_name: str = "Nerith"
+    state_keys = BaseCharacter.state_keys + (
+        "nerith_attr_idx", "nerith_missao", "nerith_recall_inject", "nerith_recall_kw",
+        "momento_atual", "ultra_ia_on", "ultra_critic_model", "force_boot", "reset_persona",
+        "_nerith_boot_persistido", "last_saved_nerith_event_key", "last_saved_nerith_event_val",
+    )
 
     # ===== Evidência concisa =====
     def _compact_user_evidence(self, docs: List[Dict], max_chars: int = 320) -> str:
@@ -322,14 +309,15 @@ class NerithService(BaseCharacter):
     def _recall_lore_text(self, usuario_key: str, keyword: str) -> str:
         """
         Busca memória longa por palavra-chave e retorna texto para injetar como [LORE:RECALL].
-        keyword="__LAST__" usa a última memória salva nesta sessão; senão, busca semântica (lore_topk).
+        keyword="__LAST__" usa a última memória salva nesta sessão; senão, busca híbrida
+        (BM25 + vetor, lore_hybrid) — nomes próprios como "Elysarix" casam por palavra-chave.
         """
         if keyword == "__LAST__":
-            last_val = (st.session_state.get("last_saved_nerith_event_val", "") or "").strip()
+            last_val = (session_state().get("last_saved_nerith_event_val", "") or "").strip()
             if last_val:
                 return last_val[:1500]
         try:
-            top = lore_topk(usuario_key, keyword, k=4, allow_tags=None)
+            top = lore_hybrid(usuario_key, keyword, k=4, allow_tags=None)
             blocos = []
             for d in top or []:
                 txt = (d.get("texto", "") or "").strip()
@@ -340,6 +328,8 @@ class NerithService(BaseCharacter):
         except Exception:
             return ""
 
+    @metrics.timed(REPLY_SECONDS, REPLY_ERRORS, character="nerith")
+    @traced("nerith.reply", root=True)
     def reply(self, user: str, model: str) -> str:
         prompt = self._get_user_prompt()
         usuario_key = _current_user_key()
@@ -347,8 +337,8 @@ class NerithService(BaseCharacter):
         persona_text, history_boot = self._load_persona()
 
         # reset/colar boot via sidebar
-        reset_flag = bool(st.session_state.get("reset_persona", False)
-                          or st.session_state.get("force_boot", False))
+        reset_flag = bool(session_state().get("reset_persona", False)
+                          or session_state().get("force_boot", False))
 
         # facts/prefs
         try: f_all = cached_get_facts(usuario_key) or {}
@@ -363,8 +353,8 @@ class NerithService(BaseCharacter):
 
         # foco sensorial (rotativo leve)
         pool = ["calor da pele","brilho azul","respiração","perfume","toque das mãos","timbre da voz"]
-        idx = (int(st.session_state.get("nerith_attr_idx", -1)) + 1) % len(pool)
-        st.session_state["nerith_attr_idx"] = idx
+        idx = (int(session_state().get("nerith_attr_idx", -1)) + 1) % len(pool)
+        session_state()["nerith_attr_idx"] = idx
         foco = pool[idx]
 
         # NSFW nuance
@@ -389,18 +379,19 @@ class NerithService(BaseCharacter):
         # ===== Recall automático com base no prompt (opcional)
         kw_auto = self._extract_recall_query(prompt)
         if kw_auto:
-            st.session_state["nerith_recall_inject"] = self._recall_lore_text(usuario_key, kw_auto)
+            with span("nerith.recall", query_chars=len(kw_auto)):
+                session_state()["nerith_recall_inject"] = self._recall_lore_text(usuario_key, kw_auto)
 
         # system único
         system_block = _build_system_block(
             persona_text=persona_text, rolling_summary=rolling, sensory_focus=foco,
             nsfw_hint=nsfw_hint, scene_loc=local_atual or "—", entities_line=entities_line,
             evidence=evidence, prefs_line=_prefs_line(prefs),
-            scene_time=st.session_state.get("momento_atual","")
+            scene_time=session_state().get("momento_atual","")
         )
 
         # ===== Recall acionado via sidebar/tool (injeta antes do LORE automático)
-        recall_text = (st.session_state.pop("nerith_recall_inject", "") or "").strip()
+        recall_text = (session_state().pop("nerith_recall_inject", "") or "").strip()
 
         # LORE (memória longa)
         lore_msgs: List[Dict[str, str]] = []
@@ -408,16 +399,19 @@ class NerithService(BaseCharacter):
             lore_msgs.append({"role": "system", "content": f"[LORE:RECALL]\n{recall_text}"})
         try:
             q = (prompt or "") + "\n" + (rolling or "")
-            top = lore_topk(usuario_key, q, k=4, allow_tags=None)
+            with span("nerith.lore", k=4) as sp:
+                top = lore_topk(usuario_key, q, k=4, allow_tags=None)
+                sp.set(hits=len(top or []))
             if top:
                 lore_text = " | ".join(d.get("texto","") for d in top if d.get("texto"))
                 if lore_text: lore_msgs.append({"role": "system", "content": f"[LORE]\n{lore_text}"})
         except Exception: pass
 
         # histórico com orçamento + boot
-        verbatim_ultimos = int(st.session_state.get("verbatim_ultimos", 10))
-        hist_msgs = self._montar_historico(usuario_key, history_boot, model,
-                                           verbatim_ultimos=verbatim_ultimos, reset_flag=reset_flag)
+        verbatim_ultimos = int(session_state().get("verbatim_ultimos", 10))
+        with span("nerith.history", verbatim=verbatim_ultimos):
+            hist_msgs = self._montar_historico(usuario_key, history_boot, model,
+                                               verbatim_ultimos=verbatim_ultimos, reset_flag=reset_flag)
 
         # se for primeiro turno/reset e sem prompt → retorna boot
         if not prompt and hist_msgs and hist_msgs[0].get("role") == "assistant":
@@ -441,7 +435,7 @@ class NerithService(BaseCharacter):
         )
 
         # aviso de poda/resumo
-        try: _mem_drop_warn(st.session_state.get("_mem_drop_report", {}))
+        try: _mem_drop_warn(session_state().get("_mem_drop_report", {}))
         except Exception: pass
 
         # orçamento saída
@@ -459,22 +453,24 @@ class NerithService(BaseCharacter):
             "together/meta-llama/Meta-Llama-3.1-405B-Instruct-Turbo",
             "anthropic/claude-3.5-haiku",
         ]
-        tools_to_use = TOOLS if st.session_state.get("tool_calling_on", False) else None
+        tools_to_use = TOOLS if session_state().get("tool_calling_on", False) else None
 
         # loop de tool-calling (até 3)
         texto, tool_calls = "", []
         for iteration in range(1, 4):
-            data, used_model, provider = _robust_chat_call(
-                model, messages, max_tokens=max_out, temperature=temperature, top_p=0.95,
-                fallback_models=fallbacks, tools=tools_to_use
-            )
+            with span("nerith.completion", iteration=iteration, max_tokens=max_out), \
+                    purpose("main" if iteration == 1 else "tool-iteration"):
+                data, used_model, provider = _robust_chat_call(
+                    model, messages, max_tokens=max_out, temperature=temperature, top_p=0.95,
+                    fallback_models=fallbacks, tools=tools_to_use
+                )
             msg = (data.get("choices", [{}])[0].get("message", {}) or {})
             texto = (msg.get("content","") or "").strip()
             tool_calls = msg.get("tool_calls", [])
             if not tool_calls or not tools_to_use:
                 break
 
-            st.caption(f"🔧 Executando {len(tool_calls)} ferramenta(s)...")
+            notify("caption", f"🔧 Executando {len(tool_calls)} ferramenta(s)...")
             messages.append({"role":"assistant","content": texto or None, "tool_calls": tool_calls})
             for tc in tool_calls:
                 tool_id = tc.get("id", f"call_{iteration}")
@@ -482,26 +478,29 @@ class NerithService(BaseCharacter):
                 fname = func.get("name",""); args_raw = func.get("arguments","{}")
                 try:
                     args = json.loads(args_raw) if args_raw else {}
-                    result = self._exec_tool_call(fname, args, usuario_key)
+                    with span("nerith.tool", tool=fname, iteration=iteration):
+                        result = self._exec_tool_call(fname, args, usuario_key)
                     messages.append({"role":"tool","tool_call_id": tool_id, "content": result})
-                    st.caption(f"  ✓ {fname}: {result[:50]}...")
+                    notify("caption", f"  ✓ {fname}: {result[:50]}...")
                 except Exception as e:
                     err = f"ERRO ao executar {fname}: {str(e)}"
                     messages.append({"role":"tool","tool_call_id": tool_id, "content": err})
-                    st.warning(f"⚠️ {err}")
+                    notify("warning", f"⚠️ {err}")
 
         # Ultra IA (opcional)
         try:
-            if bool(st.session_state.get("ultra_ia_on", False)) and texto:
-                critic_model = st.session_state.get("ultra_critic_model", model) or model
-                notes = critic_review(critic_model, system_block, prompt, texto)
-                texto = polish(model, system_block, prompt, texto, notes)
+            if bool(session_state().get("ultra_ia_on", False)) and texto:
+                critic_model = session_state().get("ultra_critic_model", model) or model
+                with span("nerith.critic", model=critic_model):
+                    notes = critic_review(critic_model, system_block, prompt, texto)
+                with span("nerith.polish", model=model):
+                    texto = polish(model, system_block, prompt, texto, notes)
         except Exception: pass
 
         # sentinela de esquecimento
         try:
             if re.search(r"\b(n[ãa]o (lembro|recordo)|quem (é|[ée] voc[êe])|me relembre|o que est[aá]vamos)\b", texto, re.I):
-                st.warning("🧠 Possível esquecimento detectado. Se quiser, peça um **recap curto**.")
+                notify("warning", "🧠 Possível esquecimento detectado. Se quiser, peça um **recap curto**.")
         except Exception: pass
 
         # persistências
@@ -517,20 +516,21 @@ class NerithService(BaseCharacter):
         # memória longa (lore)
         try:
             frag = f"[USER] {prompt}\n[NERITH] {texto}"
-            lore_save(usuario_key, frag, tags=["nerith","chat"])
+            with span("nerith.lore_save"):
+                lore_save(usuario_key, frag, tags=["nerith","chat"])
         except Exception: pass
 
         # placeholder leve
         try:
-            st.session_state["suggestion_placeholder"] = self._suggest_placeholder(texto, local_atual)
-            st.session_state["last_assistant_message"] = texto
+            session_state()["suggestion_placeholder"] = self._suggest_placeholder(texto, local_atual)
+            session_state()["last_assistant_message"] = texto
         except Exception:
-            st.session_state["suggestion_placeholder"] = ""
+            session_state()["suggestion_placeholder"] = ""
 
         # avisos de failover
         try:
             if provider == "synthetic-fallback":
-                st.info("⚠️ Provedor instável. Resposta em fallback — pode continuar normalmente.")
+                notify("info", "⚠️ Provedor instável. Resposta em fallback — pode continuar normalmente.")
         except Exception: pass
 
         # sinaliza recall ao usuário
@@ -545,10 +545,10 @@ class NerithService(BaseCharacter):
 
     def _get_user_prompt(self) -> str:
         return (
-            st.session_state.get("chat_input")
-            or st.session_state.get("user_input")
-            or st.session_state.get("last_user_message")
-            or st.session_state.get("prompt")
+            session_state().get("chat_input")
+            or session_state().get("user_input")
+            or session_state().get("last_user_message")
+            or session_state().get("prompt")
             or ""
         ).strip()
 
@@ -593,7 +593,7 @@ class NerithService(BaseCharacter):
         win = _get_window_for(model)
         hist_budget, _, _ = _budget_slices(model)
         docs = cached_get_history(usuario_key)
-        force_boot = reset_flag or bool(st.session_state.get("force_boot", False))
+        force_boot = reset_flag or bool(session_state().get("force_boot", False))
 
         # texto do boot
         boot_text = ""
@@ -603,11 +603,11 @@ class NerithService(BaseCharacter):
         # sem docs OU reset forçado → injeta boot e persiste
         if force_boot or not docs:
             msgs_boot = history_boot[:] if history_boot else []
-            if boot_text and not st.session_state.get("_nerith_boot_persistido", False):
+            if boot_text and not session_state().get("_nerith_boot_persistido", False):
                 self._persist_boot(usuario_key, boot_text)
-                st.session_state.pop("force_boot", None)
-                st.session_state.pop("reset_persona", None)
-            st.session_state["_mem_drop_report"] = {}
+                session_state().pop("force_boot", None)
+                session_state().pop("reset_persona", None)
+            session_state()["_mem_drop_report"] = {}
             return msgs_boot
 
         # pares user/assistant
@@ -620,9 +620,9 @@ class NerithService(BaseCharacter):
 
         if not pares:
             msgs_boot = history_boot[:] if history_boot else []
-            if boot_text and not st.session_state.get("_nerith_boot_persistido", False):
+            if boot_text and not session_state().get("_nerith_boot_persistido", False):
                 self._persist_boot(usuario_key, boot_text)
-            st.session_state["_mem_drop_report"] = {}
+            session_state()["_mem_drop_report"] = {}
             return msgs_boot
 
         keep = max(0, verbatim_ultimos * 2)
@@ -663,7 +663,7 @@ class NerithService(BaseCharacter):
             msgs = [m for m in msgs if m["role"] == "system"] + verbatim
 
         hist_tokens = sum(toklen(m.get("content","")) for m in msgs if m.get("content"))
-        st.session_state["_mem_drop_report"] = {
+        session_state()["_mem_drop_report"] = {
             "summarized_pairs": summarized_pairs,
             "trimmed_pairs": trimmed_pairs,
             "hist_tokens": hist_tokens,
@@ -694,6 +694,8 @@ class NerithService(BaseCharacter):
         except Exception:
             return True
 
+    @traced("nerith.rolling_summary")
+    @purpose("summary")
     def _update_rolling_summary_v2(self, usuario_key: str, model: str, last_user: str, last_assistant: str) -> None:
         if not self._should_update_summary(usuario_key, last_user, last_assistant): return
         seed = ("Resuma a conversa recente em ATÉ 8–10 frases, apenas fatos duráveis "
@@ -752,24 +754,16 @@ class NerithService(BaseCharacter):
     # ===== Persistência do boot (colar na hora) =====
     def _persist_boot(self, usuario_key: str, boot_text: str) -> None:
         if not (usuario_key and boot_text): return
+        # save_interaction invalida o cache compartilhado → próxima leitura já traz o boot
         try: save_interaction(usuario_key, "", boot_text, "system:boot:nerith")
         except Exception: pass
-        try:
-            docs = _cache_history.get(usuario_key) or []
-            docs = list(docs)
-            docs.append({
-                "mensagem_usuario": "", "resposta_nerith": boot_text,
-                "provider_model": "system:boot:nerith", "ts": time.time(),
-            })
-            _cache_history[usuario_key] = docs; _cache_ts[f"hist_{usuario_key}"] = time.time()
-        except Exception: pass
-        st.session_state["_nerith_boot_persistido"] = True
+        session_state()["_nerith_boot_persistido"] = True
 
     # ===== Execução de ferramentas =====
     def _exec_tool_call(self, name: str, args: dict, usuario_key: str) -> str:
         try:
             if name == "get_memory_pin":
-                return self._build_memory_pin(usuario_key, st.session_state.get("user_id","") or "")
+                return self._build_memory_pin(usuario_key, session_state().get("user_id","") or "")
             if name == "set_fact":
                 k = (args or {}).get("key",""); v = (args or {}).get("value","")
                 if not k: return "ERRO: key ausente."
@@ -778,22 +772,22 @@ class NerithService(BaseCharacter):
             if name == "save_event":
                 label = (args or {}).get("label","").strip()
                 content = (args or {}).get("content","").strip()
-                if not content: content = st.session_state.get("last_assistant_message","").strip()
+                if not content: content = session_state().get("last_assistant_message","").strip()
                 if not content: return "ERRO: nenhum conteúdo para salvar."
                 if not label:
                     low = content.lower()
                     label = "elysarix" if "elysarix" in low else f"evento_{int(time.time())}"
                 fact_key = f"nerith.evento.{label}"
                 set_fact(usuario_key, fact_key, content, {"fonte":"tool_call"}); clear_user_cache(usuario_key)
-                st.session_state["last_saved_nerith_event_key"] = fact_key
-                st.session_state["last_saved_nerith_event_val"] = content
+                session_state()["last_saved_nerith_event_key"] = fact_key
+                session_state()["last_saved_nerith_event_val"] = content
                 return f"OK: salvo em {fact_key}"
             if name == "recall_memory":
                 kw = (args or {}).get("keyword","").strip() or "__LAST__"
                 txt = self._recall_lore_text(usuario_key, kw)
                 if not txt:
                     return "ERRO: nenhuma memória encontrada para a palavra-chave."
-                st.session_state["nerith_recall_inject"] = txt
+                session_state()["nerith_recall_inject"] = txt
                 return f"OK: memória recuperada ({len(txt)} chars)"
             return "ERRO: ferramenta desconhecida"
         except Exception as e:
@@ -809,7 +803,7 @@ class NerithService(BaseCharacter):
         usuario_key = _current_user_key()
 
         # ===== Estado de Missão (session_state) =====
-        ms = st.session_state.setdefault("nerith_missao", {
+        ms = session_state().setdefault("nerith_missao", {
             "modo": "capturar",   # ou "eliminar"
             "ultimo_pulso": "",   # ex: "forte @ 19:42"
             "suspeitos": [],      # lista: {"nome": "...", "assinatura": "...", "risco": "baixo/médio/alto"}
@@ -820,20 +814,20 @@ class NerithService(BaseCharacter):
         # ===== Preferências/flags usuais =====
         json_on = container.checkbox(
             "JSON Mode",
-            value=bool(st.session_state.get("json_mode_on", False))
+            value=bool(session_state().get("json_mode_on", False))
         )
         tool_on = container.checkbox(
             "Tool-Calling",
-            value=bool(st.session_state.get("tool_calling_on", False))
+            value=bool(session_state().get("tool_calling_on", False))
         )
-        st.session_state["json_mode_on"] = json_on
-        st.session_state["tool_calling_on"] = tool_on
+        session_state()["json_mode_on"] = json_on
+        session_state()["tool_calling_on"] = tool_on
 
         lora = container.text_input(
             "Adapter ID (Together LoRA) — opcional",
-            value=st.session_state.get("together_lora_id", "")
+            value=session_state().get("together_lora_id", "")
         )
-        st.session_state["together_lora_id"] = lora
+        session_state()["together_lora_id"] = lora
 
         # ===== Modo da missão =====
         ms["modo"] = container.selectbox(
@@ -853,29 +847,29 @@ class NerithService(BaseCharacter):
         rec_col1, rec_col2 = container.columns([3, 1])
         recall_kw = rec_col1.text_input(
             "Palavra-chave (ex.: 'terraço', 'floresta', 'beco')",
-            value=st.session_state.get("nerith_recall_kw", "")
+            value=session_state().get("nerith_recall_kw", "")
         )
         rec_col2.write("")  # espaçamento
         btn_recall = container.button("🔎 Buscar memória", use_container_width=True, key=f"{usuario_key}_btn_recall")
         if btn_recall:
-            st.session_state["nerith_recall_kw"] = recall_kw
+            session_state()["nerith_recall_kw"] = recall_kw
             kw = (recall_kw or "").strip() or "__LAST__"
             txt = self._recall_lore_text(usuario_key, kw)  # helper de recall
             if txt:
-                st.session_state["nerith_recall_inject"] = txt
+                session_state()["nerith_recall_inject"] = txt
                 container.success("Memória recuperada. Será injetada na próxima resposta.")
             else:
                 container.warning("Nenhuma memória encontrada para essa palavra-chave.")
 
         # ===== Quadrinhos (providers + botão) =====
         def _scene_text_provider() -> str:
-            ms_local = st.session_state.get("nerith_missao", {})
+            ms_local = session_state().get("nerith_missao", {})
             local = (
                 ms_local.get("local_isolado")
-                or st.session_state.get("momento_atual")
+                or session_state().get("momento_atual")
                 or "noite, beco molhado de chuva"
             )
-            last_assistant = (st.session_state.get("last_assistant_message") or "")[:120]
+            last_assistant = (session_state().get("last_assistant_message") or "")[:120]
             return f"{local}; two characters; tense, close-up; dynamic angle; {last_assistant}"
 
         render_comic_button(
@@ -937,7 +931,7 @@ class NerithService(BaseCharacter):
     def _acao_varrer_area(self, usuario_key: str) -> None:
         """Simula varredura: registra pulso, insere/atualiza suspeito e marca andamento."""
         try:
-            ms = st.session_state.get("nerith_missao", {})
+            ms = session_state().get("nerith_missao", {})
             hhmm = time.strftime("%H:%M")
             seed = str(int(time.time()))[-4:]
             assinatura = f"Σ-{seed}"
@@ -952,7 +946,7 @@ class NerithService(BaseCharacter):
             if not any(s.get("assinatura") == assinatura for s in lista):
                 lista.append({"nome": nome, "assinatura": assinatura, "risco": risco})
             ms["suspeitos"] = lista
-            st.session_state["nerith_missao"] = ms
+            session_state()["nerith_missao"] = ms
 
             set_fact(usuario_key, "nerith.hunt.last_pulse", ms["ultimo_pulso"], {"fonte": "scanner"})
             set_fact(usuario_key, "nerith.hunt.last_sig", assinatura, {"fonte": "scanner"})
@@ -964,7 +958,7 @@ class NerithService(BaseCharacter):
     def _acao_isolar_alvo(self, usuario_key: str) -> None:
         """Escolhe um suspeito e define um local discreto para a cena, atualizando local_cena_atual."""
         try:
-            ms = st.session_state.get("nerith_missao", {})
+            ms = session_state().get("nerith_missao", {})
             candidatos = ms.get("suspeitos") or []
             if not candidatos:
                 candidatos = [{"nome": "Alvo anônimo", "assinatura": "Σ-0000", "risco": "médio"}]
@@ -979,7 +973,7 @@ class NerithService(BaseCharacter):
             local = random.choice(locais)
             ms["local_isolado"] = local
             ms["andamento"] = "isolado"
-            st.session_state["nerith_missao"] = ms
+            session_state()["nerith_missao"] = ms
 
             set_fact(usuario_key, "local_cena_atual", local, {"fonte": "isolamento"})
             set_fact(usuario_key, "portal_aberto", False, {"fonte": "isolamento"})
@@ -992,7 +986,7 @@ class NerithService(BaseCharacter):
     def _acao_extrair_info(self, usuario_key: str) -> None:
         """Grava um evento de interrogatório curto e atualiza andamento."""
         try:
-            ms = st.session_state.get("nerith_missao", {})
+            ms = session_state().get("nerith_missao", {})
             local = ms.get("local_isolado") or (get_fact(usuario_key, "local_cena_atual", "") or "—")
             alvo = get_fact(usuario_key, "nerith.hunt.target", "") or "desconhecido"
             carimbo = time.strftime("%Y-%m-%d %H:%M:%S")
@@ -1005,7 +999,7 @@ class NerithService(BaseCharacter):
             set_fact(usuario_key, f"nerith.evento.interrogatorio_{int(time.time())}", texto_evento, {"fonte": "missao"})
             set_fact(usuario_key, "nerith.hunt.status", "interrogando", {"fonte": "missao"})
             ms["andamento"] = "interrogando"
-            st.session_state["nerith_missao"] = ms
+            session_state()["nerith_missao"] = ms
             clear_user_cache(usuario_key)
         except Exception:
             pass
@@ -1020,7 +1014,7 @@ class NerithService(BaseCharacter):
                 "local_isolado": "",
                 "andamento": "ocioso"
             }
-            st.session_state["nerith_missao"] = ms_default
+            session_state()["nerith_missao"] = ms_default
 
             set_fact(usuario_key, "nerith.hunt.status", "concluido", {"fonte": "missao"})
             clear_user_cache(usuario_key)
@@ -0,0 +1,174 @@
+# core/ann_index.py
+"""
+Índice aproximado (IVF) para a memória longa.
+
+- Centroides por k-means esférico (cosseno), nlist ≈ sqrt(N).
+- Listas invertidas: cada linha da matriz vai para o centroide mais próximo.
+- Busca: sonda os `nprobe` centroides mais próximos da consulta e ranqueia só essas linhas.
+- Persistência binária compacta: cabeçalho + centroides float32 + atribuições int32.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import struct
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+import numpy as np
+
+_MAGIC = b"IVF1"
+_HEADER = struct.Struct("<4sIIII20s")  # magic, dim, nlist, n, n_trained, sha1(hashes)
+
+ANN_DIR = Path(os.getenv("LORE_ANN_DIR", "") or (Path(__file__).resolve().parents[1] / ".cache" / "ann"))
+
+
+def _digest(hashes: Iterable[str]) -> bytes:
+    h = hashlib.sha1()
+    for x in hashes:
+        h.update(str(x).encode("utf-8"))
+        h.update(b"\0")
+    return h.digest()
+
+
+def _assign(mat: np.ndarray, centroids: np.ndarray, chunk: int = 8192) -> np.ndarray:
+    out = np.empty(mat.shape[0], dtype=np.int32)
+    for i in range(0, mat.shape[0], chunk):
+        out[i:i + chunk] = np.argmax(mat[i:i + chunk] @ centroids.T, axis=1)
+    return out
+
+
+def _kmeans(mat: np.ndarray, nlist: int, iters: int = 10, seed: int = 0) -> np.ndarray:
+    """K-means esférico sobre uma amostra (linhas já normalizadas)."""
+    rng = np.random.default_rng(seed)
+    sample = mat
+    cap = nlist * 64
+    if mat.shape[0] > cap:
+        sample = mat[rng.choice(mat.shape[0], cap, replace=False)]
+    centroids = sample[rng.choice(sample.shape[0], nlist, replace=False)].copy()
+    for _ in range(iters):
+        labels = _assign(sample, centroids)
+        order = np.argsort(labels, kind="stable")
+        present, starts = np.unique(labels[order], return_index=True)
+        sums = np.zeros_like(centroids)
+        sums[present] = np.add.reduceat(sample[order], starts, axis=0)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        empty = norms[:, 0] == 0
+        # centroide vazio: re-semeia com uma linha aleatória
+        if empty.any():
+            sums[empty] = sample[rng.choice(sample.shape[0], int(empty.sum()))]
+            norms[empty] = np.linalg.norm(sums[empty], axis=1, keepdims=True)
+        centroids = (sums / np.maximum(norms, 1e-12)).astype(np.float32)
+    return centroids
+
+
+class IVFIndex:
+    def __init__(self, centroids: np.ndarray, assign: np.ndarray, n_trained: int):
+        self.centroids = centroids.astype(np.float32, copy=False)
+        self.dim = int(centroids.shape[1])
+        self.n_trained = int(n_trained)
+        self.lists: List[List[int]] = [[] for _ in range(centroids.shape[0])]
+        for row, c in enumerate(assign.tolist()):
+            self.lists[c].append(row)
+        self.n = int(assign.shape[0])
+        self._arrays: List[Optional[np.ndarray]] = [None] * centroids.shape[0]
+        self.dirty = 0
+
+    # ---------- construção ----------
+    @classmethod
+    def train(cls, mat: np.ndarray, nlist: Optional[int] = None) -> "IVFIndex":
+        n = mat.shape[0]
+        nlist = int(nlist or max(1, min(n, int(np.sqrt(n)))))
+        centroids = _kmeans(mat, nlist)
+        return cls(centroids, _assign(mat, centroids), n_trained=n)
+
+    def needs_retrain(self, n: int) -> bool:
+        """Listas ficam desbalanceadas quando a base cresce muito além do treino."""
+        return n > 4 * max(1, self.n_trained)
+
+    # ---------- atualização incremental ----------
+    def add(self, vec: np.ndarray, row: int) -> None:
+        c = int(np.argmax(self.centroids @ vec))
+        self.lists[c].append(row)
+        self._arrays[c] = None
+        self.n = max(self.n, row + 1)
+        self.dirty += 1
+
+    def extend(self, mat: np.ndarray, start: int) -> None:
+        if mat.shape[0] == 0:
+            return
+        for i, c in enumerate(_assign(mat, self.centroids).tolist()):
+            self.lists[c].append(start + i)
+            self._arrays[c] = None
+        self.n = start + mat.shape[0]
+        self.dirty += mat.shape[0]
+
+    # ---------- busca ----------
+    def probe(self, q: np.ndarray, nprobe: int) -> np.ndarray:
+        """Linhas (ordenadas) das `nprobe` listas mais próximas de q."""
+        sims = self.centroids @ q
+        nprobe = max(1, min(int(nprobe), sims.shape[0]))
+        best = np.argpartition(-sims, nprobe - 1)[:nprobe]
+        parts = []
+        for c in best.tolist():
+            arr = self._arrays[c]
+            if arr is None:
+                arr = self._arrays[c] = np.asarray(self.lists[c], dtype=np.int64)
+            parts.append(arr)
+        rows = np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+        rows.sort()
+        return rows
+
+    def assignments(self) -> np.ndarray:
+        out = np.empty(self.n, dtype=np.int32)
+        for c, rows in enumerate(self.lists):
+            out[rows] = c
+        return out
+
+    # ---------- persistência ----------
+    def save(self, path: Path, hashes: List[str]) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        assign = self.assignments()
+        with tmp.open("wb") as f:
+            f.write(_HEADER.pack(_MAGIC, self.dim, self.centroids.shape[0], self.n,
+                                 self.n_trained, _digest(hashes[:self.n])))
+            f.write(self.centroids.tobytes())
+            f.write(assign.astype("<i4", copy=False).tobytes())
+        os.replace(tmp, path)
+        self.dirty = 0
+
+    @classmethod
+    def load(cls, path: Path, mat: np.ndarray, hashes: List[str]) -> Optional["IVFIndex"]:
+        """
+        Carrega do disco e reconcilia com a matriz atual:
+        - prefixo igual (mesmos hashes) → reaproveita atribuições e atribui só as linhas novas;
+        - prefixo diferente → reaproveita centroides e reatribui tudo.
+        """
+        try:
+            raw = path.read_bytes()
+        except OSError:
+            return None
+        if len(raw) < _HEADER.size:
+            return None
+        magic, dim, nlist, n, n_trained, digest = _HEADER.unpack_from(raw, 0)
+        if magic != _MAGIC or dim != mat.shape[1] or nlist == 0:
+            return None
+        off = _HEADER.size
+        c_bytes = nlist * dim * 4
+        if len(raw) < off + c_bytes + n * 4:
+            return None
+        centroids = np.frombuffer(raw, dtype="<f4", count=nlist * dim, offset=off).reshape(nlist, dim).copy()
+        if n <= mat.shape[0] and digest == _digest(hashes[:n]):
+            assign = np.frombuffer(raw, dtype="<i4", count=n, offset=off + c_bytes).astype(np.int32)
+            idx = cls(centroids, assign, n_trained)
+            idx.extend(mat[n:], n)
+        else:
+            idx = cls(centroids, _assign(mat, centroids), n_trained)
+            idx.dirty = max(1, idx.n)
+        return idx
+
+
+def index_path(usuario_key: str, dim: int) -> Path:
+    name = hashlib.sha1((usuario_key or "").encode("utf-8")).hexdigest()
+    return ANN_DIR / f"{name}.{dim}.ivf"
@@ -0,0 +1,494 @@
+# core/cache.py
+"""
+Cache compartilhado (processo) para facts/histórico de todos os personagens.
+
+- LRU com get/put O(1) (OrderedDict) e limite de entradas e de bytes (estimados).
+- TTL único por cache: a ordem de inserção é a ordem de expiração, então a purga
+  só olha a cabeça de um segundo OrderedDict (sem varrer todas as chaves).
+- Invalidação versionada: cada usuário tem um contador; bump_version(usuario) torna
+  obsoletas todas as entradas dele em O(1) (são descartadas ao serem lidas).
+- Valores mutáveis (dict/list/set) entram e saem como cópia: o L1 é do processo inteiro
+  (todas as sessões/threads) e um caller que altere facts/histórico não corrompe o cache.
+- Métricas: hits, misses, evictions, expired, stale, invalidations.
+
+Backends (CACHE_BACKEND):
+- "memory" (default): só TTLCache no processo.
+- "redis": TieredCache = TTLCache local (L1) + RedisCache (L2, REDIS_URL) compartilhado
+  entre réplicas; versões ficam no Redis e cada bump_version é publicado num canal
+  pub/sub para as outras réplicas invalidarem o L1 (e índices locais, ex.: lore).
+  Para testes, qualquer cliente compatível pode ser injetado (FakeRedis em
+  benchmarks/fake_redis.py; verificação em benchmarks/check_cache_redis.py).
+  Valores no L2 vão em JSON com tags ($dt, $oid, $b64) — nunca pickle: quem escreve no
+  Redis não consegue executar código na app. Sem ping no import: o cliente conecta sob
+  demanda (timeouts REDIS_TIMEOUT_S) e, após uma falha, o L2 é pulado por
+  REDIS_RETRY_S segundos (a app segue com L1/banco).
+"""
+from __future__ import annotations
+
+import base64
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from threading import RLock
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from datetime import datetime
+
+from . import metrics
+from .config import settings
+
+try:  # opcional (vem com o pymongo)
+    from bson import ObjectId
+except Exception:  # pragma: no cover
+    ObjectId = None  # type: ignore
+
+REDIS_TIMEOUT_S = float(os.getenv("REDIS_TIMEOUT_S", "0.5"))
+REDIS_RETRY_S = float(os.getenv("REDIS_RETRY_S", "30"))
+
+
+def _approx_size(obj: Any, depth: int = 0) -> int:
+    """Estimativa barata de bytes (recursiva até 4 níveis)."""
+    size = sys.getsizeof(obj, 64)
+    if depth >= 4:
+        return size
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            size += _approx_size(k, depth + 1) + _approx_size(v, depth + 1)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for v in obj:
+            size += _approx_size(v, depth + 1)
+    return size
+
+
+def _copy(obj: Any) -> Any:
+    """Cópia estrutural de dict/list/set (folhas imutáveis — str, números, datetime — são reusadas)."""
+    if isinstance(obj, dict):
+        return {k: _copy(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_copy(v) for v in obj]
+    if isinstance(obj, tuple):
+        return tuple(_copy(v) for v in obj)
+    if isinstance(obj, set):
+        return {_copy(v) for v in obj}
+    return obj
+
+
+class TTLCache:
+    def __init__(self, ttl: float = 30.0, max_entries: int = 2048, max_bytes: int = 64 * 1024 * 1024):
+        self.ttl = float(ttl)
+        self.max_entries = int(max_entries)
+        self.max_bytes = int(max_bytes)
+        self._lru: "OrderedDict[Hashable, Tuple[Any, int, Hashable, int]]" = OrderedDict()  # key -> (valor, bytes, dono, versão)
+        self._exp: "OrderedDict[Hashable, float]" = OrderedDict()  # key -> expira_em (ordem = expiração)
+        self._versions: Dict[Hashable, int] = {}
+        self._bytes = 0
+        self._lock = RLock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0, "stale": 0, "invalidations": 0}
+
+    # ---------- internos ----------
+    def _drop(self, key: Hashable) -> None:
+        ent = self._lru.pop(key, None)
+        self._exp.pop(key, None)
+        if ent is not None:
+            self._bytes -= ent[1]
+
+    def _purge_expired(self, now: float) -> None:
+        while self._exp:
+            key, exp = next(iter(self._exp.items()))
+            if exp > now:
+                break
+            self._drop(key)
+            self._stats["expired"] += 1
+
+    # ---------- API ----------
+    def version(self, owner: Hashable) -> int:
+        with self._lock:
+            return self._versions.get(owner, 0)
+
+    def bump_version(self, owner: Hashable) -> None:
+        """Invalida todas as entradas do dono (ex.: usuario_key)."""
+        with self._lock:
+            self._versions[owner] = self._versions.get(owner, 0) + 1
+            self._stats["invalidations"] += 1
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            self._purge_expired(time.time())
+            ent = self._lru.get(key)
+            if ent is None:
+                self._stats["misses"] += 1
+                return default
+            if ent[3] != self._versions.get(ent[2], 0):
+                self._drop(key)
+                self._stats["stale"] += 1
+                self._stats["misses"] += 1
+                return default
+            self._lru.move_to_end(key)
+            self._stats["hits"] += 1
+            value = ent[0]
+        return _copy(value)
+
+    def put(self, key: Hashable, value: Any, owner: Hashable = None, version: Optional[int] = None) -> None:
+        """
+        Guarda value. `version` deve ser a lida ANTES de carregar do banco: se houve
+        invalidação no meio do carregamento, a entrada já nasce obsoleta.
+        """
+        value = _copy(value)  # o caller segue dono do objeto que passou
+        size = _approx_size(value)
+        with self._lock:
+            now = time.time()
+            self._drop(key)
+            if size > self.max_bytes:
+                return
+            ver = self._versions.get(owner, 0) if version is None else version
+            self._lru[key] = (value, size, owner, ver)
+            self._exp[key] = now + self.ttl
+            self._bytes += size
+            self._purge_expired(now)
+            while self._lru and (len(self._lru) > self.max_entries or self._bytes > self.max_bytes):
+                old = next(iter(self._lru))
+                self._drop(old)
+                self._stats["evictions"] += 1
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any], owner: Hashable = None) -> Any:
+        sentinel = object()
+        val = self.get(key, sentinel)
+        if val is not sentinel:
+            return val
+        ver = self.version(owner)
+        val = loader()
+        self.put(key, val, owner=owner, version=ver)
+        return val
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._drop(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._lru.clear()
+            self._exp.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self._stats["hits"] + self._stats["misses"]
+            return dict(self._stats, entries=len(self._lru), bytes=self._bytes,
+                        hit_rate=round(self._stats["hits"] / total, 4) if total else 0.0)
+
+
+def _encode(obj: Any) -> Any:
+    """default= do json.dumps: tipos que facts/histórico carregam além do JSON puro."""
+    if isinstance(obj, datetime):
+        return {"$dt": obj.isoformat()}
+    if ObjectId is not None and isinstance(obj, ObjectId):
+        return {"$oid": str(obj)}
+    if isinstance(obj, (bytes, bytearray)):
+        return {"$b64": base64.b64encode(bytes(obj)).decode("ascii")}
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"não serializável no cache: {type(obj).__name__}")
+
+
+def _decode(d: Dict[str, Any]) -> Any:
+    if len(d) == 1:
+        if "$dt" in d:
+            return datetime.fromisoformat(d["$dt"])
+        if "$oid" in d:
+            return ObjectId(d["$oid"]) if ObjectId is not None else d["$oid"]
+        if "$b64" in d:
+            return base64.b64decode(d["$b64"])
+    return d
+
+
+def dumps_value(value: Any) -> bytes:
+    return json.dumps(value, default=_encode, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads_value(raw: Any) -> Any:
+    return json.loads(raw, object_hook=_decode)
+
+
+class RedisCache:
+    """
+    L2 compartilhado (protocolo Redis). Valores em JSON com tags ([dono, versão, valor]);
+    versões em chaves INCR por dono. Erros de rede viram miss e desligam o L2 por
+    REDIS_RETRY_S (a app segue com o L1/banco sem pagar timeout a cada leitura).
+    """
+
+    def __init__(self, client: Any, ttl: float = 30.0, prefix: str = "p25", retry_s: float = REDIS_RETRY_S):
+        self.client = client
+        self.ttl = float(ttl)
+        self.prefix = prefix
+        self.retry_s = float(retry_s)
+        self._down_until = 0.0
+        self._stats = {"hits": 0, "misses": 0, "stale": 0, "invalidations": 0, "errors": 0, "skipped": 0}
+
+    def _up(self) -> bool:
+        if time.time() >= self._down_until:
+            return True
+        self._stats["skipped"] += 1
+        return False
+
+    def _fail(self) -> None:
+        self._stats["errors"] += 1
+        self._down_until = time.time() + self.retry_s
+
+    def _key(self, key: Hashable) -> str:
+        return f"{self.prefix}:v:{hashlib.sha1(repr(key).encode('utf-8')).hexdigest()}"
+
+    def _ver_key(self, owner: Hashable) -> str:
+        return f"{self.prefix}:ver:{owner}"
+
+    def version(self, owner: Hashable) -> int:
+        if not self._up():
+            return -1
+        try:
+            return int(self.client.get(self._ver_key(owner)) or 0)
+        except Exception:
+            self._fail()
+            return -1
+
+    def bump_version(self, owner: Hashable) -> None:
+        try:  # sempre tenta: uma invalidação perdida deixaria o L2 servindo dado velho
+            self.client.incr(self._ver_key(owner))
+            self._stats["invalidations"] += 1
+        except Exception:
+            self._fail()
+
+    def get_entry(self, key: Hashable) -> Optional[Tuple[Hashable, Any]]:
+        """(dono, valor) se presente e na versão atual; None caso contrário."""
+        if not self._up():
+            self._stats["misses"] += 1
+            return None
+        try:
+            raw = self.client.get(self._key(key))
+        except Exception:
+            self._fail()
+            return None
+        if raw is None:
+            self._stats["misses"] += 1
+            return None
+        try:
+            owner, ver, value = loads_value(raw)
+        except Exception:  # payload corrompido/estranho: trata como miss
+            self._stats["errors"] += 1
+            return None
+        if ver != self.version(owner):
+            self._stats["stale"] += 1
+            self._stats["misses"] += 1
+            return None
+        self._stats["hits"] += 1
+        return owner, value
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        ent = self.get_entry(key)
+        return default if ent is None else ent[1]
+
+    def put(self, key: Hashable, value: Any, owner: Hashable = None, version: Optional[int] = None) -> None:
+        ver = self.version(owner) if version is None else version
+        if ver < 0:
+            return
+        try:
+            payload = dumps_value([owner, ver, value])
+        except (TypeError, ValueError):
+            self._stats["errors"] += 1  # tipo fora do JSON: fica só no L1
+            return
+        try:
+            self.client.set(self._key(key), payload, ex=max(1, int(self.ttl)))
+        except Exception:
+            self._fail()
+
+    def invalidate(self, key: Hashable) -> None:
+        try:
+            self.client.delete(self._key(key))
+        except Exception:
+            self._fail()
+
+    def clear(self) -> None:
+        """No-op: entradas expiram por TTL; use bump_version para invalidar."""
+
+    def stats(self) -> Dict[str, Any]:
+        total = self._stats["hits"] + self._stats["misses"]
+        return dict(self._stats, hit_rate=round(self._stats["hits"] / total, 4) if total else 0.0)
+
+
+# ===================== Invalidação entre réplicas =====================
+class InvalidationBus:
+    """Barramento local: sem réplicas, não há a quem avisar (listeners só recebem mensagens remotas)."""
+
+    def __init__(self):
+        self._listeners: Dict[str, List[Callable[[str], None]]] = {}
+
+    def subscribe(self, scope: str, fn: Callable[[str], None]) -> None:
+        self._listeners.setdefault(scope, []).append(fn)
+
+    def publish(self, scope: str, owner: str) -> None:
+        pass
+
+    def _deliver(self, scope: str, owner: str) -> None:
+        for fn in list(self._listeners.get(scope, ())):
+            try:
+                fn(owner)
+            except Exception:
+                pass
+
+
+class RedisInvalidationBus(InvalidationBus):
+    """Pub/sub Redis: publica {"origin","scope","owner"}; thread daemon entrega mensagens de outras réplicas."""
+
+    def __init__(self, client: Any, channel: str = "p25:invalidate", listen_client: Any = None):
+        super().__init__()
+        self.client = client
+        self.listen_client = listen_client or client  # listen() fica ocioso: sem socket_timeout
+        self.channel = channel
+        self.node_id = uuid.uuid4().hex  # origem desta réplica (mensagens próprias são ignoradas)
+        self._thread: Optional[threading.Thread] = None
+
+    def publish(self, scope: str, owner: str) -> None:
+        try:
+            self.client.publish(self.channel, json.dumps({"origin": self.node_id, "scope": scope, "owner": owner}))
+        except Exception:
+            pass
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        def _loop():
+            while True:
+                try:
+                    ps = self.listen_client.pubsub(ignore_subscribe_messages=True)
+                    ps.subscribe(self.channel)
+                    for msg in ps.listen():
+                        try:
+                            data = json.loads(msg.get("data") or b"{}")
+                        except Exception:
+                            continue
+                        if data.get("origin") != self.node_id and data.get("scope") and data.get("owner"):
+                            self._deliver(data["scope"], data["owner"])
+                except Exception:
+                    time.sleep(2.0)  # reconecta
+
+        self._thread = threading.Thread(target=_loop, name="cache-invalidation", daemon=True)
+        self._thread.start()
+
+
+class TieredCache:
+    """L1 (TTLCache no processo) + L2 (RedisCache); bump_version invalida os dois e avisa as réplicas."""
+
+    def __init__(self, l1: TTLCache, l2: RedisCache, bus: InvalidationBus):
+        self.l1 = l1
+        self.l2 = l2
+        self.bus = bus
+        bus.subscribe("user", self.l1.bump_version)
+
+    @property
+    def ttl(self) -> float:
+        return self.l1.ttl
+
+    def version(self, owner: Hashable) -> int:
+        return self.l1.version(owner)
+
+    def bump_version(self, owner: Hashable) -> None:
+        self.l1.bump_version(owner)
+        self.l2.bump_version(owner)
+        self.bus.publish("user", str(owner))
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        sentinel = object()
+        val = self.l1.get(key, sentinel)
+        if val is not sentinel:
+            return val
+        ent = self.l2.get_entry(key)
+        if ent is None:
+            return default
+        self.l1.put(key, ent[1], owner=ent[0])
+        return ent[1]
+
+    def put(self, key: Hashable, value: Any, owner: Hashable = None, version: Optional[int] = None) -> None:
+        self.l1.put(key, value, owner=owner, version=version)
+        self.l2.put(key, value, owner=owner)
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any], owner: Hashable = None) -> Any:
+        sentinel = object()
+        val = self.l1.get(key, sentinel)
+        if val is not sentinel:
+            return val
+        v1, v2 = self.l1.version(owner), self.l2.version(owner)
+        ent = self.l2.get_entry(key)
+        if ent is not None:
+            val = ent[1]
+        else:
+            val = loader()
+            self.l2.put(key, val, owner=owner, version=v2)
+        self.l1.put(key, val, owner=owner, version=v1)
+        return val
+
+    def invalidate(self, key: Hashable) -> None:
+        self.l1.invalidate(key)
+        self.l2.invalidate(key)
+
+    def clear(self) -> None:
+        self.l1.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self.l1.stats(), l2=self.l2.stats())
+
+
+def _int(raw: Any, default: int) -> int:
+    try:
+        return int(raw)
+    except (TypeError, ValueError):
+        return default
+
+
+def make_cache(backend: Optional[str] = None, redis_client: Any = None) -> Tuple[Any, InvalidationBus]:
+    """
+    (cache, barramento) conforme CACHE_BACKEND; cai para memória só se o pacote redis
+    faltar. Não conecta aqui (roda no import): Redis lento/ausente vira miss no L2.
+    """
+    l1 = TTLCache(
+        ttl=_int(settings.CACHE_TTL, 30),
+        max_entries=_int(settings.CACHE_MAX_ENTRIES, 2048),
+        max_bytes=_int(settings.CACHE_MAX_BYTES, 64 * 1024 * 1024),
+    )
+    backend = (backend or settings.CACHE_BACKEND or "memory").strip().lower()
+    if backend != "redis":
+        return l1, InvalidationBus()
+    client = bus_client = redis_client
+    if client is None:
+        try:
+            import redis  # opcional
+            client = redis.Redis.from_url(settings.REDIS_URL, socket_timeout=REDIS_TIMEOUT_S,
+                                          socket_connect_timeout=REDIS_TIMEOUT_S)
+            bus_client = redis.Redis.from_url(settings.REDIS_URL, socket_connect_timeout=REDIS_TIMEOUT_S)
+        except Exception:
+            return l1, InvalidationBus()
+    bus = RedisInvalidationBus(client, channel=f"{settings.APP_NAME}:invalidate", listen_client=bus_client)
+    bus.start()
+    return TieredCache(l1, RedisCache(client, ttl=l1.ttl, prefix=settings.APP_NAME), bus), bus
+
+
+# Instância única (facts/histórico de todos os personagens) + barramento de invalidação
+user_cache, invalidation_bus = make_cache()
+
+
+def _cache_metrics():
+    st = user_cache.stats()
+    for tier, d in (("l1", st), ("l2", st.get("l2") or {})):
+        for k in ("hits", "misses", "evictions", "expired", "stale", "invalidations", "errors", "skipped"):
+            if k in d:
+                yield ("cache_events_total", "counter", "Eventos do cache compartilhado", {"tier": tier, "event": k}, d[k])
+        if "hit_rate" in d:
+            yield ("cache_hit_ratio", "gauge", "Hits / (hits + misses)", {"tier": tier}, d["hit_rate"])
+    yield ("cache_entries", "gauge", "Entradas no cache local", {}, st.get("entries", 0))
+    yield ("cache_bytes", "gauge", "Bytes estimados no cache local", {}, st.get("bytes", 0))
+
+
+metrics.register_collector(_cache_metrics)
@@ -0,0 +1,137 @@
+# core/change_watcher.py
+"""
+Invalidação de cache guiada por change streams do Mongo (opcional).
+
+- Uma thread daemon por processo observa 'state_data', 'history', 'events' e
+  'memoria_longa' (db.watch com filtro por coleção).
+- Cada mudança invalida só o usuário afetado: bump_version(usuario) no user_cache
+  (facts/histórico/eventos) ou invalidate_index(usuario_key) para a memória longa.
+  Inserts na memória longa que este processo já aplicou no índice (save_fragment faz
+  append) são ignorados pelo hash — o índice local não é recarregado à toa.
+- Updates usam updateLookup (o $set de um valor igual não aparece em updatedFields) e o
+  pipeline projeta só os campos que identificam o dono — nada de texto/vetores no stream.
+- Deletes: o usuário vem do pré-imagem (MongoDB 6+, changeStreamPreAndPostImages)
+  quando disponível; sem ele, o cache local inteiro é descartado (seguro, só mais caro).
+  Servidores < 6.0 recusam a opção: o watcher reabre o stream sem ela.
+- Reconexão com resume token; sem replica set (change streams indisponíveis) a thread
+  encerra e o cache segue só com TTL.
+
+Com o watcher ativo, CACHE_TTL pode ser bem maior (ex.: 600) sem servir dados velhos
+de escritas feitas por outras abas/sessões/processos.
+"""
+from __future__ import annotations
+
+import threading
+from typing import Any, Dict, Optional
+
+from .cache import user_cache
+from .config import settings
+from .database import get_backend, mongo_database
+
+WATCHED = ("state_data", "history", "events", "memoria_longa")
+
+_W: Dict[str, Any] = {
+    "thread": None, "stop": threading.Event(), "resume": None,
+    "events": 0, "invalidations": 0, "full_clears": 0, "last_error": "", "running": False,
+}
+_W_LOCK = threading.Lock()
+
+# só o que _owner()/handle_change leem (o _id do evento é o resume token e fica)
+_PROJECTION = {
+    "operationType": 1, "ns": 1, "documentKey": 1,
+    **{f"{f}.{k}": 1 for f in ("fullDocument", "fullDocumentBeforeChange") for k in ("usuario", "usuario_key")},
+    "fullDocument.hash": 1,
+}
+
+
+def _owner(change: Dict[str, Any]) -> Optional[str]:
+    for field in ("fullDocument", "fullDocumentBeforeChange"):
+        doc = change.get(field) or {}
+        key = doc.get("usuario") or doc.get("usuario_key")
+        if key:
+            return str(key)
+    return None
+
+
+def handle_change(change: Dict[str, Any]) -> None:
+    """Aplica um evento de change stream aos caches locais (exposto para testes)."""
+    _W["events"] += 1
+    coll = (change.get("ns") or {}).get("coll") or ""
+    owner = _owner(change)
+    if coll == "memoria_longa":
+        try:
+            from core.memoria_longa import index_has, invalidate_index
+            h = (change.get("fullDocument") or {}).get("hash")
+            if change.get("operationType") == "insert" and owner and index_has(owner, h):
+                return  # eco do nosso próprio save_fragment (já está no índice)
+            invalidate_index(owner, broadcast=False)  # None (delete sem pré-imagem) = todos
+        except Exception:
+            pass
+        if not owner:
+            _W["full_clears"] += 1
+            return
+    elif owner:
+        user_cache.bump_version(owner)
+    else:
+        user_cache.clear()
+        _W["full_clears"] += 1
+        return
+    _W["invalidations"] += 1
+
+
+def _run(stop: threading.Event) -> None:
+    pipeline = [{"$match": {"ns.coll": {"$in": list(WATCHED)},
+                            "operationType": {"$in": ["insert", "update", "replace", "delete"]}}},
+                {"$project": _PROJECTION}]
+    opts: Dict[str, Any] = {"full_document": "updateLookup", "full_document_before_change": "whenAvailable"}
+    while not stop.is_set():
+        db = mongo_database()
+        if db is None:
+            _W["last_error"] = "Mongo indisponível"
+            break
+        try:
+            with db.watch(pipeline, resume_after=_W["resume"], max_await_time_ms=1000, **opts) as stream:
+                _W["running"] = True
+                while not stop.is_set() and stream.alive:
+                    change = stream.try_next()
+                    if change is None:
+                        continue
+                    _W["resume"] = stream.resume_token
+                    handle_change(change)
+        except Exception as e:
+            _W["last_error"] = f"{type(e).__name__}: {e}"
+            # 40573/IllegalOperation: sem replica set → change streams não existem aqui
+            if getattr(e, "code", None) in (40573, 20) or "replica set" in str(e).lower():
+                break
+            # < 6.0 não conhece fullDocumentBeforeChange: reabre já, sem pré-imagem
+            if "full_document_before_change" in opts and "fulldocumentbeforechange" in str(e).lower():
+                opts.pop("full_document_before_change")
+                continue
+            _W["resume"] = None if "resume" in str(e).lower() else _W["resume"]
+            stop.wait(5.0)
+    _W["running"] = False
+
+
+def start_change_watcher(force: bool = False) -> bool:
+    """Inicia (uma vez por processo) o watcher; só com backend Mongo e CACHE_WATCH ligado."""
+    enabled = str(settings.CACHE_WATCH).strip().lower() in {"1", "true", "yes", "on"}
+    if not (enabled or force) or get_backend() != "mongo":
+        return False
+    with _W_LOCK:
+        th = _W["thread"]
+        if th is not None and th.is_alive():
+            return False
+        stop: threading.Event = _W["stop"]
+        stop.clear()
+        th = threading.Thread(target=_run, args=(stop,), name="cache-change-watcher", daemon=True)
+        _W["thread"] = th
+        th.start()
+        return True
+
+
+def stop_change_watcher() -> None:
+    _W["stop"].set()
+
+
+def watcher_stats() -> Dict[str, Any]:
+    return {k: v for k, v in _W.items() if k not in ("thread", "stop", "resume")}
@@ -1,11 +1,23 @@
 # core/common/base_service.py
 from __future__ import annotations
-from typing import List
+from typing import List, Tuple
+
+from core import metrics
+
+# reply() de todas as personagens (rótulo character), via @metrics.timed
+REPLY_SECONDS = metrics.histogram("character_reply_seconds", "Duração de reply() por personagem", ["character"])
+REPLY_ERRORS = metrics.counter("character_reply_errors_total", "Exceções em reply()", ["character"])
 
 class BaseCharacter:
     """Base concreta com defaults seguros (no-op)."""
 
     title: str = "Personagem"
+    # chaves da sessão que reply() lê/grava (core.session): a pré-geração copia só estas
+    state_keys: Tuple[str, ...] = (
+        "user_id", "prompt", "user_input", "chat_input", "last_user_message",
+        "last_assistant_message", "suggestion_placeholder", "json_mode_on", "tool_calling_on",
+        "together_lora_id", "verbatim_ultimos", "_mem_drop_report",
+    )
 
     def render_sidebar(self, sb) -> None:
         """Default: sem opções específicas."""
@@ -49,6 +49,16 @@ class _Settings:
     MONGO_CLUSTER: str = _pick("MONGO_CLUSTER", default="")
     MONGO_DB: str = _pick("MONGO_DB", default=APP_NAME)
 
+    # Cache compartilhado de facts/histórico (core.cache)
+    CACHE_TTL: str = _pick("CACHE_TTL", default="30")
+    CACHE_MAX_ENTRIES: str = _pick("CACHE_MAX_ENTRIES", default="2048")
+    CACHE_MAX_BYTES: str = _pick("CACHE_MAX_BYTES", default=str(64 * 1024 * 1024))
+    # memory | redis (L1 local + L2 Redis compartilhado entre réplicas)
+    CACHE_BACKEND: str = _pick("CACHE_BACKEND", default="memory")
+    REDIS_URL: str = _pick("REDIS_URL", default="redis://localhost:6379/0")
+    # 1 = invalida caches via change streams do Mongo (permite CACHE_TTL bem maior)
+    CACHE_WATCH: str = _pick("CACHE_WATCH", default="0")
+
     # LLM timeout
     LLM_HTTP_TIMEOUT: str = _pick("LLM_HTTP_TIMEOUT", default="60")
 
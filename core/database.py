@@ -2,12 +2,14 @@
 from __future__ import annotations
 
 from typing import Any, Dict, List, Optional, Iterable, Tuple
+import threading
 from threading import RLock
 import os
 import uuid
 import datetime as _dt
 
 from .config import settings
+from . import metrics
 
 # ===================== Estado global do backend =====================
 _BACKEND = (os.getenv("DB_BACKEND", "").strip().lower() or "memory")
@@ -26,8 +28,42 @@ if settings.mongo_uri():
     if env_choice == "":
         _BACKEND = "mongo"
 
+# ===================== Instrumentação (chamadas ao banco por thread/turno) =====================
+_TL = threading.local()
+_DB_OPS = metrics.counter("db_ops_total", "Operações de banco por coleção", ["collection", "op"])
+_DB_SERIES: Dict[Tuple[str, str], Any] = {}
+_DB_TURN = metrics.histogram("db_calls_per_turn", "Chamadas ao banco por turno de geração",
+                             buckets=(1, 2, 3, 5, 8, 12, 20, 40, 80))
+
+def _count(op: str, name: str) -> None:
+    calls = getattr(_TL, "calls", None)
+    if calls is None:
+        calls = _TL.calls = {}
+    key = f"{name}.{op}"
+    calls[key] = calls.get(key, 0) + 1
+    series = _DB_SERIES.get((name, op))
+    if series is None:
+        series = _DB_SERIES[(name, op)] = _DB_OPS.labels(collection=name, op=op)
+    series.inc()
+
+def reset_db_calls() -> None:
+    """Zera o contador da thread atual (chame no início do turno)."""
+    _TL.calls = {}
+
+def db_call_stats() -> Dict[str, Any]:
+    """{"total": n, "by_op": {"state_data.find_one": 1, ...}} desde o último reset nesta thread."""
+    calls = dict(getattr(_TL, "calls", None) or {})
+    return {"total": sum(calls.values()), "by_op": calls}
+
+def end_turn_db_calls() -> Dict[str, Any]:
+    """db_call_stats() do turno que terminou nesta thread + observa o histograma."""
+    stats = db_call_stats()
+    _DB_TURN.observe(stats["total"])
+    return stats
+
 # ===================== Implementação: Memória =====================
 _STORE: Dict[str, List[Dict[str, Any]]] = {}
+_INDEXES: Dict[str, Dict[str, Dict[str, Any]]] = {}
 _LOCK = RLock()
 
 def _get_nested(d: Dict[str, Any], dotted: str, default=None):
@@ -58,37 +94,176 @@ def _unset_nested(d: Dict[str, Any], dotted: str) -> None:
         cur = cur[p]
     cur.pop(parts[-1], None)
 
+_MISSING = object()
+
+def _cmp(value: Any, op: str, arg: Any) -> bool:
+    if op == "$in":
+        if isinstance(value, list):
+            return any(v in arg for v in value)
+        return value in arg
+    if op == "$nin":
+        return not _cmp(value, "$in", arg)
+    if op == "$exists":
+        return (value is not _MISSING) == bool(arg)
+    if op == "$ne":
+        return (None if value is _MISSING else value) != arg
+    if op == "$eq":
+        return (None if value is _MISSING else value) == arg
+    if value is _MISSING or value is None:
+        return False
+    try:
+        if op == "$gt":
+            return value > arg
+        if op == "$gte":
+            return value >= arg
+        if op == "$lt":
+            return value < arg
+        if op == "$lte":
+            return value <= arg
+    except TypeError:
+        return False
+    return False
+
 def _match_simple(doc: Dict[str, Any], filt: Optional[Dict[str, Any]]) -> bool:
     if not filt:
         return True
     for k, v in filt.items():
-        # suporte mínimo a $in e chaves pontilhadas
-        if isinstance(v, dict) and "$in" in v:
-            if "." in k:
-                value = _get_nested(doc, k, None)
-            else:
-                value = doc.get(k)
-            if value not in v["$in"]:
+        if k == "$or":
+            if not any(_match_simple(doc, f) for f in v):
                 return False
-        else:
-            if "." in k:
-                if _get_nested(doc, k, object()) != v:
-                    return False
-            else:
-                if doc.get(k) != v:
-                    return False
+            continue
+        # suporte mínimo a operadores ($in/$nin/$exists/$ne/$eq/$gt/$gte/$lt/$lte) e chaves pontilhadas
+        value = _get_nested(doc, k, _MISSING)
+        if isinstance(v, dict) and v and all(str(op).startswith("$") for op in v):
+            if not all(_cmp(value, op, arg) for op, arg in v.items()):
+                return False
+        elif isinstance(value, list) and not isinstance(v, list):
+            # igual ao Mongo: campo lista casa se contiver o valor
+            if v not in value:
+                return False
+        elif (None if value is _MISSING else value) != v:
+            return False
     return True
 
+def _sort_key(value: Any):
+    # None/ausente primeiro (como no Mongo); tipos mistos não quebram a ordenação
+    if value is None:
+        return (0, 0, "")
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return (1, value, "")
+    if isinstance(value, _dt.datetime):
+        return (2, value.timestamp(), "")
+    return (3, 0, str(value))
+
+def _apply_update(d: Dict[str, Any], update: Dict[str, Any], inserting: bool) -> None:
+    """Aplica $set/$unset/$inc/$push/$setOnInsert (ou substituição simples) em d."""
+    if not any(str(k).startswith("$") for k in update):
+        d.update(update)
+        return
+    for k, v in (update.get("$setOnInsert") or {}).items() if inserting else ():
+        _set_nested(d, k, v)
+    for k, v in (update.get("$set") or {}).items():
+        _set_nested(d, k, v)
+    for k in (update.get("$unset") or {}).keys():
+        _unset_nested(d, k)
+    for k, v in (update.get("$inc") or {}).items():
+        cur = _get_nested(d, k, 0) or 0
+        _set_nested(d, k, cur + v)
+    for k, v in (update.get("$push") or {}).items():
+        cur = _get_nested(d, k, None)
+        if not isinstance(cur, list):
+            cur = []
+            _set_nested(d, k, cur)
+        if isinstance(v, dict) and "$each" in v:
+            cur.extend(v["$each"])
+            if isinstance(v.get("$slice"), int):
+                keep = v["$slice"]
+                cur[:] = cur[keep:] if keep < 0 else cur[:keep]
+        else:
+            cur.append(v)
+
+class MemoryCursor:
+    """
+    Cursor preguiçoso (subset do pymongo): sort/skip/limit encadeáveis;
+    a consulta só roda ao iterar.
+    """
+
+    def __init__(self, name: str, filt: Optional[Dict[str, Any]] = None):
+        self._name = name
+        self._filt = filt
+        self._sort: List[Tuple[str, int]] = []
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key_or_list, direction: int = 1) -> "MemoryCursor":
+        if isinstance(key_or_list, str):
+            self._sort = [(key_or_list, direction)]
+        else:
+            self._sort = list(key_or_list or [])
+        return self
+
+    def skip(self, n: int) -> "MemoryCursor":
+        self._skip = max(0, int(n or 0))
+        return self
+
+    def limit(self, n: int) -> "MemoryCursor":
+        self._limit = max(0, int(n or 0))
+        return self
+
+    def _rows(self) -> List[Dict[str, Any]]:
+        with _LOCK:
+            rows = [d for d in _STORE.get(self._name, []) if _match_simple(d, self._filt)]
+        if self._sort:
+            # aplica múltiplas chaves, da última para a primeira (sort estável)
+            for key, direction in reversed(self._sort):
+                rows.sort(key=lambda x: _sort_key(_get_nested(x, key, None)), reverse=(direction or 1) < 0)
+        end = self._skip + self._limit if self._limit else None
+        return [d.copy() for d in rows[self._skip:end]]
+
+    def __iter__(self):
+        return iter(self._rows())
+
+    def __len__(self) -> int:
+        return len(self._rows())
+
+    def __getitem__(self, i):
+        return self._rows()[i]
+
 class MemoryCollection:
     def __init__(self, name: str):
         self.name = name
         _STORE.setdefault(name, [])
+        _INDEXES.setdefault(name, {})
+
+    def create_index(self, keys, unique: bool = False, **_: Any) -> str:
+        """Registra o índice; unique=True é verificado em inserts/upserts."""
+        if isinstance(keys, str):
+            keys = [(keys, 1)]
+        keys = [(k, d) for k, d in keys]
+        name = "_".join(f"{k}_{d}" for k, d in keys)
+        with _LOCK:
+            _INDEXES[self.name][name] = {"keys": [k for k, _ in keys], "unique": bool(unique)}
+        return name
+
+    def _check_unique(self, doc: Dict[str, Any]) -> None:
+        for spec in _INDEXES.get(self.name, {}).values():
+            if not spec["unique"]:
+                continue
+            key = tuple(_get_nested(doc, k, None) for k in spec["keys"])
+            for d in _STORE[self.name]:
+                if d is not doc and tuple(_get_nested(d, k, None) for k in spec["keys"]) == key:
+                    raise ValueError(f"duplicate key em {self.name}: {dict(zip(spec['keys'], key))}")
 
     def insert_one(self, doc: Dict[str, Any]) -> Dict[str, Any]:
+        _count("insert_one", self.name)
+        return self._insert(doc)
+
+    def _insert(self, doc: Dict[str, Any]) -> Dict[str, Any]:
         with _LOCK:
             d = dict(doc)
             d.setdefault("_id", str(uuid.uuid4()))
             d.setdefault("ts", _dt.datetime.utcnow())
+            self._check_unique(d)
             _STORE[self.name].append(d)
             return {"inserted_id": d["_id"]}
 
@@ -97,78 +272,68 @@ class MemoryCollection:
         filt: Optional[Dict[str, Any]] = None,
         sort: Optional[List[Tuple[str, int]]] = None,
         limit: Optional[int] = None,
-    ) -> Iterable[Dict[str, Any]]:
-        with _LOCK:
-            rows = [d.copy() for d in _STORE.get(self.name, []) if _match_simple(d, filt)]
+    ) -> MemoryCursor:
+        _count("find", self.name)
+        cur = MemoryCursor(self.name, filt)
         if sort:
-            # aplica múltiplas chaves, da última para a primeira
-            for key, direction in reversed(sort):
-                rows.sort(
-                    key=lambda x: _get_nested(x, key, None),
-                    reverse=(direction or 1) < 0
-                )
+            cur.sort(sort)
         if limit:
-            rows = rows[:limit]
-        return rows
+            cur.limit(limit)
+        return cur
 
     def find_one(
         self,
         filt: Optional[Dict[str, Any]] = None,
         sort: Optional[List[Tuple[str, int]]] = None,
     ) -> Optional[Dict[str, Any]]:
-        rows = list(self.find(filt=filt, sort=sort, limit=1))
+        _count("find_one", self.name)
+        rows = list(MemoryCursor(self.name, filt).sort(sort or []).limit(1))
         return rows[0] if rows else None
 
     def update_one(self, filt: Dict[str, Any], update: Dict[str, Any], upsert: bool = False) -> None:
         """
         Suporta:
-          - $set com chaves pontilhadas
-          - $unset com chaves pontilhadas
-          - upsert
+          - $set / $unset com chaves pontilhadas
+          - $inc, $push (com $each/$slice), $setOnInsert
+          - upsert (campos de igualdade do filtro entram no doc novo)
         """
+        _count("update_one", self.name)
         with _LOCK:
             rows = _STORE.get(self.name, [])
 
             # tenta atualizar documento existente
             for d in rows:
                 if _match_simple(d, filt):
-                    if "$set" in update or "$unset" in update:
-                        if "$set" in update:
-                            for k, v in update["$set"].items():
-                                if "." in k:
-                                    _set_nested(d, k, v)
-                                else:
-                                    d[k] = v
-                        if "$unset" in update:
-                            for k in update["$unset"].keys():
-                                if "." in k:
-                                    _unset_nested(d, k)
-                                else:
-                                    d.pop(k, None)
-                    else:
-                        d.update(update)
+                    _apply_update(d, update, inserting=False)
                     return
 
             # se não encontrou e for upsert → cria
             if upsert:
-                new_doc: Dict[str, Any] = dict(filt)
-                if "$set" in update:
-                    for k, v in update["$set"].items():
-                        if "." in k:
-                            _set_nested(new_doc, k, v)
-                        else:
-                            new_doc[k] = v
-                else:
-                    new_doc.update(update)
-                self.insert_one(new_doc)
+                new_doc: Dict[str, Any] = {}
+                for k, v in (filt or {}).items():
+                    if not (isinstance(v, dict) and any(str(op).startswith("$") for op in v)):
+                        _set_nested(new_doc, k, v)
+                _apply_update(new_doc, update, inserting=True)
+                self._insert(new_doc)  # upsert é uma operação só (já contada como update_one)
 
     def delete_many(self, filt: Dict[str, Any]) -> int:
+        _count("delete_many", self.name)
         with _LOCK:
             rows = _STORE.get(self.name, [])
             before = len(rows)
             rows[:] = [d for d in rows if not _match_simple(d, filt)]
             return before - len(rows)
 
+    def distinct(self, field: str, filt: Optional[Dict[str, Any]] = None) -> List[Any]:
+        _count("distinct", self.name)
+        out: List[Any] = []
+        with _LOCK:
+            for d in _STORE.get(self.name, []):
+                v = _get_nested(d, field, None)
+                if v is not None and v not in out and _match_simple(d, filt):
+                    out.append(v)
+        return out
+
 # ===================== Implementação: Mongo (opcional) =====================
 _MONGO_OK = False
 _mongo_client = None
@@ -192,14 +357,21 @@ def _ensure_mongo():
         _mongo_client = None
         _mongo_db = None
 
+def mongo_database():
+    """Handle pymongo do banco da app (None se Mongo indisponível)."""
+    _ensure_mongo()
+    return _mongo_db if _MONGO_OK else None
+
 class MongoCollection:
     def __init__(self, name: str):
         _ensure_mongo()
         if not _MONGO_OK:
             raise RuntimeError("Mongo não inicializado.")
+        self.name = name
         self._col = _mongo_db.get_collection(name)
 
     def insert_one(self, doc: Dict[str, Any]) -> Dict[str, Any]:
+        _count("insert_one", self.name)
         d = dict(doc)
         d.setdefault("ts", _dt.datetime.utcnow())
         r = self._col.insert_one(d)
@@ -211,6 +383,7 @@ class MongoCollection:
         sort: Optional[List[Tuple[str, int]]] = None,
         limit: Optional[int] = None,
     ) -> Iterable[Dict[str, Any]]:
+        _count("find", self.name)
         cur = self._col.find(filt or {})
         if sort:
             cur = cur.sort(sort)
@@ -223,6 +396,7 @@ class MongoCollection:
         filt: Optional[Dict[str, Any]] = None,
         sort: Optional[List[Tuple[str, int]]] = None,
     ) -> Optional[Dict[str, Any]]:
+        _count("find_one", self.name)
         if sort:
             cur = self._col.find(filt or {}).sort(sort).limit(1)
             rows = list(cur)
@@ -230,11 +404,20 @@ class MongoCollection:
         return self._col.find_one(filt or {})
 
     def update_one(self, filt: Dict[str, Any], update: Dict[str, Any], upsert: bool = False) -> None:
+        _count("update_one", self.name)
         self._col.update_one(filt, update, upsert=upsert)
 
     def delete_many(self, filt: Dict[str, Any]) -> int:
+        _count("delete_many", self.name)
         return self._col.delete_many(filt or {}).deleted_count
 
+    def distinct(self, field: str, filt: Optional[Dict[str, Any]] = None) -> List[Any]:
+        _count("distinct", self.name)
+        return list(self._col.distinct(field, filt or {}))
+
+    def create_index(self, keys, unique: bool = False, **kw: Any) -> str:
+        return self._col.create_index(keys, unique=unique, **kw)
+
 # ===================== API pública =====================
 def get_col(name: str):
     """Retorna uma coleção de acordo com o backend atual."""
@@ -246,12 +429,35 @@ def get_col(name: str):
             return MemoryCollection(name)
     return MemoryCollection(name)
 
+_POOL_WARM: Dict[str, Any] = {"state": "frio", "ms": 0.0}
+
+
+def warm_pool() -> bool:
+    """Abre a 1ª conexão do pool (DNS SRV + TLS + handshake) com um ping; usado pelo warm-up."""
+    _ensure_mongo()
+    if not _MONGO_OK or _mongo_client is None:
+        _POOL_WARM["state"] = "indisponível"
+        return False
+    _POOL_WARM["state"] = "aquecendo"
+    t0 = _dt.datetime.now()
+    try:
+        _mongo_client.admin.command("ping")
+    except Exception:
+        _POOL_WARM["state"] = "falhou"
+        return False
+    _POOL_WARM.update(state="aquecido", ms=(_dt.datetime.now() - t0).total_seconds() * 1000.0)
+    return True
+
+
 def db_status() -> Tuple[str, str]:
     """(backend, detalhe)"""
     b = get_backend()
     if b == "mongo":
         _ensure_mongo()
         detail = "OK" if _MONGO_OK else "indisponível"
+        if _MONGO_OK and _POOL_WARM["state"] != "frio":
+            ms = f" em {_POOL_WARM['ms']:.0f} ms" if _POOL_WARM["state"] == "aquecido" else ""
+            detail += f" · pool {_POOL_WARM['state']}{ms}"
         return ("mongo", detail)
     return ("memory", "memória local")
 
@@ -4,15 +4,17 @@ from re import error as ReError
 
 from core.common.base_service import BaseCharacter
 from core.repositories import (
-    save_interaction, get_history_docs, set_fact, get_fact,
-    get_facts, last_event,
+    save_interaction, get_history_docs,
 )
 from core.rules import violou_mary, reforco_system
-from core.locations import infer_from_prompt
+from core.locations import update_location_from_prompt
+from core.facts_snapshot import FactsSnapshot
 from core.textproc import strip_metacena, formatar_roleplay_profissional
 from core.tokens import toklen
 from core.service_router import route_chat_strict
 from core.nsfw import nsfw_enabled
+from core.tracing import annotate_trace, traced
+from core.usage import annotate_turn
 
 # -------- util sentence split (sem look-behind variável)
 _SENT_END = re.compile(r'([.!?…]["”»\']?)\s+')
@@ -39,15 +41,13 @@ def _force_paragraphs(text: str, max_frases_por_par: int = 2, alvo_pars: Tuple[i
         chunks = head + [tail]
     return '\n\n'.join(chunks)
 
-def _memory_context(usuario_key: str) -> str:
-    try: f = get_facts(usuario_key) or {}
-    except Exception: f = {}
+def _memory_context(snap: FactsSnapshot) -> str:
+    f = snap.facts
     out = []
     if f.get("parceiro_atual"): out.append(f"RELACIONAMENTO: parceiro_atual={f['parceiro_atual']}")
     if "virgem" in f: out.append(f"STATUS ÍNTIMO: virgem={bool(f['virgem'])}")
     if f.get("primeiro_encontro"): out.append(f"PRIMEIRO_ENCONTRO: {f['primeiro_encontro']}")
-    try: ev = last_event(usuario_key, "primeira_vez")
-    except Exception: ev = None
+    ev = snap.last_event("primeira_vez")
     if ev:
         dt = ev.get("ts"); quando = dt.strftime("%Y-%m-%d %H:%M") if hasattr(dt,"strftime") else str(dt)
         out.append(f"EVENTO_CANÔNICO: primeira_vez em {quando} @ {ev.get('local') or '—'}")
@@ -94,20 +94,23 @@ def _pos_processar_seguro(texto: str, local_atual: str, max_frases_por_par=2) ->
     except ReError:
         return texto
 
+@traced("pipeline.generate_response", root=True)
 def generate_response(svc: BaseCharacter, usuario: str, prompt_usuario: str, model: str) -> str:
     char = (svc.name or "Mary").strip()
     usuario_key = usuario if char.lower()=="mary" else f"{usuario}::{char.lower()}"
+    annotate_trace(character=char.lower())  # uso/custo do turno vai para o personagem, não "pipeline"
+    annotate_turn(character=char.lower())
 
-    loc = infer_from_prompt(prompt_usuario) or ""
-    if loc: set_fact(usuario_key, "local_cena_atual", loc, {"fonte":"service"})
+    # um snapshot por turno: facts (1 find_one) + eventos (1 find); escrita write-through
+    snap = FactsSnapshot.load(usuario_key)
+    local_atual = update_location_from_prompt(snap, prompt_usuario, fonte="service")
 
     hist = _montar_historico(usuario_key, svc.history_boot())
-    local_atual = get_fact(usuario_key, "local_cena_atual", "") or ""
-    memo = _memory_context(usuario_key)
+    memo = _memory_context(snap)
 
-    flirt_mode = bool(get_fact(usuario_key, "flirt_mode", False))
-    nsfw_on = bool(nsfw_enabled(usuario_key))
-    parceiro = (get_fact(usuario_key, "parceiro_atual", "") or "").strip().lower()
+    flirt_mode = bool(snap.get("flirt_mode", False))
+    nsfw_on = bool(nsfw_enabled(usuario_key, snapshot=snap))
+    parceiro = (snap.get("parceiro_atual", "") or "").strip().lower()
     romance_on = (char.lower()=="laura" and parceiro in {"janio","jânio"})
 
     estilo_msg = {"role":"system","content": svc.style_guide(nsfw_on, flirt_mode, romance_on)}
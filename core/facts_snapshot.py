@@ -0,0 +1,95 @@
+# core/facts_snapshot.py
+"""
+FactsSnapshot: fatos + últimos eventos de um usuário, carregados uma vez por turno.
+
+- load(): facts (cache compartilhado → no máximo um find_one em 'state_data')
+  + um find em 'events' para os tipos pedidos.
+- get()/facts/last_event(): leituras locais, sem ida ao banco.
+- set()/delete(): write-through — grava no banco e aplica no snapshot. O cache
+  compartilhado NÃO recebe uma cópia do snapshot (ele é do início do turno e
+  apagaria fatos gravados no meio do turno via set_fact); vale o bump de versão
+  do set_fact/delete_fact e a próxima leitura relê do banco.
+"""
+from __future__ import annotations
+
+import copy
+from typing import Any, Dict, Iterable, Optional
+
+from .repositories import (
+    _delete_dotted, _events, delete_fact, get_facts_cached, set_fact,
+)
+
+DEFAULT_EVENT_TYPES = ("primeira_vez",)
+
+_MISSING = object()
+
+
+class FactsSnapshot:
+    def __init__(self, usuario: str, facts: Optional[Dict[str, Any]] = None,
+                 events: Optional[Dict[str, Optional[Dict[str, Any]]]] = None):
+        self.usuario = usuario
+        self._facts: Dict[str, Any] = facts or {}
+        self._events: Dict[str, Optional[Dict[str, Any]]] = events or {}
+
+    @classmethod
+    def load(cls, usuario: str, event_types: Iterable[str] = DEFAULT_EVENT_TYPES) -> "FactsSnapshot":
+        try:
+            facts = copy.deepcopy(get_facts_cached(usuario) or {})
+        except Exception:
+            facts = {}
+        snap = cls(usuario, facts)
+        snap.prefetch_events(event_types)
+        return snap
+
+    def prefetch_events(self, event_types: Iterable[str]) -> None:
+        """Último evento de cada tipo, em uma única consulta."""
+        tipos = [t for t in event_types if t and t not in self._events]
+        if not tipos:
+            return
+        for t in tipos:
+            self._events[t] = None
+        try:
+            for ev in _events().find({"usuario": self.usuario, "tipo": {"$in": tipos}},
+                                     sort=[("ts", -1), ("_id", -1)]):
+                if self._events.get(ev.get("tipo")) is None:
+                    self._events[ev.get("tipo")] = ev
+        except Exception:
+            pass
+
+    # ---------- leitura ----------
+    @property
+    def facts(self) -> Dict[str, Any]:
+        return self._facts
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Acesso raso ou pontilhado (mesma semântica de repositories.get_fact)."""
+        if key in self._facts:
+            return self._facts[key]
+        cur: Any = self._facts
+        for part in key.split("."):
+            if not isinstance(cur, dict) or part not in cur:
+                return default
+            cur = cur[part]
+        return cur
+
+    def last_event(self, tipo: str) -> Optional[Dict[str, Any]]:
+        if tipo not in self._events:
+            self.prefetch_events([tipo])
+        return self._events.get(tipo)
+
+    # ---------- escrita (write-through) ----------
+    def set(self, key: str, value: Any, meta: Optional[Dict[str, Any]] = None) -> None:
+        set_fact(self.usuario, key, value, meta)
+        cur = self._facts
+        parts = key.split(".")
+        for p in parts[:-1]:
+            if not isinstance(cur.get(p), dict):
+                cur[p] = {}
+            cur = cur[p]
+        cur[parts[-1]] = value
+
+    def delete(self, key: str) -> bool:
+        ok = delete_fact(self.usuario, key)
+        if ok:
+            _delete_dotted(self._facts, key)
+        return ok
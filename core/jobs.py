@@ -0,0 +1,324 @@
+# core/jobs.py
+"""
+Jobs de geração fora do script do Streamlit (o rerun não bloqueia esperando o LLM).
+
+- submit(fn, owner=..., **meta) → job_id; fn roda num ThreadPoolExecutor (JOB_WORKERS).
+- Dentro do job (thread-local): current_job(). Os provedores (openrouter/together)
+  registram o httpx.Client em uso (job.attach) e, se should_stream(), pedem stream=True
+  e vão preenchendo job.partial (stream_completion) — a UI lê isso no polling.
+- cancel(job_id): marca o job e fecha os clients registrados → a requisição em voo aborta;
+  check_cancelled() levanta JobCancelled nos pontos de controle (route_chat_strict).
+  JobCancelled herda de BaseException: os `except Exception` dos serviços (fallbacks,
+  resposta sintética, save_interaction) não a engolem. Cancel depois de fn() voltar não
+  vale: o job fica "done" com a resposta.
+- notify(kind, texto): avisos dos serviços (st.caption/info/warning/error). Dentro de um
+  job vão para job.meta["notices"] e a UI (_job_view) os desenha — a thread do pool não
+  escreve na página, cujo run já terminou. Fora de job, chama st.<kind> direto.
+- Streaming acumula também delta.tool_calls (message.tool_calls no retorno).
+- Persistência: cada mudança de status vai para JOBS_COLLECTION ("gen_jobs"); após um
+  refresh da página a sessão nova reencontra o job por owner (active_job/pending_result).
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from . import metrics
+from .usage import current_purpose
+
+try:
+    from core.database import get_col
+except Exception:
+    get_col = None
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_STREAM = os.getenv("JOB_STREAM", "1").strip().lower() not in {"0", "false", "no", "off"}
+JOBS_COLLECTION = os.getenv("JOBS_COLLECTION", "gen_jobs")
+JOB_KEEP = 200  # jobs finalizados mantidos em memória
+STREAM_PURPOSES = ("main", "tool-iteration")  # critic/polish/summary não aparecem como parcial
+FINAL = ("done", "error", "cancelled")
+
+_M_JOBS = metrics.counter("gen_jobs_total", "Jobs de geração finalizados", ("status",))
+_M_JOB_SECONDS = metrics.histogram("gen_job_seconds", "Duração dos jobs de geração (fila + execução)")
+
+
+class JobCancelled(BaseException):
+    """Job cancelado pelo usuário (BaseException de propósito, como asyncio.CancelledError)."""
+
+
+class Job:
+    def __init__(self, owner: str, meta: Dict[str, Any]):
+        self.id = uuid.uuid4().hex[:12]
+        self.owner = owner
+        self.meta = meta
+        self.status = "queued"
+        self.partial = ""
+        self.text = ""
+        self.error = ""
+        self.created = time.time()
+        self.finished: Optional[float] = None
+        self.cost = 0.0  # US$ das chamadas de LLM feitas pelo job (route_chat_strict)
+        self.on_done: Optional[Callable[["Job"], None]] = None
+        self._cancel = threading.Event()
+        self._clients: List[Any] = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    @property
+    def done(self) -> bool:
+        return self.status in FINAL
+
+    def attach(self, client: Any) -> None:
+        """Registra um cliente HTTP em uso; cancel() o fecha para abortar a requisição."""
+        with self._lock:
+            self._clients.append(client)
+        if self.cancelled:
+            _close(client)
+
+    def detach(self, client: Any) -> None:
+        with self._lock:
+            if client in self._clients:
+                self._clients.remove(client)
+
+    def cancel(self) -> None:
+        self._cancel.set()
+        with self._lock:
+            clients = list(self._clients)
+        for c in clients:
+            _close(c)
+
+    def to_doc(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id, "owner": self.owner, "status": self.status, "text": self.text,
+            "error": self.error, "created": self.created, "finished": self.finished, "cost": self.cost,
+            **{k: v for k, v in self.meta.items() if isinstance(v, (str, int, float, bool)) or v is None},
+        }
+
+
+def _close(client: Any) -> None:
+    try:
+        client.close()
+    except Exception:
+        pass
+
+
+_TL = threading.local()
+_JOBS: "OrderedDict[str, Job]" = OrderedDict()
+_LOCK = threading.Lock()
+_POOL: Dict[str, Optional[ThreadPoolExecutor]] = {"executor": None}
+
+
+def _executor() -> ThreadPoolExecutor:
+    with _LOCK:
+        ex = _POOL["executor"]
+        if ex is None:
+            ex = _POOL["executor"] = ThreadPoolExecutor(max_workers=max(1, JOB_WORKERS),
+                                                        thread_name_prefix="gen-job")
+        return ex
+
+
+def current_job() -> Optional[Job]:
+    return getattr(_TL, "job", None)
+
+
+def check_cancelled() -> None:
+    job = getattr(_TL, "job", None)
+    if job is not None and job.cancelled:
+        raise JobCancelled(job.id)
+
+
+def notify(kind: str, text: str, **kwargs: Any) -> None:
+    job = getattr(_TL, "job", None)
+    if job is not None:
+        job.meta.setdefault("notices", []).append({"kind": kind, "text": str(text), **kwargs})
+        return
+    try:
+        import streamlit as st
+        getattr(st, kind)(text, **kwargs)
+    except Exception:
+        pass
+
+
+def should_stream() -> bool:
+    return JOB_STREAM and getattr(_TL, "job", None) is not None and current_purpose() in STREAM_PURPOSES
+
+
+def _persist(job: Job, **extra: Any) -> None:
+    if not callable(get_col):
+        return
+    try:
+        get_col(JOBS_COLLECTION).update_one({"job_id": job.id}, {"$set": dict(job.to_doc(), **extra)}, upsert=True)
+    except Exception:
+        pass
+
+
+def _run(job: Job, fn: Callable[[], str]) -> None:
+    _TL.job = job
+    try:
+        if job.cancelled:
+            raise JobCancelled(job.id)
+        job.status = "running"
+        _persist(job)
+        text = fn()  # fn() voltou: o serviço já gravou o turno, um cancel tardio não desfaz
+        job.text = str(text or "")
+        job.status = "done"
+    except JobCancelled:
+        job.status = "cancelled"
+    except Exception as e:
+        job.error = f"{type(e).__name__}: {e}"
+        job.meta["traceback"] = traceback.format_exc()
+        job.status = "cancelled" if job.cancelled else "error"
+    finally:
+        _TL.job = None
+        job.finished = time.time()
+        _M_JOBS.labels(status=job.status).inc()
+        _M_JOB_SECONDS.observe(job.finished - job.created)
+        _persist(job, consumed=False)
+        if job.on_done is not None:
+            try:
+                job.on_done(job)
+            except Exception:
+                pass
+
+
+def submit(fn: Callable[[], str], *, owner: str, on_done: Optional[Callable[[Job], None]] = None,
+           **meta: Any) -> str:
+    """Enfileira fn() (sem argumentos, devolve o texto da resposta). Retorna o job_id."""
+    job = Job(owner, meta)
+    job.on_done = on_done
+    with _LOCK:
+        _JOBS[job.id] = job
+        finished = [k for k, j in _JOBS.items() if j.done]
+        for k in finished[: max(0, len(finished) - JOB_KEEP)]:
+            _JOBS.pop(k, None)
+    _persist(job, consumed=False)
+    _executor().submit(_run, job, fn)
+    return job.id
+
+
+def get(job_id: Optional[str]) -> Optional[Job]:
+    return _JOBS.get(job_id or "")
+
+
+def cancel(job_id: Optional[str]) -> bool:
+    job = get(job_id)
+    if job is None or job.done:
+        return False
+    job.cancel()
+    return True
+
+
+def active_job(owner: str) -> Optional[Job]:
+    """Job em fila/execução deste owner neste processo (sobrevive a refresh da página)."""
+    with _LOCK:
+        jobs = [j for j in _JOBS.values() if j.owner == owner and not j.done]
+    return jobs[-1] if jobs else None
+
+
+def pending_result(owner: str) -> Optional[Dict[str, Any]]:
+    """Último job finalizado e ainda não consumido por nenhuma sessão (doc persistido)."""
+    if not callable(get_col):
+        return None
+    try:
+        return get_col(JOBS_COLLECTION).find_one(
+            {"owner": owner, "consumed": False, "status": {"$in": list(FINAL)}}, sort=[("created", -1)])
+    except Exception:
+        return None
+
+
+def mark_consumed(job_id: str) -> None:
+    if not callable(get_col):
+        return
+    try:
+        get_col(JOBS_COLLECTION).update_one({"job_id": job_id}, {"$set": {"consumed": True}})
+    except Exception:
+        pass
+
+
+def jobs_stats() -> Dict[str, Any]:
+    with _LOCK:
+        jobs = list(_JOBS.values())
+    by: Dict[str, int] = {}
+    for j in jobs:
+        by[j.status] = by.get(j.status, 0) + 1
+    return {"workers": JOB_WORKERS, "stream": JOB_STREAM, **by}
+
+
+def _jobs_metrics():
+    for status, n in jobs_stats().items():
+        if status in ("queued", "running"):
+            yield ("gen_jobs_active", "gauge", "Jobs de geração em fila/execução", {"status": status}, n)
+
+
+metrics.register_collector(_jobs_metrics)
+
+
+# ===================== Streaming (SSE) =====================
+def stream_completion(client: Any, url: str, headers: Dict[str, str], body: Dict[str, Any],
+                      job: Job, label: str) -> Dict[str, Any]:
+    """
+    POST com stream=True (SSE no formato OpenAI). Os deltas vão para job.partial e o
+    retorno tem o mesmo formato da resposta não-stream (choices[0].message.content, usage).
+    """
+    parts: List[str] = []
+    calls: Dict[int, Dict[str, Any]] = {}  # tool_calls chegam fatiados por índice
+    usage: Dict[str, Any] = {}
+    model = body.get("model")
+    finish = None
+    job.partial = ""
+    with client.stream("POST", url, headers=headers, json=dict(body, stream=True)) as r:
+        if r.status_code >= 400:
+            r.read()
+            try:
+                err = r.json()
+            except Exception:
+                err = {"text": r.text}
+            raise RuntimeError(f"{label} {r.status_code}: {err.get('error') or err.get('message') or err}")
+        for line in r.iter_lines():
+            if job.cancelled:
+                raise JobCancelled(job.id)
+            if not line.startswith("data:"):
+                continue  # comentários SSE (": OPENROUTER PROCESSING") e linhas vazias
+            payload = line[5:].strip()
+            if payload == "[DONE]":
+                break
+            try:
+                chunk = json.loads(payload)
+            except ValueError:
+                continue
+            if chunk.get("error"):
+                raise RuntimeError(f"{label}: {chunk['error']}")
+            model = chunk.get("model") or model
+            usage = chunk.get("usage") or usage
+            for ch in chunk.get("choices") or []:
+                piece = (ch.get("delta") or {}).get("content")
+                if piece:
+                    parts.append(piece)
+                    job.partial += piece
+                for tc in (ch.get("delta") or {}).get("tool_calls") or []:
+                    acc = calls.setdefault(int(tc.get("index") or 0),
+                                           {"id": "", "type": "function", "function": {"name": "", "arguments": ""}})
+                    acc["id"] = tc.get("id") or acc["id"]
+                    acc["type"] = tc.get("type") or acc["type"]
+                    fn = tc.get("function") or {}
+                    acc["function"]["name"] += fn.get("name") or ""
+                    acc["function"]["arguments"] += fn.get("arguments") or ""
+                finish = ch.get("finish_reason") or finish
+    message: Dict[str, Any] = {"role": "assistant", "content": "".join(parts)}
+    if calls:
+        message["tool_calls"] = [calls[i] for i in sorted(calls)]
+    return {
+        "model": model,
+        "choices": [{"index": 0, "message": message, "finish_reason": finish}],
+        "usage": usage,
+    }
@@ -0,0 +1,258 @@
+# core/json_log.py
+"""
+Log das respostas em modo JSON (fala/pensamento/acao/meta) na coleção 'interacoes'.
+
+- Gravado no caminho de geração (uma vez por resposta), não na renderização.
+- Idempotente: cada doc leva `hash` = sha1(usuario|personagem|fala|pensamento|acao|meta)
+  com índice único parcial; a escrita é upsert com $setOnInsert (repetição = no-op).
+- Assíncrono: enqueue() só põe na fila; uma thread daemon grava em lotes
+  (JSONLOG_BATCH itens ou a cada JSONLOG_FLUSH_S) via bulk_write(ordered=False).
+- dedup_collection(): job avulso que preenche `hash` nos docs antigos, remove as
+  duplicatas (mantém o mais antigo) e cria o índice único.
+    python -m core.json_log --dedup [--dry-run]
+"""
+from __future__ import annotations
+
+import atexit
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from . import metrics
+
+JSONLOG_DB = os.getenv("JSONLOG_DB", "roleplay_mary")
+JSONLOG_COLLECTION = os.getenv("JSONLOG_COLLECTION", "interacoes")
+JSONLOG_BATCH = int(os.getenv("JSONLOG_BATCH", "50"))
+JSONLOG_FLUSH_S = float(os.getenv("JSONLOG_FLUSH_S", "2"))
+JSONLOG_MAX_QUEUE = 5000
+FIELDS = ("fala", "pensamento", "acao", "meta")
+
+_Q: "queue.Queue[tuple]" = queue.Queue(maxsize=JSONLOG_MAX_QUEUE)
+_INDEXED: set = set()
+_STATE: Dict[str, Any] = {"thread": None, "written": 0, "duplicates": 0, "dropped": 0, "last_error": ""}
+_LOCK = threading.Lock()
+
+_M_DOCS = metrics.counter("jsonlog_docs_total", "Respostas JSON enviadas ao log", ("result",))
+
+
+def parse_json_response(text: str) -> Optional[Dict[str, Any]]:
+    """Dict da resposta estruturada (tem ao menos um de FIELDS) ou None."""
+    s = (text or "").strip()
+    if not s.startswith("{"):
+        return None
+    try:
+        data = json.loads(s)
+    except ValueError:
+        return None
+    if isinstance(data, dict) and any(k in data for k in FIELDS):
+        return data
+    return None
+
+
+def content_hash(doc: Dict[str, Any]) -> str:
+    parts = [str(doc.get("usuario") or ""), str(doc.get("personagem") or "")]
+    parts += [str(doc.get(k) or "").strip() for k in FIELDS]
+    return hashlib.sha1("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+def build_doc(data: Dict[str, Any], *, user: str, personagem: str, modelo: str) -> Dict[str, Any]:
+    doc: Dict[str, Any] = {"usuario": user, "personagem": personagem}
+    doc.update({k: str(data.get(k) or "").strip() for k in FIELDS})
+    doc.update({
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "modelo": modelo,
+        "modo_json": True,
+    })
+    doc["hash"] = content_hash(doc)
+    return doc
+
+
+def ensure_index(coll: Any) -> None:
+    """Índice único em `hash` (parcial: docs antigos sem hash não colidem)."""
+    key = id(coll)
+    if key in _INDEXED:
+        return
+    coll.create_index("hash", unique=True, name="hash_unique",
+                      partialFilterExpression={"hash": {"$type": "string"}})
+    _INDEXED.add(key)
+
+
+def enqueue(coll: Any, data: Dict[str, Any], *, user: str, personagem: str, modelo: str) -> bool:
+    """Agenda a gravação (não bloqueia). False se não há coleção ou a fila está cheia."""
+    if coll is None:
+        return False
+    try:
+        _Q.put_nowait((coll, build_doc(data, user=user, personagem=personagem, modelo=modelo)))
+    except queue.Full:
+        _STATE["dropped"] += 1
+        _M_DOCS.labels(result="dropped").inc()
+        return False
+    _start_writer()
+    return True
+
+
+def _write(batch: List[tuple]) -> None:
+    from pymongo import UpdateOne
+
+    by_coll: Dict[int, tuple] = {}
+    for coll, doc in batch:
+        by_coll.setdefault(id(coll), (coll, []))[1].append(doc)
+    for coll, docs in by_coll.values():
+        try:
+            ensure_index(coll)
+            res = coll.bulk_write(
+                [UpdateOne({"hash": d["hash"]}, {"$setOnInsert": d}, upsert=True) for d in docs],
+                ordered=False,
+            )
+            new = int(res.upserted_count)
+            _STATE["written"] += new
+            _STATE["duplicates"] += len(docs) - new
+            _M_DOCS.labels(result="written").inc(new)
+            _M_DOCS.labels(result="duplicate").inc(len(docs) - new)
+        except Exception as e:
+            details = getattr(e, "details", None) or {}
+            errs = details.get("writeErrors") or []
+            dup = sum(1 for w in errs if w.get("code") == 11000)  # corrida entre processos = já gravado
+            new = int(details.get("nUpserted") or 0)
+            _STATE["written"] += new
+            _STATE["duplicates"] += dup
+            _M_DOCS.labels(result="written").inc(new)
+            _M_DOCS.labels(result="duplicate").inc(dup)
+            failed = len(errs) - dup if errs else len(docs) - new
+            if failed:
+                _STATE["last_error"] = f"{type(e).__name__}: {e}"[:300]
+                _M_DOCS.labels(result="error").inc(failed)
+
+
+def _drain(max_items: int) -> List[tuple]:
+    out: List[tuple] = []
+    while len(out) < max_items:
+        try:
+            out.append(_Q.get_nowait())
+        except queue.Empty:
+            break
+    return out
+
+
+def _run() -> None:
+    while True:
+        first = _Q.get()
+        deadline = time.monotonic() + JSONLOG_FLUSH_S
+        batch = [first]
+        while len(batch) < JSONLOG_BATCH:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                break
+            try:
+                batch.append(_Q.get(timeout=left))
+            except queue.Empty:
+                break
+        _write(batch)
+
+
+def _start_writer() -> None:
+    th = _STATE["thread"]
+    if th is not None and th.is_alive():
+        return
+    with _LOCK:
+        th = _STATE["thread"]
+        if th is None or not th.is_alive():
+            th = threading.Thread(target=_run, name="jsonlog-writer", daemon=True)
+            _STATE["thread"] = th
+            th.start()
+
+
+def flush() -> int:
+    """Grava o que está na fila nesta thread (usado no atexit). Retorna itens processados."""
+    n = 0
+    while True:
+        batch = _drain(JSONLOG_BATCH)
+        if not batch:
+            return n
+        _write(batch)
+        n += len(batch)
+
+
+atexit.register(flush)
+
+
+def jsonlog_stats() -> Dict[str, Any]:
+    return {"queued": _Q.qsize(), **{k: v for k, v in _STATE.items() if k != "thread"}}
+
+
+def _jsonlog_metrics():
+    yield ("jsonlog_queue_depth", "gauge", "Respostas JSON aguardando gravação", {}, _Q.qsize())
+
+
+metrics.register_collector(_jsonlog_metrics)
+
+
+# ===================== Dedup (job avulso) =====================
+def dedup_collection(coll: Any, dry_run: bool = False, batch: int = 500) -> Dict[str, int]:
+    """
+    Percorre a coleção em ordem de _id: o 1º doc de cada hash fica (ganha o campo `hash`
+    se não tinha), os demais são removidos. Ao final cria o índice único.
+    """
+    from pymongo import DeleteOne, UpdateOne
+
+    seen: set = set()
+    ops: List[Any] = []
+    stats = {"scanned": 0, "kept": 0, "removed": 0, "backfilled": 0}
+    proj = {"usuario": 1, "personagem": 1, "hash": 1, **{k: 1 for k in FIELDS}}
+
+    def _apply() -> None:
+        if ops and not dry_run:
+            coll.bulk_write(list(ops), ordered=False)
+        ops.clear()
+
+    for doc in coll.find({}, proj).sort("_id", 1):
+        stats["scanned"] += 1
+        h = content_hash(doc)
+        if h in seen:
+            ops.append(DeleteOne({"_id": doc["_id"]}))
+            stats["removed"] += 1
+        else:
+            seen.add(h)
+            stats["kept"] += 1
+            if doc.get("hash") != h:
+                ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"hash": h}}))
+                stats["backfilled"] += 1
+        if len(ops) >= batch:
+            _apply()
+    _apply()
+    if not dry_run:
+        _INDEXED.discard(id(coll))
+        ensure_index(coll)
+    return stats
+
+
+def _main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Dedup do log de respostas JSON")
+    ap.add_argument("--dedup", action="store_true", help="remove duplicatas e cria o índice único")
+    ap.add_argument("--dry-run", action="store_true", help="só conta, não altera nada")
+    args = ap.parse_args(argv)
+    if not args.dedup:
+        ap.print_help()
+        return 2
+
+    from pymongo import MongoClient
+    from .config import settings
+
+    uri = settings.mongo_uri()
+    if not uri:
+        print("MONGO_USER/MONGO_PASS/MONGO_CLUSTER ausentes.")
+        return 1
+    coll = MongoClient(uri, serverSelectionTimeoutMS=5000)[JSONLOG_DB][JSONLOG_COLLECTION]
+    print(json.dumps(dedup_collection(coll, dry_run=args.dry_run), ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(_main())
@@ -0,0 +1,98 @@
+# core/lexical_index.py
+"""
+Índice invertido incremental com pontuação BM25 (memória longa).
+
+- Tokens via core.textproc.search_tokens (minúsculas, sem acento, sem stopwords PT)
+  + redução leve de plural ("tempestades" → "tempestade", "anéis" → "anel").
+- Postings por termo em listas Python (append O(1)); o array NumPy de cada termo
+  é materializado sob demanda e descartado quando o termo recebe documento novo.
+- score() devolve um vetor denso (um valor por documento) calculado sem loop por doc.
+"""
+from __future__ import annotations
+
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from core.textproc import search_tokens
+
+
+def _stem(tok: str) -> str:
+    """Plural → singular, só nos casos regulares (suficiente para casar consulta e memória)."""
+    if len(tok) <= 3 or tok.isdigit():
+        return tok
+    if tok.endswith("oes") or tok.endswith("aes"):
+        return tok[:-3] + "ao"
+    if tok.endswith("eis") and len(tok) > 4:
+        return tok[:-3] + "el"
+    if tok.endswith("ns"):
+        return tok[:-2] + "m"
+    if tok.endswith("res") or tok.endswith("zes"):
+        return tok[:-2]
+    if tok.endswith("s") and not tok.endswith("ss"):
+        return tok[:-1]
+    return tok
+
+
+def analyze(text: str) -> List[str]:
+    return [_stem(t) for t in search_tokens(text)]
+
+
+class BM25Index:
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.n = 0
+        self.total_len = 0
+        self.doc_len = np.zeros(64, dtype=np.float32)
+        self._postings: Dict[str, Tuple[List[int], List[int]]] = {}  # termo -> (docs, tfs)
+        self._arrays: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+
+    def add(self, text: str, doc_pos: Optional[int] = None) -> int:
+        """Indexa um documento; doc_pos deve crescer monotonicamente (default: próximo)."""
+        pos = self.n if doc_pos is None else int(doc_pos)
+        if pos >= self.doc_len.shape[0]:
+            grown = np.zeros(max(64, (pos + 1) * 2), dtype=np.float32)
+            grown[:self.doc_len.shape[0]] = self.doc_len
+            self.doc_len = grown
+        toks = analyze(text)
+        self.doc_len[pos] = len(toks)
+        self.total_len += len(toks)
+        for term, tf in Counter(toks).items():
+            docs, tfs = self._postings.setdefault(term, ([], []))
+            docs.append(pos)
+            tfs.append(tf)
+            self._arrays.pop(term, None)
+        self.n = max(self.n, pos + 1)
+        return pos
+
+    def _postings_array(self, term: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        arr = self._arrays.get(term)
+        if arr is None:
+            p = self._postings.get(term)
+            if p is None:
+                return None
+            arr = self._arrays[term] = (np.asarray(p[0], dtype=np.int64), np.asarray(p[1], dtype=np.float32))
+        return arr
+
+    def score(self, query: str, size: Optional[int] = None) -> np.ndarray:
+        """BM25 da consulta contra todos os documentos (vetor denso de tamanho `size` ou n)."""
+        size = self.n if size is None else int(size)
+        out = np.zeros(size, dtype=np.float32)
+        if not self.n:
+            return out
+        avgdl = max(1e-6, self.total_len / float(self.n))
+        norm = self.k1 * (1.0 - self.b + self.b * self.doc_len[:size] / avgdl)
+        for term in set(analyze(query)):
+            arr = self._postings_array(term)
+            if arr is None:
+                continue
+            docs, tfs = arr
+            if size < self.n:
+                keep = docs < size
+                docs, tfs = docs[keep], tfs[keep]
+            df = docs.shape[0]
+            idf = np.log1p((self.n - df + 0.5) / (df + 0.5))
+            out[docs] += idf * tfs * (self.k1 + 1.0) / (tfs + norm[docs])
+        return out
@@ -1,6 +1,10 @@
 # core/locations.py
 from __future__ import annotations
 import re
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .facts_snapshot import FactsSnapshot
 
 # Dicionário opcional de equivalentes (mantenha o que você já tem)
 _CANON_EQUIVALENTES = {
@@ -46,3 +50,18 @@ def infer_from_prompt(prompt: str) -> str | None:
     if re.search(r"\b(chal[eé]|rota\s*do\s*lagarto|domingos\s*martins|montanha)\b", t):
         return "chalé rota do lagarto"
     return None
+
+
+def current_location(snapshot: "FactsSnapshot", key: str = "local_cena_atual") -> str:
+    return str(snapshot.get(key, "") or "")
+
+def update_location_from_prompt(snapshot: "FactsSnapshot", prompt: str, fonte: str = "service",
+                                key: str = "local_cena_atual") -> str:
+    """
+    Infere o local pelo prompt e grava via snapshot (write-through) só se mudou.
+    Retorna o local atual.
+    """
+    loc = infer_from_prompt(prompt) or ""
+    if loc and loc != current_location(snapshot, key):
+        snapshot.set(key, loc, {"fonte": fonte})
+    return current_location(snapshot, key)
@@ -0,0 +1,313 @@
+# core/memoria_compaction.py
+"""
+Compactação e retenção da memória longa ('memoria_longa').
+
+- Retenção por tag (opt-in): fragmentos com tag expirada (ex.: LORE_RETENTION="chat:180,mission:0";
+  vazio = nada expira; 0 = sem expiração para a tag) são apagados, a menos que tenham uma tag protegida (LORE_RETENTION_KEEP).
+- Quase-duplicatas: o fragmento mais recente ainda livre é o representante; entram no
+  grupo só os que têm cosseno >= limiar contra ELE (sem encadear A~B~C). O grupo é
+  consolidado no representante (tags unidas, vetor médio, contagem em "merged"),
+  opcionalmente resumido por LLM.
+- Incremental: do banco vêm só os fragmentos mais novos que a marca d'água do usuário
+  (coleção 'memoria_compaction') e, para cada um, até LORE_COMPACT_CANDIDATES vizinhos
+  antigos acima do limiar, achados no índice em memória da memória longa (o mesmo das
+  buscas). A retenção consulta só fragmentos com tag de prazo vencido.
+- Em background (opt-in, LORE_COMPACT_INTERVAL_S > 0): start_background_compaction() roda
+  compact_all() em uma thread daemon. Apaga/funde memórias do usuário: desligado por padrão.
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from core.memoria_longa import (
+    ANN_NPROBE, _bson_len, _col, _doc_vec, _epoch, _normalize, _pack_vec, _user_index, invalidate_index,
+)
+
+try:
+    from core.database import get_col
+except Exception:
+    get_col = None
+
+try:
+    from core.service_router import route_chat_strict
+except Exception:
+    route_chat_strict = None
+
+COMPACT_THRESHOLD = float(os.getenv("LORE_COMPACT_THRESHOLD", "0.92"))
+COMPACT_MAX_GROUP = int(os.getenv("LORE_COMPACT_MAX_GROUP", "12"))
+COMPACT_INTERVAL_S = float(os.getenv("LORE_COMPACT_INTERVAL_S", "0"))
+COMPACT_MODEL = os.getenv("LORE_COMPACT_MODEL", "")
+COMPACT_CANDIDATES = int(os.getenv("LORE_COMPACT_CANDIDATES", "8"))
+
+
+def _parse_retention(raw: str) -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    for part in (raw or "").split(","):
+        tag, _, days = part.partition(":")
+        try:
+            out[tag.strip()] = float(days)
+        except ValueError:
+            continue
+    return {k: v for k, v in out.items() if k}
+
+
+RETENTION_DAYS = _parse_retention(os.getenv("LORE_RETENTION", ""))
+RETENTION_KEEP = {t.strip() for t in os.getenv("LORE_RETENTION_KEEP", "pinned,canon").split(",") if t.strip()}
+
+
+def _state_col():
+    if not callable(get_col):
+        return None
+    try:
+        return get_col("memoria_compaction")
+    except Exception:
+        return None
+
+
+def _doc_bytes(d: Dict[str, Any]) -> int:
+    return 5 + sum(_bson_len(v) - 2 + len(str(k)) + 1 for k, v in d.items() if k != "_id")
+
+
+def _expired(d: Dict[str, Any], now: float) -> bool:
+    tags = [t for t in (d.get("tags") or []) if isinstance(t, str)]
+    if not tags or RETENTION_KEEP.intersection(tags):
+        return False
+    ts = _epoch(d.get("ts"))
+    for t in tags:
+        days = RETENTION_DAYS.get(t)
+        if days and ts and now - ts > days * 86400.0:
+            return True
+    return False
+
+
+def _summarize(texts: List[str], model: str) -> Optional[str]:
+    if not callable(route_chat_strict) or not model:
+        return None
+    prompt = (
+        "Consolide os fragmentos de memória abaixo em UM fragmento curto e factual, "
+        "sem inventar nada e preservando nomes, lugares e promessas.\n\n"
+        + "\n---\n".join(texts)
+    )
+    try:
+        data, used, prov = route_chat_strict(model, {
+            "model": model,
+            "messages": [{"role": "user", "content": prompt}],
+            "max_tokens": 300,
+            "temperature": 0.0,
+            "top_p": 0.9,
+            "purpose": "summary",
+        })
+        out = (data.get("choices", [{}])[0].get("message", {}) or {}).get("content", "") or ""
+        return out.strip() or None
+    except Exception:
+        return None
+
+
+def _expired_docs(col, usuario_key: str, now: float) -> List[Dict[str, Any]]:
+    """Fragmentos vencidos: uma consulta por tag com prazo (não varre o usuário inteiro)."""
+    out: Dict[Any, Dict[str, Any]] = {}
+    for tag, days in RETENTION_DAYS.items():
+        if not days:
+            continue
+        for d in col.find({"usuario_key": usuario_key, "tags": tag, "ts": {"$lt": now - days * 86400.0}}):
+            if _expired(d, now):
+                out.setdefault(d.get("hash"), d)
+    return list(out.values())
+
+
+def _candidates(usuario_key: str, new_docs: List[Dict[str, Any]], vecs: Dict[int, np.ndarray],
+                threshold: float) -> List[str]:
+    """Hashes de fragmentos antigos com cosseno >= threshold contra algum novo (índice da memória longa)."""
+    if COMPACT_CANDIDATES <= 0 or not new_docs:
+        return []
+    idx = _user_index(usuario_key)
+    new_h = {d.get("hash") for d in new_docs}
+    out: List[str] = []
+    for d in new_docs:
+        pos, scores = idx._vector_top(vecs[id(d)], COMPACT_CANDIDATES + len(new_h), None, ANN_NPROBE)
+        for p, sc in zip(pos.tolist(), scores.tolist()):
+            h = idx.docs[p].get("hash")
+            if sc >= threshold and h and h not in new_h and h not in out:
+                out.append(h)
+    return out
+
+
+def _groups(mat: np.ndarray, ts: List[float], is_new: List[bool], threshold: float) -> List[List[int]]:
+    """
+    Grupos (>1 linha, ao menos uma nova). Em ordem de recência, cada linha livre é o
+    representante e leva as livres com cosseno >= threshold contra ela (até COMPACT_MAX_GROUP).
+    """
+    order = sorted(range(mat.shape[0]), key=lambda i: ts[i], reverse=True)
+    free = np.ones(mat.shape[0], dtype=bool)
+    out: List[List[int]] = []
+    for r in order:
+        if not free[r]:
+            continue
+        sims = mat @ mat[r]
+        members = [j for j in order if j != r and free[j] and sims[j] >= threshold][:max(0, COMPACT_MAX_GROUP - 1)]
+        group = [r] + members
+        if len(group) > 1 and any(is_new[i] for i in group):
+            free[group] = False
+            out.append(group)
+    return out
+
+
+def compact_user(usuario_key: str, threshold: Optional[float] = None, summarize: bool = False,
+                 model: Optional[str] = None, full: bool = False, now: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Compacta a memória de um usuário. full=True ignora a marca d'água (todos contam como novos).
+    Retorna relatório: novos examinados, candidatos antigos, expirados, grupos/fundidos, bytes liberados.
+    """
+    threshold = COMPACT_THRESHOLD if threshold is None else float(threshold)
+    now = time.time() if now is None else float(now)
+    model = model or COMPACT_MODEL
+    col = _col()
+    rep: Dict[str, Any] = {"usuario_key": usuario_key, "new": 0, "candidates": 0, "expired": 0,
+                           "groups": 0, "merged": 0, "reclaimed": 0}
+
+    # ---- retenção por tag
+    expired = _expired_docs(col, usuario_key, now)
+    if expired:
+        col.delete_many({"usuario_key": usuario_key, "hash": {"$in": [d.get("hash") for d in expired]}})
+        rep["expired"] = len(expired)
+        rep["reclaimed"] += sum(_doc_bytes(d) for d in expired)
+    gone = {d.get("hash") for d in expired}
+
+    # ---- quase-duplicatas: novos desde a marca d'água + vizinhos antigos
+    state = _state_col()
+    hw = 0.0
+    if state is not None and not full:
+        try:
+            hw = float((state.find_one({"_id": usuario_key}) or {}).get("hw") or 0.0)
+        except Exception:
+            hw = 0.0
+    filt: Dict[str, Any] = {"usuario_key": usuario_key}
+    if hw > 0.0:
+        filt["ts"] = {"$gt": hw}
+    new_docs = [d for d in col.find(filt, sort=[("ts", 1), ("hash", 1)]) if d.get("hash") not in gone]
+    vecs: Dict[int, np.ndarray] = {}
+    for d in new_docs:
+        v = _doc_vec(d)
+        if v is not None and len(v):
+            vecs[id(d)] = _normalize(v)
+    new_docs = [d for d in new_docs if id(d) in vecs]
+    rep["new"] = len(new_docs)
+
+    old_docs: List[Dict[str, Any]] = []
+    if new_docs and not full:
+        cand = [h for h in _candidates(usuario_key, new_docs, vecs, threshold) if h not in gone]
+        if cand:
+            for d in col.find({"usuario_key": usuario_key, "hash": {"$in": cand}}):
+                v = _doc_vec(d)
+                if v is not None and len(v):
+                    vecs[id(d)] = _normalize(v)
+                    old_docs.append(d)
+    rep["candidates"] = len(old_docs)
+
+    by_dim: Dict[int, List[Dict[str, Any]]] = {}
+    for d in new_docs + old_docs:
+        by_dim.setdefault(vecs[id(d)].shape[0], []).append(d)
+    new_ids = {id(d) for d in new_docs}
+
+    removed: List[str] = []
+    for group_docs in by_dim.values():
+        mat = np.stack([vecs[id(d)] for d in group_docs])
+        ts = [_epoch(d.get("ts")) for d in group_docs]
+        is_new = [id(d) in new_ids for d in group_docs]
+        for g in _groups(mat, ts, is_new, threshold):
+            keep, drop = group_docs[g[0]], [group_docs[i] for i in g[1:]]
+            members = [keep] + drop
+            before = _doc_bytes(keep)
+            texto = keep.get("texto") or ""
+            if summarize:
+                texto = _summarize([m.get("texto") or "" for m in reversed(members)], model) or texto
+            tags = sorted({t for m in members for t in (m.get("tags") or []) if isinstance(t, str)})
+            mean = _normalize(np.mean([vecs[id(m)] for m in members], axis=0))
+            raw, fmt = _pack_vec(mean)
+            merged = sum(int(m.get("merged") or 1) for m in members)
+            col.update_one({"usuario_key": usuario_key, "hash": keep.get("hash")},
+                           {"$set": {"texto": texto, "tags": tags, "vecb": raw, "vfmt": fmt, "merged": merged},
+                            "$unset": {"vec": ""}})
+            keep.update({"texto": texto, "tags": tags, "vecb": raw, "vfmt": fmt, "merged": merged})
+            keep.pop("vec", None)
+            removed.extend(m.get("hash") for m in drop)
+            rep["groups"] += 1
+            rep["reclaimed"] += before - _doc_bytes(keep) + sum(_doc_bytes(m) for m in drop)
+
+    if removed:
+        col.delete_many({"usuario_key": usuario_key, "hash": {"$in": removed}})
+    rep["merged"] = len(removed)
+
+    if state is not None:
+        newest = max([hw] + [_epoch(d.get("ts")) for d in new_docs])
+        try:
+            state.update_one({"_id": usuario_key}, {"$set": {"hw": newest, "last_run": now,
+                                                             "last_report": dict(rep)}}, upsert=True)
+        except Exception:
+            pass
+    if expired or removed:  # só no fim: o índice em uso acima é o que fornece os candidatos
+        invalidate_index(usuario_key)
+    return rep
+
+
+def compact_all(usuario_keys: Optional[List[str]] = None, **kw: Any) -> Dict[str, Any]:
+    """Compacta vários usuários (default: todos presentes na coleção) e soma os relatórios."""
+    t0 = time.time()
+    if usuario_keys is None:
+        usuario_keys = sorted(k for k in _col().distinct("usuario_key") if k)  # sem trazer os vetores
+    total: Dict[str, Any] = {"users": 0, "new": 0, "candidates": 0, "expired": 0, "groups": 0,
+                             "merged": 0, "reclaimed": 0}
+    for key in usuario_keys:
+        try:
+            rep = compact_user(key, **kw)
+        except Exception:
+            continue
+        total["users"] += 1
+        for k in total:
+            if k != "users" and isinstance(rep.get(k), (int, float)):
+                total[k] += rep[k]
+    total["seconds"] = round(time.time() - t0, 3)
+    return total
+
+
+# ===================== Execução em background =====================
+_BG: Dict[str, Any] = {"thread": None, "last_report": None, "stop": threading.Event()}
+_BG_LOCK = threading.Lock()
+
+
+def last_report() -> Optional[Dict[str, Any]]:
+    return _BG["last_report"]
+
+
+def start_background_compaction(interval_s: Optional[float] = None, **kw: Any) -> bool:
+    """Inicia (uma vez por processo) a thread que roda compact_all() a cada interval_s segundos."""
+    interval_s = COMPACT_INTERVAL_S if interval_s is None else float(interval_s)
+    if interval_s <= 0:
+        return False
+    with _BG_LOCK:
+        th = _BG["thread"]
+        if th is not None and th.is_alive():
+            return False
+        stop: threading.Event = _BG["stop"]
+        stop.clear()
+
+        def _loop():
+            while not stop.wait(interval_s):
+                try:
+                    _BG["last_report"] = compact_all(**kw)
+                except Exception:
+                    pass
+
+        th = threading.Thread(target=_loop, name="lore-compaction", daemon=True)
+        _BG["thread"] = th
+        th.start()
+        return True
+
+
+def stop_background_compaction() -> None:
+    _BG["stop"].set()
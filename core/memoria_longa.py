@@ -1,51 +1,597 @@
 # core/memoria_longa.py
 from __future__ import annotations
-import os, time, math, hashlib, json
+import os, time, hashlib, json, zlib
+from collections import Counter, OrderedDict
+from threading import Event, RLock
 from typing import List, Dict, Any, Optional, Tuple
 
+import numpy as np
+
+from core.ann_index import IVFIndex, index_path
+from core.lexical_index import BM25Index
+from core.textproc import PT_STOPWORDS, search_tokens
+
 # DB
 try:
     from core.database import get_col
 except Exception:
     get_col = None
 
+try:
+    from core.cache import invalidation_bus
+except Exception:
+    invalidation_bus = None
+
+from core import metrics
+
+_LORE_SEARCH = metrics.histogram("lore_search_seconds", "Busca na memória longa", ["mode"])
+_LORE_SAVES = metrics.counter("lore_fragments_saved_total", "Fragmentos gravados (dup = já existia)", ["result"])
+
 # Embeddings (OpenAI >=1.0 recomendado; fallback determinístico)
+EMBED_MODEL_DEFAULT = "text-embedding-3-small"
+EMBED_BATCH = int(os.getenv("LORE_EMBED_BATCH", "128"))
+EMBED_CACHE_SIZE = int(os.getenv("LORE_EMBED_CACHE_SIZE", "4096"))
+
+_CLIENT: Optional[Tuple[str, Any]] = None  # (api_key, OpenAI)
+_CLIENT_LOCK = RLock()
+
+def _embed_model() -> str:
+    return os.environ.get("EMBED_MODEL", EMBED_MODEL_DEFAULT)
+
+def _openai_client():
+    """Cliente OpenAI reaproveitado entre chamadas (recriado só se a chave mudar)."""
+    global _CLIENT
+    api_key = os.environ.get("OPENAI_API_KEY") or os.environ.get("OPENAI_APIKEY")
+    if not api_key:
+        return None
+    with _CLIENT_LOCK:
+        if _CLIENT is None or _CLIENT[0] != api_key:
+            try:
+                from openai import OpenAI
+                _CLIENT = (api_key, OpenAI(api_key=api_key))
+            except Exception:
+                return None
+        return _CLIENT[1]
+
+def _embed_openai_many(texts: List[str], client: Any = None) -> List[Optional[List[float]]]:
+    out: List[Optional[List[float]]] = [None] * len(texts)
+    client = client or _openai_client()
+    if client is None:
+        return out
+    model = _embed_model()
+    for i in range(0, len(texts), EMBED_BATCH):
+        chunk = texts[i:i + EMBED_BATCH]
+        _emb_count("api_calls")  # só lotes de fato enviados ao provedor
+        try:
+            resp = client.embeddings.create(model=model, input=chunk)
+        except Exception:
+            continue
+        for item in resp.data:
+            j = getattr(item, "index", None)
+            if isinstance(j, int) and 0 <= j < len(chunk):
+                out[i + j] = item.embedding
+    return out
+
 def _embed_openai(text: str) -> Optional[List[float]]:
+    return _embed_openai_many([text])[0]
+
+# Fallback local (sem rede/GPU): TF com feature hashing de palavras, bigramas de palavras
+# e n-gramas de caracteres (3–5), peso sublinear 1+log(tf), sinal por hash, L2 normalizado.
+# crc32 (não o hash() do Python, que é salgado por processo) → determinístico entre processos.
+FALLBACK_DIM = int(os.getenv("LORE_FALLBACK_DIM", "512"))
+_NGRAM_WEIGHTS = {"w": 1.0, "b": 0.7, "c": 0.4}
+
+def _fallback_features(text: str) -> Counter:
+    words = search_tokens(text, drop_stopwords=False)
+    content = [w for w in words if w not in PT_STOPWORDS] or words
+    feats: Counter = Counter()
+    feats.update("w:" + w for w in content)
+    feats.update(f"b:{a}_{b}" for a, b in zip(content, content[1:]))
+    for w in content:
+        padded = f" {w} "
+        for n in (3, 4, 5):
+            if len(padded) < n:
+                break
+            feats.update("c:" + padded[i:i + n] for i in range(len(padded) - n + 1))
+    return feats
+
+def _embed_fallback(text: str, dim: Optional[int] = None) -> List[float]:
+    dim = int(dim or FALLBACK_DIM)
+    feats = _fallback_features(text)
+    if not feats:
+        return [0.0] * dim
+    keys = list(feats.keys())
+    hashed = np.fromiter((zlib.crc32(k.encode("utf-8")) for k in keys), dtype=np.uint64, count=len(keys))
+    tf = np.fromiter(feats.values(), dtype=np.float32, count=len(keys))
+    kind = np.fromiter((_NGRAM_WEIGHTS[k[0]] for k in keys), dtype=np.float32, count=len(keys))
+    sign = np.where((hashed >> np.uint64(31)) & np.uint64(1), -1.0, 1.0).astype(np.float32)
+    weights = sign * kind * (1.0 + np.log(tf))
+    vec = np.bincount((hashed % np.uint64(dim)).astype(np.int64), weights=weights, minlength=dim)
+    norm = float(np.linalg.norm(vec))
+    return (vec / norm if norm > 0.0 else vec).astype(np.float32).tolist()
+
+# ===================== Cache de embeddings (LRU em memória + coleção persistente) =====================
+# Só vetores do provedor entram no cache: o fallback é barato e não deve "grudar"
+# depois que a chave da OpenAI for configurada.
+_EMB_LRU: "OrderedDict[str, List[float]]" = OrderedDict()
+_EMB_LOCK = RLock()
+_EMB_STATS = {"hits_mem": 0, "hits_db": 0, "misses": 0, "api_calls": 0}
+
+def _emb_key(model: str, text: str) -> str:
+    return hashlib.sha1(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+def _emb_col():
+    if not callable(get_col):
+        return None
     try:
-        from openai import OpenAI
-        api_key = os.environ.get("OPENAI_API_KEY") or os.environ.get("OPENAI_APIKEY")
-        if not api_key:
-            return None
-        client = OpenAI(api_key=api_key)
-        model = os.environ.get("EMBED_MODEL", "text-embedding-3-small")
-        out = client.embeddings.create(model=model, input=text)
-        return out.data[0].embedding
+        return get_col("embed_cache")
     except Exception:
         return None
 
-def _embed_fallback(text: str, dim: int = 256) -> List[float]:
-    # hashing simples e estável (não semântico, mas funcional como fallback)
-    h = hashlib.sha256(text.encode("utf-8")).digest()
-    base = list(h) * (math.ceil(dim / len(h)))
-    base = base[:dim]
-    # normaliza 0..1
-    return [x / 255.0 for x in base]
+def _lru_get(key: str) -> Optional[List[float]]:
+    with _EMB_LOCK:
+        vec = _EMB_LRU.get(key)
+        if vec is not None:
+            _EMB_LRU.move_to_end(key)
+        return vec
+
+def _lru_put(key: str, vec: List[float]) -> None:
+    with _EMB_LOCK:
+        _EMB_LRU[key] = vec
+        _EMB_LRU.move_to_end(key)
+        while len(_EMB_LRU) > max(1, EMBED_CACHE_SIZE):
+            _EMB_LRU.popitem(last=False)
+
+def _emb_count(stat: str, n: int = 1) -> None:
+    with _EMB_LOCK:
+        _EMB_STATS[stat] += n
+
+def embed_cache_stats() -> Dict[str, int]:
+    with _EMB_LOCK:
+        return dict(_EMB_STATS, size=len(_EMB_LRU))
+
+def _embed_metrics():
+    st = embed_cache_stats()
+    for k, v in st.items():
+        if k == "size":
+            yield ("lore_embed_cache_entries", "gauge", "Embeddings no LRU em memória", {}, v)
+        else:
+            yield ("lore_embed_events_total", "counter", "Cache de embeddings (hits/misses/chamadas)", {"event": k}, v)
+
+metrics.register_collector(_embed_metrics)
+
+def clear_embed_cache() -> None:
+    """Limpa só o nível em memória (a coleção 'embed_cache' é mantida)."""
+    with _EMB_LOCK:
+        _EMB_LRU.clear()
+
+def embed_many(texts: List[str]) -> List[List[float]]:
+    """
+    Embeddings de vários textos com o mínimo de chamadas ao provedor:
+    LRU em memória → coleção 'embed_cache' → uma chamada em lote para o que faltar
+    (textos repetidos são embutidos uma vez só).
+    """
+    clean = [(t or "").strip() for t in texts]
+    client = _openai_client()
+    if client is None:  # sem chave: nada a buscar no cache (só vetores do provedor entram nele)
+        return [_embed_fallback(t) for t in clean]
+    model = _embed_model()
+    keys = [_emb_key(model, t) for t in clean]
+    found: Dict[str, List[float]] = {}
+
+    pending: List[str] = []
+    for k, t in zip(keys, clean):
+        if not t or k in found or k in pending:
+            continue
+        vec = _lru_get(k)
+        if vec is not None:
+            found[k] = vec
+            _emb_count("hits_mem")
+        else:
+            pending.append(k)
+
+    if pending:
+        col = _emb_col()
+        if col is not None:
+            try:
+                for d in col.find({"_id": {"$in": pending}}):
+                    vec = _doc_vec(d)
+                    if vec is not None and len(vec):
+                        vec = vec.tolist() if isinstance(vec, np.ndarray) else vec
+                        found[d["_id"]] = vec
+                        _lru_put(d["_id"], vec)
+                        _emb_count("hits_db")
+            except Exception:
+                pass
+        by_key = {k: t for k, t in zip(keys, clean)}
+        missing = [k for k in pending if k not in found]
+        if missing:
+            _emb_count("misses", len(missing))
+            vecs = _embed_openai_many([by_key[k] for k in missing], client)
+            for k, vec in zip(missing, vecs):
+                if not vec:
+                    continue
+                found[k] = vec
+                _lru_put(k, vec)
+                if col is not None:
+                    try:
+                        raw, fmt = _pack_vec(vec, "f32")
+                        col.update_one({"_id": k}, {"$set": {"model": model, "vecb": raw, "vfmt": fmt,
+                                                             "ts": time.time()}}, upsert=True)
+                    except Exception:
+                        pass
+
+    return [found.get(k) or _embed_fallback(t) for k, t in zip(keys, clean)]
 
 def embed(text: str) -> List[float]:
-    text = (text or "").strip()
-    if not text:
-        return _embed_fallback("")
-    vec = _embed_openai(text)
-    return vec if vec else _embed_fallback(text)
-
-def _cosine(a: List[float], b: List[float]) -> float:
-    if not a or not b or len(a) != len(b):
+    return embed_many([text])[0]
+
+def _normalize(vec: Any) -> np.ndarray:
+    v = np.asarray(vec, dtype=np.float32).ravel()
+    n = float(np.linalg.norm(v))
+    return v / n if n > 0.0 else v
+
+# ===================== Vetores empacotados (binário) =====================
+# Documentos novos guardam "vecb" (bytes) + "vfmt" em vez de "vec" (lista BSON de doubles):
+#   f32 → float32 LE;  f16 → float16 LE;  i8 → escala float32 LE + int8 (vec ≈ escala * q)
+VEC_FORMAT = os.getenv("LORE_VEC_FORMAT", "f16")
+_VEC_DTYPES = {"f32": "<f4", "f16": "<f2"}
+
+def _pack_vec(vec: Any, fmt: Optional[str] = None) -> Tuple[bytes, str]:
+    fmt = fmt or VEC_FORMAT
+    v = np.asarray(vec, dtype=np.float32).ravel()
+    if fmt == "i8":
+        scale = float(np.abs(v).max()) / 127.0 if v.size else 0.0
+        q = np.round(v / scale).astype(np.int8) if scale > 0 else np.zeros(v.shape, dtype=np.int8)
+        return np.float32(scale).astype("<f4").tobytes() + q.tobytes(), fmt
+    if fmt not in _VEC_DTYPES:
+        fmt = "f32"
+    return v.astype(_VEC_DTYPES[fmt]).tobytes(), fmt
+
+def _unpack_vec(raw: bytes, fmt: str) -> np.ndarray:
+    if fmt == "i8":
+        scale = np.frombuffer(raw, dtype="<f4", count=1)[0]
+        return np.frombuffer(raw, dtype=np.int8, offset=4).astype(np.float32) * scale
+    return np.frombuffer(raw, dtype=_VEC_DTYPES.get(fmt, "<f4"))
+
+def _doc_vec(doc: Dict[str, Any]) -> Optional[Any]:
+    """Vetor do documento, seja empacotado ("vecb") ou legado ("vec")."""
+    raw = doc.get("vecb")
+    if raw:
+        return _unpack_vec(bytes(raw), doc.get("vfmt") or "f32")
+    return doc.get("vec")
+
+def _bson_len(value: Any) -> int:
+    """Tamanho de um campo em BSON (exato com pymongo/bson; estimado sem ele)."""
+    try:
+        import bson
+        return len(bson.encode({"v": value})) - 5
+    except Exception:
+        pass
+    if isinstance(value, str):
+        return 3 + 4 + len(value.encode("utf-8")) + 1
+    if isinstance(value, (bytes, bytearray)):
+        return 3 + 4 + 1 + len(value)
+    if isinstance(value, (list, tuple)):
+        return 3 + 4 + 1 + sum(1 + len(str(i)) + 1 + 8 for i in range(len(value)))
+    return 0
+
+# ===================== Índice vetorial em memória (por usuario_key) =====================
+# IVF (aproximado) só entra acima de ANN_MIN_ROWS; nprobe=0 força busca exata.
+ANN_NPROBE = int(os.getenv("LORE_ANN_NPROBE", "16"))
+ANN_MIN_ROWS = int(os.getenv("LORE_ANN_MIN_ROWS", "20000"))
+ANN_SAVE_EVERY = int(os.getenv("LORE_ANN_SAVE_EVERY", "256"))
+
+# Busca híbrida (BM25 + vetor): fusão "rrf" ou "weighted"; recência com meia-vida em dias.
+HYBRID_FUSION = os.getenv("LORE_HYBRID_FUSION", "rrf")
+HYBRID_ALPHA = float(os.getenv("LORE_HYBRID_ALPHA", "0.5"))
+HYBRID_DEPTH = int(os.getenv("LORE_HYBRID_DEPTH", "50"))
+RRF_K = 60.0
+RECENCY_HALF_LIFE_DAYS = float(os.getenv("LORE_RECENCY_HALF_LIFE_DAYS", "30"))
+RECENCY_WEIGHT = float(os.getenv("LORE_RECENCY_WEIGHT", "0.2"))
+
+def _epoch(ts: Any) -> float:
+    if isinstance(ts, (int, float)):
+        return float(ts)
+    try:
+        return float(ts.timestamp())
+    except Exception:
         return 0.0
-    import math
-    dot = sum(x*y for x, y in zip(a, b))
-    na = math.sqrt(sum(x*x for x in a))
-    nb = math.sqrt(sum(x*x for x in b))
-    return (dot / (na * nb + 1e-9))
+
+class _Block:
+    """Matriz float32 (linhas normalizadas) de uma única dimensão, com crescimento amortizado."""
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.n = 0
+        self.mat = np.empty((0, dim), dtype=np.float32)
+        self.rows: List[int] = []                 # linha -> posição em _UserIndex.docs
+        self.tag_rows: Dict[str, List[int]] = {}  # tag -> linhas
+        self.ivf: Optional[IVFIndex] = None
+
+    def add(self, vec: np.ndarray, doc_pos: int, tags: List[str]) -> None:
+        if self.n == self.mat.shape[0]:
+            grown = np.empty((max(64, self.n * 2), self.dim), dtype=np.float32)
+            grown[:self.n] = self.mat[:self.n]
+            self.mat = grown
+        self.mat[self.n] = vec
+        if self.ivf is not None:
+            self.ivf.add(vec, self.n)
+        for t in tags:
+            self.tag_rows.setdefault(t, []).append(self.n)
+        self.rows.append(doc_pos)
+        self.n += 1
+
+    def candidates(self, allow_tags: Optional[List[str]]) -> Optional[np.ndarray]:
+        """Linhas permitidas pelo filtro de tags (None = todas)."""
+        if not allow_tags:
+            return None
+        mask = np.zeros(self.n, dtype=bool)
+        for t in allow_tags:
+            rows = self.tag_rows.get(t)
+            if rows:
+                mask[rows] = True
+        return np.flatnonzero(mask)
+
+
+class _UserIndex:
+    """
+    Todos os fragmentos de um usuário: metadados + um bloco por dimensão de embedding
+    (OpenAI e fallback podem coexistir no mesmo usuário) + índice BM25 do texto.
+    """
+
+    def __init__(self, key: str = ""):
+        self.key = key
+        self.docs: List[Dict[str, Any]] = []
+        self.hashes: set = set()
+        self.blocks: Dict[int, _Block] = {}
+        self.lex = BM25Index()
+        self.ts = np.zeros(64, dtype=np.float64)     # posição -> epoch (recência)
+        self.tag_pos: Dict[str, List[int]] = {}      # tag -> posições em docs
+
+    @classmethod
+    def from_docs(cls, docs, key: str = "") -> "_UserIndex":
+        idx = cls(key)
+        for d in docs:
+            idx.add(d)
+        return idx
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def add(self, doc: Dict[str, Any]) -> bool:
+        h = doc.get("hash")
+        if h and h in self.hashes:
+            return False
+        vec = _doc_vec(doc)
+        if vec is None or len(vec) == 0:
+            return False
+        v = _normalize(vec)
+        meta = {k: val for k, val in doc.items() if k not in ("vec", "vecb", "vfmt")}
+        pos = len(self.docs)
+        self.docs.append(meta)
+        if h:
+            self.hashes.add(h)
+        tags = [t for t in (doc.get("tags") or []) if isinstance(t, str)]
+        block = self.blocks.get(v.shape[0])
+        if block is None:
+            block = self.blocks[v.shape[0]] = _Block(v.shape[0])
+        block.add(v, pos, tags)
+        for t in tags:
+            self.tag_pos.setdefault(t, []).append(pos)
+        self.lex.add(str(doc.get("texto") or ""), pos)
+        if pos >= self.ts.shape[0]:
+            grown = np.zeros(self.ts.shape[0] * 2, dtype=np.float64)
+            grown[:pos] = self.ts[:pos]
+            self.ts = grown
+        self.ts[pos] = _epoch(doc.get("ts"))
+        return True
+
+    def _block_hashes(self, block: _Block) -> List[str]:
+        return [str(self.docs[p].get("hash") or "") for p in block.rows]
+
+    def _ivf_for(self, block: _Block) -> IVFIndex:
+        """IVF do bloco: carrega do disco (se houver chave), treina ou re-treina quando preciso."""
+        mat = block.mat[:block.n]
+        ivf = block.ivf
+        path = index_path(self.key, block.dim) if self.key else None
+        if ivf is None and path is not None:
+            ivf = IVFIndex.load(path, mat, self._block_hashes(block))
+        if ivf is None or ivf.needs_retrain(block.n):
+            ivf = IVFIndex.train(mat)
+            ivf.dirty = max(1, ivf.n)
+        if path is not None and ivf.dirty >= min(ANN_SAVE_EVERY, ivf.n):
+            try:
+                ivf.save(path, self._block_hashes(block))
+            except OSError:
+                pass
+        block.ivf = ivf
+        return ivf
+
+    def _vector_top(self, q: np.ndarray, k: int, allow_tags: Optional[List[str]],
+                    nprobe: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(posições em docs, cossenos) dos k melhores no bloco da dimensão de q, ordenados."""
+        empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+        block = self.blocks.get(q.shape[0])
+        if block is None or not block.n:
+            return empty
+        cand = block.candidates(allow_tags)
+        if nprobe > 0 and block.n >= ANN_MIN_ROWS:
+            probed = self._ivf_for(block).probe(q, nprobe)
+            cand = probed if cand is None else np.intersect1d(cand, probed, assume_unique=True)
+        mat = block.mat[:block.n] if cand is None else block.mat[cand]
+        if not mat.shape[0]:
+            return empty
+        scores = mat @ q
+        kk = min(k, scores.shape[0])
+        part = np.argpartition(-scores, kk - 1)[:kk]
+        order = part[np.argsort(-scores[part], kind="stable")]
+        rows = order if cand is None else cand[order]
+        return np.asarray(block.rows, dtype=np.int64)[rows], scores[order]
+
+    def search(self, qvec: Any, k: int, allow_tags: Optional[List[str]] = None,
+               nprobe: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Top-K por cosseno: um produto matriz-vetor + argpartition.
+        nprobe > 0 e bloco grande → IVF (aproximado); senão exato.
+        """
+        if k <= 0 or not self.docs:
+            return []
+        q = _normalize(qvec)
+        nprobe = ANN_NPROBE if nprobe is None else int(nprobe)
+        pos, _ = self._vector_top(q, k, allow_tags, nprobe)
+        out = [self.docs[p] for p in pos.tolist()]
+        # dimensões diferentes da consulta valem score 0 (mesma semântica do cosseno escalar legado)
+        if len(out) < k:
+            for dim, other in self.blocks.items():
+                if dim == q.shape[0]:
+                    continue
+                cand = other.candidates(allow_tags)
+                rows = range(other.n) if cand is None else cand.tolist()
+                for r in rows:
+                    out.append(self.docs[other.rows[r]])
+                    if len(out) >= k:
+                        return out
+        return out
+
+    def hybrid(self, query: str, qvec: Any, k: int, allow_tags: Optional[List[str]] = None,
+               nprobe: Optional[int] = None, fusion: Optional[str] = None,
+               alpha: Optional[float] = None, now: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        BM25 + cosseno sobre os `depth` melhores de cada lado, fundidos por RRF
+        (ou soma ponderada com alpha no cosseno), com filtro de tags e decaimento por recência.
+        """
+        n = len(self.docs)
+        if k <= 0 or not n:
+            return []
+        depth = max(HYBRID_DEPTH, 4 * k)
+        nprobe = ANN_NPROBE if nprobe is None else int(nprobe)
+        fusion = (fusion or HYBRID_FUSION).lower()
+        alpha = HYBRID_ALPHA if alpha is None else float(alpha)
+
+        lex = self.lex.score(query, n)
+        if allow_tags:
+            mask = np.zeros(n, dtype=bool)
+            for t in allow_tags:
+                rows = self.tag_pos.get(t)
+                if rows:
+                    mask[rows] = True
+            lex[~mask] = 0.0
+        hits = np.flatnonzero(lex > 0.0)
+        if hits.shape[0] > depth:
+            hits = hits[np.argpartition(-lex[hits], depth - 1)[:depth]]
+        lex_pos = hits[np.argsort(-lex[hits], kind="stable")]
+        vec_pos, vec_sc = self._vector_top(_normalize(qvec), depth, allow_tags, nprobe)
+
+        cand = np.union1d(lex_pos, vec_pos)
+        if not cand.shape[0]:
+            return []
+        fused = np.zeros(cand.shape[0], dtype=np.float64)
+        if fusion == "weighted":
+            cos = np.zeros(n, dtype=np.float32)
+            cos[vec_pos] = np.clip(vec_sc, 0.0, None)
+            top = float(lex[lex_pos[0]]) if lex_pos.shape[0] else 0.0
+            fused += alpha * cos[cand]
+            if top > 0.0:
+                fused += (1.0 - alpha) * lex[cand] / top
+        else:
+            for ranked in (lex_pos, vec_pos):
+                rank = np.full(n, -1, dtype=np.int64)
+                rank[ranked] = np.arange(ranked.shape[0])
+                r = rank[cand]
+                fused += np.where(r >= 0, 1.0 / (RRF_K + r + 1.0), 0.0)
+
+        if RECENCY_WEIGHT > 0.0 and RECENCY_HALF_LIFE_DAYS > 0.0:
+            now = time.time() if now is None else float(now)
+            age = np.clip(now - self.ts[cand], 0.0, None) / 86400.0
+            decay = np.power(0.5, age / RECENCY_HALF_LIFE_DAYS)
+            fused *= (1.0 - RECENCY_WEIGHT) + RECENCY_WEIGHT * decay
+
+        kk = min(k, cand.shape[0])
+        part = np.argpartition(-fused, kk - 1)[:kk]
+        order = part[np.argsort(-fused[part], kind="stable")]
+        return [self.docs[p] for p in cand[order].tolist()]
+
+
+_INDEX: Dict[str, _UserIndex] = {}
+_INDEX_LOCK = RLock()
+# carga a frio fora do lock global: um carregador por usuário (singleflight), os demais esperam;
+# _GEN muda a cada invalidação/gravação — carga que cruzou uma mudança não é instalada
+_LOADING: Dict[str, Event] = {}
+_GEN: Dict[str, int] = {}
+_GEN_ALL = [0]
+
+def invalidate_index(usuario_key: Optional[str] = None, broadcast: bool = True) -> None:
+    """
+    Descarta o índice em memória (de um usuário ou de todos).
+    Chame após qualquer escrita em 'memoria_longa' feita fora de save_fragment.
+    broadcast: avisa as outras réplicas (CACHE_BACKEND=redis) para descartarem o delas.
+    """
+    with _INDEX_LOCK:
+        if usuario_key is None:
+            _INDEX.clear()
+            _GEN_ALL[0] += 1
+        else:
+            _INDEX.pop(usuario_key, None)
+            _GEN[usuario_key] = _GEN.get(usuario_key, 0) + 1
+    if broadcast:
+        _publish_lore(usuario_key or "*")
+
+def _publish_lore(usuario_key: str) -> None:
+    if invalidation_bus is not None:
+        invalidation_bus.publish("lore", usuario_key)
+
+def _on_remote_lore(usuario_key: str) -> None:
+    invalidate_index(None if usuario_key == "*" else usuario_key, broadcast=False)
+
+if invalidation_bus is not None:
+    invalidation_bus.subscribe("lore", _on_remote_lore)
+
+def _user_index(usuario_key: str) -> _UserIndex:
+    while True:
+        with _INDEX_LOCK:
+            idx = _INDEX.get(usuario_key)
+            if idx is not None:
+                return idx
+            ev = _LOADING.get(usuario_key)
+            leader = ev is None
+            if leader:
+                ev = _LOADING[usuario_key] = Event()
+                gen = (_GEN_ALL[0], _GEN.get(usuario_key, 0))
+        if not leader:
+            ev.wait()
+            continue  # instalado pelo carregador (ou descartado: tenta de novo)
+        try:
+            # ordem estável (ts, hash) → atribuições do IVF persistido continuam válidas
+            docs = _col().find({"usuario_key": usuario_key}, sort=[("ts", 1), ("hash", 1)])
+            idx = _UserIndex.from_docs(docs, key=usuario_key)
+            with _INDEX_LOCK:
+                if gen == (_GEN_ALL[0], _GEN.get(usuario_key, 0)):
+                    _INDEX[usuario_key] = idx
+            return idx
+        finally:
+            with _INDEX_LOCK:
+                _LOADING.pop(usuario_key, None)
+            ev.set()
+
+def index_has(usuario_key: str, h: str) -> bool:
+    """True se o índice do usuário já está em memória e contém o fragmento (hash)."""
+    with _INDEX_LOCK:
+        idx = _INDEX.get(usuario_key)
+        return idx is not None and bool(h) and h in idx.hashes
+
+def preload_index(usuario_key: str) -> int:
+    """
+    Carrega (se ainda não estiver em memória) o índice do usuário e o IVF dos blocos
+    grandes — usado pelo prefetch na troca de personagem. Retorna nº de fragmentos.
+    """
+    if not usuario_key:
+        return 0
+    idx = _user_index(usuario_key)
+    for block in list(idx.blocks.values()):
+        if ANN_NPROBE > 0 and block.n >= ANN_MIN_ROWS and block.ivf is None:
+            idx._ivf_for(block)
+    return len(idx)
 
 def _col():
     if not callable(get_col):
@@ -56,6 +602,7 @@ def ensure_indexes() -> None:
     try:
         col = _col()
         col.create_index([("usuario_key", 1), ("tags", 1), ("ts", -1)])
+        col.create_index([("usuario_key", 1), ("ts", 1)])
         col.create_index([("usuario_key", 1), ("hash", 1)], unique=True)
     except Exception:
         pass
@@ -66,46 +613,135 @@ def _hash(text: str) -> str:
 def save_fragment(usuario_key: str, texto: str, tags: List[str] | None = None) -> Optional[str]:
     """
     Salva um fragmento canônico (curto e informativo).
-    Evita duplicatas por hash.
+    Evita duplicatas por hash (checado antes de gerar o embedding).
     """
     if not texto or not usuario_key:
         return None
+    try:
+        from core.repositories import defer_write
+        if defer_write(save_fragment, usuario_key, texto, tags):
+            return None
+    except ImportError:
+        pass
     try:
         col = _col()
-        vec = embed(texto)
+        h = _hash(usuario_key + "||" + texto)
+        # duplicata → nenhuma chamada de embedding
+        with _INDEX_LOCK:
+            idx = _INDEX.get(usuario_key)
+            if idx is not None and h in idx.hashes:
+                _LORE_SAVES.labels(result="dup").inc()
+                return h
+        if idx is None and col.find_one({"usuario_key": usuario_key, "hash": h}):
+            _LORE_SAVES.labels(result="dup").inc()
+            return h
         doc = {
             "usuario_key": usuario_key,
             "texto": texto,
             "tags": list(tags or []),
             "ts": time.time(),
-            "hash": _hash(usuario_key + "||" + texto),
-            "vec": vec,
+            "hash": h,
         }
+        doc["vecb"], doc["vfmt"] = _pack_vec(embed(texto))
         col.update_one({"usuario_key": usuario_key, "hash": doc["hash"]},
                        {"$setOnInsert": doc}, upsert=True)
+        # índice já carregado → append incremental (duplicatas são ignoradas pelo hash)
+        with _INDEX_LOCK:
+            idx = _INDEX.get(usuario_key)
+            if idx is not None:
+                idx.add(doc)
+            else:  # carga em andamento pode não ter visto este doc
+                _GEN[usuario_key] = _GEN.get(usuario_key, 0) + 1
+        _publish_lore(usuario_key)
+        _LORE_SAVES.labels(result="new").inc()
         return doc["hash"]
     except Exception:
+        _LORE_SAVES.labels(result="error").inc()
         return None
 
-def topk(usuario_key: str, query: str, k: int = 5, allow_tags: List[str] | None = None) -> List[Dict[str, Any]]:
+@metrics.timed(_LORE_SEARCH, mode="topk")
+def topk(usuario_key: str, query: str, k: int = 5, allow_tags: List[str] | None = None,
+         nprobe: Optional[int] = None) -> List[Dict[str, Any]]:
     """
     Retorna top-K fragmentos por similaridade. Se allow_tags for dada, filtra.
+    Considera todos os fragmentos do usuário (índice em memória, carregado uma vez).
+    nprobe: listas IVF sondadas (mais = mais recall, mais latência); 0 = busca exata.
+    Default: LORE_ANN_NPROBE.
     """
     if not query or not usuario_key:
         return []
     try:
-        col = _col()
-        q = {"usuario_key": usuario_key}
-        if allow_tags:
-            q["tags"] = {"$in": list(allow_tags)}
-        cur = col.find(q).limit(400)  # traz um lote e ranqueia em memória (simples)
-        vec_q = embed(query)
-        scored = []
-        for d in cur:
-            v = d.get("vec") or []
-            score = _cosine(vec_q, v) if v else 0.0
-            scored.append((score, d))
-        scored.sort(key=lambda t: t[0], reverse=True)
-        return [d for _, d in scored[:k]]
+        idx = _user_index(usuario_key)
+        if not len(idx):
+            return []
+        return idx.search(embed(query), k, allow_tags=allow_tags, nprobe=nprobe)
+    except Exception:
+        return []
+
+@metrics.timed(_LORE_SEARCH, mode="hybrid")
+def hybrid_topk(usuario_key: str, query: str, k: int = 5, allow_tags: List[str] | None = None,
+                fusion: Optional[str] = None, nprobe: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Top-K híbrido: BM25 (palavras-chave, sem acento) fundido com similaridade vetorial,
+    filtrado por tags e com leve preferência por fragmentos recentes.
+    fusion: "rrf" (default, LORE_HYBRID_FUSION) ou "weighted" (LORE_HYBRID_ALPHA no vetor).
+    """
+    if not query or not usuario_key:
+        return []
+    try:
+        idx = _user_index(usuario_key)
+        if not len(idx):
+            return []
+        return idx.hybrid(query, embed(query), k, allow_tags=allow_tags, nprobe=nprobe, fusion=fusion)
     except Exception:
         return []
+
+def migrate_vectors(fmt: Optional[str] = None, usuario_key: Optional[str] = None,
+                    dry_run: bool = False) -> Dict[str, Any]:
+    """
+    Converte documentos legados ("vec" em lista) para o formato empacotado.
+    Retorna relatório com bytes antes/depois (campo de vetor em BSON).
+    dry_run=True só conta e estima (não grava).
+    """
+    fmt = fmt or VEC_FORMAT
+    rep = {"fmt": fmt, "docs": 0, "converted": 0, "bytes_before": 0, "bytes_after": 0, "dry_run": bool(dry_run)}
+    col = _col()
+    for d in col.find({"usuario_key": usuario_key} if usuario_key else {}):
+        rep["docs"] += 1
+        vec = d.get("vec")
+        if not isinstance(vec, list) or not vec:
+            continue
+        raw, f = _pack_vec(vec, fmt)
+        if not dry_run:
+            col.update_one({"usuario_key": d.get("usuario_key"), "hash": d.get("hash")},
+                           {"$set": {"vecb": raw, "vfmt": f}, "$unset": {"vec": ""}})
+        rep["converted"] += 1
+        rep["bytes_before"] += _bson_len(vec)
+        rep["bytes_after"] += _bson_len(raw) + _bson_len(f)
+    if not dry_run:
+        invalidate_index(usuario_key)
+    if rep["bytes_before"]:
+        rep["ratio"] = round(rep["bytes_after"] / float(rep["bytes_before"]), 4)
+    return rep
+
+
+def _main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Manutenção da memória longa")
+    ap.add_argument("--migrate", action="store_true", help="empacota vetores legados (\"vec\" em lista)")
+    ap.add_argument("--fmt", choices=["f32", "f16", "i8"], default=None,
+                    help=f"formato do vetor (default LORE_VEC_FORMAT={VEC_FORMAT})")
+    ap.add_argument("--user", default=None, help="só este usuario_key")
+    ap.add_argument("--dry-run", action="store_true", help="só conta, não altera nada")
+    args = ap.parse_args(argv)
+    if not args.migrate:
+        ap.print_help()
+        return 2
+    rep = migrate_vectors(args.fmt, usuario_key=args.user, dry_run=args.dry_run)
+    print(json.dumps(rep, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(_main())
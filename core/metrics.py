@@ -0,0 +1,301 @@
+# core/metrics.py
+"""
+Registro de métricas no formato Prometheus (sem dependências).
+
+- counter()/gauge()/histogram(): idempotentes por nome (vários módulos podem declarar
+  a mesma métrica). .labels(**kv) devolve a série (guarde-a em variável no hot path).
+- Histogramas com buckets fixos: observe() = bisect + 2 somas.
+- timed(hist, **labels): decorator que observa a duração da função.
+- register_collector(fn): gauges calculados na hora do scrape (cache, filas etc.);
+  fn devolve [(nome, tipo, ajuda, {labels}, valor), ...].
+- Exposição: render() em texto Prometheus; start_metrics_exporter() sobe um HTTP
+  mínimo (METRICS_PORT, GET /metrics) e/ou grava METRICS_TEXTFILE a cada
+  METRICS_INTERVAL_S (textfile collector do node_exporter). Ambos em threads daemon.
+"""
+from __future__ import annotations
+
+import bisect
+import functools
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0") or 0)
+METRICS_ADDR = os.getenv("METRICS_ADDR", "0.0.0.0")
+METRICS_TEXTFILE = os.getenv("METRICS_TEXTFILE", "")
+METRICS_INTERVAL_S = float(os.getenv("METRICS_INTERVAL_S", "15"))
+PREFIX = os.getenv("METRICS_PREFIX", "p25_")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+Sample = Tuple[str, str, str, Dict[str, str], float]
+
+_REG_LOCK = threading.Lock()
+_METRICS: "Dict[str, _Metric]" = {}
+_COLLECTORS: List[Callable[[], Iterable[Sample]]] = []
+
+
+def _esc(v: Any) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(names: Sequence[str], values: Sequence[Any], extra: str = "") -> str:
+    parts = [f'{n}="{_esc(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt_num(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+
+class _Series:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, n: float = 1.0) -> None:
+        with self._lock:
+            self.value += n
+
+    def dec(self, n: float = 1.0) -> None:
+        with self._lock:
+            self.value -= n
+
+    def set(self, v: float) -> None:
+        self.value = float(v)
+
+
+class _HistSeries:
+    __slots__ = ("bounds", "counts", "sum", "count", "_lock")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, v: float) -> None:
+        i = bisect.bisect_left(self.bounds, v)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += v
+            self.count += 1
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, doc: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self._series: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def _new(self):
+        return _Series()
+
+    def labels(self, **kv: Any):
+        key = tuple(str(kv.get(n, "")) for n in self.labelnames)
+        s = self._series.get(key)
+        if s is None:
+            with self._lock:
+                s = self._series.setdefault(key, self._new())
+        return s
+
+    # atalhos para métricas sem labels
+    def inc(self, n: float = 1.0) -> None:
+        self.labels().inc(n)
+
+    def set(self, v: float) -> None:
+        self.labels().set(v)
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        for key, s in list(self._series.items()):
+            out.append(f"{self.name}{_fmt_labels(self.labelnames, key)} {_fmt_num(s.value)}")
+        return out
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, doc, labelnames)
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+
+    def _new(self):
+        return _HistSeries(self.buckets)
+
+    def observe(self, v: float) -> None:
+        self.labels().observe(v)
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} histogram"]
+        for key, s in list(self._series.items()):
+            with s._lock:
+                counts, total, n = list(s.counts), s.sum, s.count
+            acc = 0
+            for b, c in zip(self.buckets + (float("inf"),), counts):
+                acc += c
+                le = 'le="' + _fmt_num(b) + '"'
+                out.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, key, le)} {acc}")
+            out.append(f"{self.name}_sum{_fmt_labels(self.labelnames, key)} {_fmt_num(total)}")
+            out.append(f"{self.name}_count{_fmt_labels(self.labelnames, key)} {n}")
+        return out
+
+
+def _get(cls, name: str, doc: str, labelnames: Sequence[str], **kw: Any):
+    full = PREFIX + name
+    with _REG_LOCK:
+        m = _METRICS.get(full)
+        if m is None:
+            m = _METRICS[full] = cls(full, doc, labelnames, **kw)
+        return m
+
+
+def counter(name: str, doc: str, labelnames: Sequence[str] = ()) -> Counter:
+    return _get(Counter, name, doc, labelnames)
+
+
+def gauge(name: str, doc: str, labelnames: Sequence[str] = ()) -> Gauge:
+    return _get(Gauge, name, doc, labelnames)
+
+
+def histogram(name: str, doc: str, labelnames: Sequence[str] = (),
+              buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+    return _get(Histogram, name, doc, labelnames, buckets=buckets)
+
+
+def timed(hist: Histogram, errors: Optional[Counter] = None, **labels: Any) -> Callable:
+    """Decorator: observa a duração (s) em hist.labels(**labels); exceções contam em errors."""
+    series = hist.labels(**labels)
+    err = errors.labels(**labels) if errors is not None else None
+
+    def deco(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                if err is not None:
+                    err.inc()
+                raise
+            finally:
+                series.observe(time.perf_counter() - t0)
+        return wrapper
+    return deco
+
+
+def register_collector(fn: Callable[[], Iterable[Sample]]) -> None:
+    """fn() → [(nome, tipo, ajuda, {labels}, valor)], avaliado a cada scrape."""
+    with _REG_LOCK:
+        if fn not in _COLLECTORS:
+            _COLLECTORS.append(fn)
+
+
+def render() -> str:
+    lines: List[str] = []
+    with _REG_LOCK:
+        metrics = list(_METRICS.values())
+        collectors = list(_COLLECTORS)
+    for m in metrics:
+        lines.extend(m.render())
+    grouped: Dict[str, Tuple[str, str, List[str]]] = {}  # exposição exige amostras agrupadas por nome
+    for fn in collectors:
+        try:
+            samples = list(fn())
+        except Exception:
+            continue
+        for name, kind, doc, labels, value in samples:
+            full = PREFIX + name
+            grp = grouped.setdefault(full, (kind, doc, []))
+            grp[2].append(f"{full}{_fmt_labels(list(labels), list(labels.values()))} {_fmt_num(float(value))}")
+    for full, (kind, doc, rows) in grouped.items():
+        lines.append(f"# HELP {full} {doc}")
+        lines.append(f"# TYPE {full} {kind}")
+        lines.extend(rows)
+    return "\n".join(lines) + "\n"
+
+
+# ===================== Exposição =====================
+def _make_server(port: int):
+    """http.server só é importado se o exporter HTTP for ligado (METRICS_PORT)."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self):  # noqa: N802 (API do http.server)
+            if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args: Any) -> None:
+            pass
+
+    return ThreadingHTTPServer((METRICS_ADDR, port), _Handler)
+
+
+def write_textfile(path: str) -> None:
+    """Grava atomicamente (tmp + rename), como pede o textfile collector."""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        fh.write(render())
+    os.replace(tmp, path)
+
+
+_EXPORTER: Dict[str, Any] = {"server": None, "writer": None}
+_EXPORTER_LOCK = threading.Lock()
+
+
+def start_metrics_exporter(port: Optional[int] = None, textfile: Optional[str] = None) -> Dict[str, Any]:
+    """Sobe (uma vez por processo) o HTTP /metrics e/ou o escritor de textfile."""
+    port = METRICS_PORT if port is None else int(port)
+    textfile = METRICS_TEXTFILE if textfile is None else textfile
+    with _EXPORTER_LOCK:
+        if port and _EXPORTER["server"] is None:
+            try:
+                srv = _make_server(port)
+                srv.daemon_threads = True
+                threading.Thread(target=srv.serve_forever, name="metrics-http", daemon=True).start()
+                _EXPORTER["server"] = srv
+            except OSError:
+                pass  # porta ocupada (ex.: outro processo do mesmo host já exporta)
+        if textfile and _EXPORTER["writer"] is None:
+            def _loop():
+                while True:
+                    try:
+                        write_textfile(textfile)
+                    except OSError:
+                        pass
+                    time.sleep(max(1.0, METRICS_INTERVAL_S))
+
+            th = threading.Thread(target=_loop, name="metrics-textfile", daemon=True)
+            th.start()
+            _EXPORTER["writer"] = th
+        srv = _EXPORTER["server"]
+        return {"port": srv.server_address[1] if srv else 0, "textfile": textfile if _EXPORTER["writer"] else ""}
@@ -1,20 +1,26 @@
 # core/nsfw.py
 from __future__ import annotations
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 import re
 from .repositories import get_fact
 
+if TYPE_CHECKING:
+    from .facts_snapshot import FactsSnapshot
+
 # (mantém os padrões se você ainda quiser usar em outro lugar,
 # mas o gate principal vai ser SÓ o override)
 
-def nsfw_enabled(usuario: str, local_atual: Optional[str] = None) -> bool:
+def nsfw_enabled(usuario: str, local_atual: Optional[str] = None,
+                 snapshot: Optional["FactsSnapshot"] = None) -> bool:
     """
     Gate NSFW SIMPLIFICADO:
       - Se nsfw_override == 'on'  -> True
       - Se nsfw_override == 'off' -> False
       - Se não tiver override, padrão = True (liberado)
+    Com snapshot do turno, lê dele (sem ida ao banco).
     """
-    override = (get_fact(usuario, "nsfw_override", "") or "").lower()
+    raw = snapshot.get("nsfw_override", "") if snapshot is not None else get_fact(usuario, "nsfw_override", "")
+    override = str(raw or "").lower()
     if override == "on":
         return True
     if override == "off":
@@ -3,7 +3,7 @@ from __future__ import annotations
 import os
 from typing import Any, Dict, List, Tuple
 
-import httpx
+from .jobs import current_job, should_stream, stream_completion
 
 # Lista de modelos “sugeridos” para a UI (pode ampliar à vontade)
 DEFAULT_MODELS = [
@@ -60,26 +60,39 @@ def chat(
         "max_tokens": max_tokens,
         "temperature": temperature,
         "top_p": top_p,
+        "usage": {"include": True},  # devolve tokens + custo (USD) no bloco usage
     }
     if extra:
         body.update(extra)
 
+    import httpx  # import tardio: o SDK HTTP só carrega na 1ª chamada de LLM
+
     timeout = float(os.getenv("LLM_HTTP_TIMEOUT", "60"))
     try:
         with httpx.Client(timeout=timeout) as client:
-            r = client.post(OPENROUTER_BASE_URL, headers=_headers(), json=body)
-            # Se a API retornar erro, exponha o corpo para debug
-            if r.status_code >= 400:
-                try:
-                    err = r.json()
-                except Exception:
-                    err = {"text": r.text}
-                raise RuntimeError(
-                    f"OpenRouter {r.status_code}: {err.get('error') or err.get('message') or err}"
-                )
-            data = r.json()
-            used = data.get("model") or model
-            return data, used, "openrouter"
+            job = current_job()
+            if job is not None:
+                job.attach(client)  # cancelar o job fecha o client e aborta a requisição
+            try:
+                if job is not None and should_stream():
+                    data = stream_completion(client, OPENROUTER_BASE_URL, _headers(), body, job, "OpenRouter")
+                    return data, data.get("model") or model, "openrouter"
+                r = client.post(OPENROUTER_BASE_URL, headers=_headers(), json=body)
+                # Se a API retornar erro, exponha o corpo para debug
+                if r.status_code >= 400:
+                    try:
+                        err = r.json()
+                    except Exception:
+                        err = {"text": r.text}
+                    raise RuntimeError(
+                        f"OpenRouter {r.status_code}: {err.get('error') or err.get('message') or err}"
+                    )
+                data = r.json()
+                used = data.get("model") or model
+                return data, used, "openrouter"
+            finally:
+                if job is not None:
+                    job.detach(client)  # o client fechado não fica preso ao job
     except httpx.TimeoutException as e:
         raise RuntimeError("OpenRouter: timeout") from e
     except httpx.HTTPError as e:
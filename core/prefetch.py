@@ -0,0 +1,114 @@
+# core/prefetch.py
+"""
+Prefetch do contexto de outro personagem (troca no seletor do main.py).
+
+- prefetch(usuario_key): em background (PREFETCH_WORKERS threads) aquece o cache
+  compartilhado com o que o 1º turno do personagem lê — facts (inclui o rolling summary,
+  que mora nos facts), a janela recente do histórico (get_history_docs_cached, mesmo
+  limite dos services) — e o índice da memória longa (memoria_longa.preload_index).
+- Idempotente: a mesma chave não é reenfileirada enquanto está em voo nem dentro de
+  PREFETCH_MIN_INTERVAL_S (≈ TTL do cache) desde a última carga.
+- Só leituras: o que foi escrito depois é descartado pela invalidação versionada do
+  cache, então um prefetch atrasado nunca serve dado velho.
+PREFETCH=0 desliga.
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Optional
+
+from . import metrics
+from .repositories import get_facts_cached, get_history_docs_cached
+
+PREFETCH_ENABLED = os.getenv("PREFETCH", "1").strip().lower() not in {"0", "false", "no", "off"}
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", "2"))
+PREFETCH_MIN_INTERVAL_S = float(os.getenv("PREFETCH_MIN_INTERVAL_S", "20"))
+HISTORY_LIMIT = 400  # default de get_history_docs_cached nos services (mesma chave de cache)
+
+_LOCK = threading.Lock()
+_POOL: Dict[str, Optional[ThreadPoolExecutor]] = {"executor": None}
+_INFLIGHT: set = set()
+_LAST: Dict[str, float] = {}  # usuario_key -> fim da última carga
+_STATS: Dict[str, float] = {"queued": 0, "skipped": 0, "done": 0, "errors": 0}
+
+_M_PREFETCH = metrics.counter("prefetch_total", "Prefetch de contexto por resultado", ("result",))
+_M_PREFETCH_SECONDS = metrics.histogram("prefetch_seconds", "Duração do prefetch por etapa", ("step",))
+
+
+def _executor() -> ThreadPoolExecutor:
+    with _LOCK:
+        ex = _POOL["executor"]
+        if ex is None:
+            ex = _POOL["executor"] = ThreadPoolExecutor(max_workers=max(1, PREFETCH_WORKERS),
+                                                        thread_name_prefix="prefetch")
+        return ex
+
+
+def _count(result: str) -> None:
+    with _LOCK:
+        _STATS[result] = _STATS.get(result, 0) + 1
+    _M_PREFETCH.labels(result=result).inc()
+
+
+def _step(name: str, fn, *args: Any) -> bool:
+    t0 = time.perf_counter()
+    try:
+        fn(*args)
+        return True
+    except Exception:
+        return False
+    finally:
+        _M_PREFETCH_SECONDS.labels(step=name).observe(time.perf_counter() - t0)
+
+
+def _run(usuario_key: str, extra_keys: Iterable[str]) -> None:
+    ok = _step("facts", get_facts_cached, usuario_key)
+    ok = _step("history", get_history_docs_cached, usuario_key, HISTORY_LIMIT) and ok
+    for k in extra_keys:  # chaves legadas (ex.: Mary sem sufixo)
+        ok = _step("history", get_history_docs_cached, k, HISTORY_LIMIT) and ok
+    try:
+        from .memoria_longa import preload_index
+        ok = _step("lore", preload_index, usuario_key) and ok
+    except Exception:
+        ok = False
+    with _LOCK:
+        _INFLIGHT.discard(usuario_key)
+        _LAST[usuario_key] = time.time()
+    _count("done" if ok else "errors")
+
+
+def prefetch(usuario_key: str, extra_keys: Iterable[str] = ()) -> bool:
+    """Agenda o aquecimento do contexto de usuario_key. False se desligado/já quente/em voo."""
+    if not PREFETCH_ENABLED or not usuario_key:
+        return False
+    now = time.time()
+    with _LOCK:
+        recent = now - _LAST.get(usuario_key, 0.0) < PREFETCH_MIN_INTERVAL_S
+        if usuario_key in _INFLIGHT or recent:
+            skip = True
+        else:
+            skip = False
+            _INFLIGHT.add(usuario_key)
+    if skip:
+        _count("skipped")
+        return False
+    _count("queued")
+    _executor().submit(_run, usuario_key, [k for k in extra_keys if k and k != usuario_key])
+    return True
+
+
+def prefetch_stats() -> Dict[str, Any]:
+    with _LOCK:
+        return dict(_STATS, inflight=len(_INFLIGHT), enabled=PREFETCH_ENABLED)
+
+
+def _prefetch_metrics():
+    with _LOCK:
+        n = len(_INFLIGHT)
+    yield ("prefetch_inflight", "gauge", "Prefetches de contexto em andamento", {}, n)
+
+
+metrics.register_collector(_prefetch_metrics)
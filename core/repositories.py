@@ -1,10 +1,14 @@
 # core/repositories.py
 from __future__ import annotations
 
-from typing import Any, Dict, List, Optional
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 from datetime import datetime
 
 from .database import get_col
+from .cache import user_cache
+from .tracing import traced
 
 # coleções
 _state  = lambda: get_col("state_data")
@@ -12,6 +16,50 @@ _hist   = lambda: get_col("history")
 _events = lambda: get_col("events")
 
 
+# ---------- escritas adiadas (geração especulativa) ----------
+_DEFER = threading.local()
+Write = Tuple[Callable[..., Any], tuple, dict]
+
+
+@contextmanager
+def deferred_writes() -> Iterator[List[Write]]:
+    """
+    Nesta thread, as escritas de turno (save_interaction, set_fact, delete_fact,
+    register_event, save_fragment da memória longa) vão para um buffer em vez do banco.
+    replay_writes(buf) as aplica depois, se o resultado for aproveitado.
+    """
+    buf: List[Write] = []
+    prev = getattr(_DEFER, "buf", None)
+    _DEFER.buf = buf
+    try:
+        yield buf
+    finally:
+        _DEFER.buf = prev
+
+
+def defer_write(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> bool:
+    """True se a escrita foi para o buffer (há deferred_writes() ativo nesta thread)."""
+    buf = getattr(_DEFER, "buf", None)
+    if buf is None:
+        return False
+    buf.append((fn, args, kwargs))
+    return True
+
+
+def replay_writes(buf: List[Write]) -> List[str]:
+    """
+    Aplica as escritas do buffer em ordem. Cada uma roda isolada: a que falhar é
+    registrada ("nome: erro") e as seguintes continuam. Retorna as falhas.
+    """
+    failed: List[str] = []
+    for fn, args, kwargs in buf:
+        try:
+            fn(*args, **kwargs)
+        except Exception as e:
+            failed.append(f"{getattr(fn, '__name__', fn)}: {e}")
+    return failed
+
+
 # ---------- helpers internos ----------
 def _delete_dotted(d: Dict[str, Any], dotted: str) -> bool:
     """
@@ -50,12 +98,29 @@ def _delete_dotted(d: Dict[str, Any], dotted: str) -> bool:
     return True
 
 
+def invalidate_user(usuario: str) -> None:
+    """Descarta (por versão) tudo que estiver em cache para o usuário."""
+    if usuario:
+        user_cache.bump_version(usuario)
+
+
+# ---------- Leituras com cache compartilhado (core.cache) ----------
+def get_facts_cached(usuario: str) -> Dict[str, Any]:
+    return user_cache.get_or_load(("facts", usuario), lambda: get_facts(usuario), owner=usuario)
+
+
+def get_history_docs_cached(usuario: str, limit: int = 400) -> List[Dict[str, Any]]:
+    return user_cache.get_or_load(("history", usuario, limit), lambda: get_history_docs(usuario, limit), owner=usuario)
+
+
 # ---------- Fatos ----------
+@traced("repo.get_facts")
 def get_facts(usuario: str) -> Dict[str, Any]:
     d = _state().find_one({"usuario": usuario})
     return d.get("fatos", {}) if d else {}
 
 
+@traced("repo.get_fact")
 def get_fact(usuario: str, key: str, default: Any = None) -> Any:
     d = _state().find_one({"usuario": usuario})
     if not d:
@@ -69,13 +134,17 @@ def get_fact(usuario: str, key: str, default: Any = None) -> Any:
     return cur
 
 
+@traced("repo.set_fact")
 def set_fact(usuario: str, key: str, value: Any, meta: Optional[Dict[str, Any]] = None) -> None:
+    if defer_write(set_fact, usuario, key, value, meta):
+        return
     meta = meta or {}
     _state().update_one(
         {"usuario": usuario},
         {"$set": {f"usuario": usuario, f"fatos.{key}": value, "meta": meta}},
         upsert=True
     )
+    invalidate_user(usuario)
 
 
 def _delete_dotted(root: Dict[str, Any], dotted_key: str) -> bool:
@@ -112,11 +181,14 @@ def _delete_dotted(root: Dict[str, Any], dotted_key: str) -> bool:
     return True
 
 
+@traced("repo.delete_fact")
 def delete_fact(usuario: str, key: str) -> bool:
     """
     Remove uma memória canônica (suporta chave pontilhada).
     Compatível com backend de memória e Mongo.
     """
+    if defer_write(delete_fact, usuario, key):
+        return True
     doc = _state().find_one({"usuario": usuario})
     if not doc:
         return False
@@ -127,14 +199,18 @@ def delete_fact(usuario: str, key: str) -> bool:
 
     # Atualiza 'fatos' como bloco (evita depender de $unset no backend memória)
     _state().update_one({"usuario": usuario}, {"$set": {"fatos": facts}}, upsert=True)
+    invalidate_user(usuario)
     return True
 
 
 # ---------- Histórico ----------
+@traced("repo.save_interaction")
 def save_interaction(usuario: str, mensagem_usuario: str, resposta_mary: str, model_tag: str) -> None:
     """
     Salva um turno de conversa. Mantém o campo legado 'resposta_mary' (UI depende dele).
     """
+    if defer_write(save_interaction, usuario, mensagem_usuario, resposta_mary, model_tag):
+        return
     _hist().insert_one({
         "usuario": usuario,
         "mensagem_usuario": mensagem_usuario,
@@ -142,8 +218,10 @@ def save_interaction(usuario: str, mensagem_usuario: str, resposta_mary: str, mo
         "model": model_tag,
         "ts": datetime.utcnow(),  # ordenação estável
     })
+    invalidate_user(usuario)
 
 
+@traced("repo.get_history_docs")
 def get_history_docs(usuario: str, limit: int = 400) -> List[Dict[str, Any]]:
     """
     Histórico por uma única chave de usuário/personagem.
@@ -156,6 +234,7 @@ def get_history_docs(usuario: str, limit: int = 400) -> List[Dict[str, Any]]:
     ))
 
 
+@traced("repo.get_history_docs_multi")
 def get_history_docs_multi(users_or_keys: List[str], limit: int = 400) -> List[Dict[str, Any]]:
     """
     Histórico unificado para várias chaves (ex.: ["Janio::laura", "Janio"]).
@@ -171,10 +250,50 @@ def get_history_docs_multi(users_or_keys: List[str], limit: int = 400) -> List[D
     ))
 
 
+@traced("repo.get_history_page")
+def get_history_page(users_or_keys: List[str], before: Any = None, limit: int = 40) -> List[Dict[str, Any]]:
+    """
+    Página de histórico para "carregar anteriores": os `limit` turnos mais novos com
+    ts < before (None = mais recentes), devolvidos em ordem asc.
+    """
+    keys = [k for k in (users_or_keys or []) if k]
+    if not keys:
+        return []
+    filt: Dict[str, Any] = {"usuario": {"$in": keys}}
+    if before is not None:
+        filt["ts"] = {"$lt": before}
+    docs = list(_hist().find(filt, sort=[("ts", -1), ("_id", -1)], limit=limit))
+    docs.reverse()
+    return docs
+
+
+@traced("repo.get_history_since")
+def get_history_since(users_or_keys: List[str], after: Any, limit: int = 200,
+                      after_id: Any = None) -> List[Dict[str, Any]]:
+    """
+    Turnos gravados depois do high-water mark (ts, _id), em ordem asc —
+    sync incremental do transcript (normalmente 0–2 docs por chamada).
+    Com after_id, docs com o mesmo ts e _id maior também entram (empate de timestamp).
+    """
+    keys = [k for k in (users_or_keys or []) if k]
+    if not keys or after is None:
+        return []
+    filt: Dict[str, Any] = {"usuario": {"$in": keys}}
+    if after_id is None:
+        filt["ts"] = {"$gt": after}
+    else:
+        filt["$or"] = [{"ts": {"$gt": after}}, {"ts": after, "_id": {"$gt": after_id}}]
+    return list(_hist().find(filt, sort=[("ts", 1), ("_id", 1)], limit=limit))
+
+
+@traced("repo.delete_user_history")
 def delete_user_history(usuario: str) -> int:
-    return _hist().delete_many({"usuario": usuario})
+    n = _hist().delete_many({"usuario": usuario})
+    invalidate_user(usuario)
+    return n
 
 
+@traced("repo.delete_last_interaction")
 def delete_last_interaction(usuario: str) -> bool:
     """
     Remove o último turno (maior ts; fallback _id).
@@ -183,10 +302,12 @@ def delete_last_interaction(usuario: str) -> bool:
     if not last:
         return False
     deleted = _hist().delete_many({"_id": last["_id"]})
+    invalidate_user(usuario)
     return deleted > 0
 
 
 # ---------- Eventos ----------
+@traced("repo.register_event")
 def register_event(
     usuario: str,
     tipo: str,
@@ -194,6 +315,8 @@ def register_event(
     local: Optional[str],
     extra: Optional[Dict[str, Any]] = None
 ) -> None:
+    if defer_write(register_event, usuario, tipo, descricao, local, extra):
+        return
     _events().insert_one({
         "usuario": usuario,
         "tipo": tipo,
@@ -202,8 +325,10 @@ def register_event(
         "extra": extra or {},
         "ts": datetime.utcnow(),
     })
+    invalidate_user(usuario)
 
 
+@traced("repo.list_events")
 def list_events(usuario: str, limit: int = 5) -> List[Dict[str, Any]]:
     return list(_events().find(
         {"usuario": usuario},
@@ -213,6 +338,7 @@ def list_events(usuario: str, limit: int = 5) -> List[Dict[str, Any]]:
 
 
 # ---------- Utilidades ----------
+@traced("repo.last_event")
 def last_event(usuario: str, tipo: str) -> Optional[Dict[str, Any]]:
     return _events().find_one(
         {"usuario": usuario, "tipo": tipo},
@@ -220,10 +346,13 @@ def last_event(usuario: str, tipo: str) -> Optional[Dict[str, Any]]:
     )
 
 
+@traced("repo.delete_all_user_data")
 def delete_all_user_data(usuario: str) -> Dict[str, int]:
-    return {
+    out = {
         "hist": _hist().delete_many({"usuario": usuario}),
         "state": _state().delete_many({"usuario": usuario}),
         "eventos": _events().delete_many({"usuario": usuario}),
         "perfil": 0,
     }
+    invalidate_user(usuario)
+    return out
@@ -1,10 +1,20 @@
 from __future__ import annotations
 
 import os
+import time
 from typing import Any, Dict, List, Tuple
 
 from .openrouter import chat as openrouter_chat, DEFAULT_MODELS as OR_MODELS
 from .together import chat as together_chat, DEFAULT_MODELS as TG_MODELS
+from .tracing import span
+from .usage import record as record_usage, current_purpose, purpose as purpose_scope
+from .jobs import check_cancelled, current_job
+from . import metrics
+
+_LLM_REQS = metrics.counter("llm_requests_total", "Chamadas de LLM", ["provider", "purpose", "status"])
+_LLM_LAT = metrics.histogram("llm_request_seconds", "Latência das chamadas de LLM", ["provider", "purpose"])
+_LLM_TOKENS = metrics.counter("llm_tokens_total", "Tokens reportados pelo provedor", ["provider", "kind"])
+_LLM_COST = metrics.counter("llm_cost_usd_total", "Custo reportado/estimado (USD)", ["provider"])
 
 # Modelo seguro de fallback
 SAFE_FALLBACK_MODEL = "deepseek/deepseek-chat-v3-0324"
@@ -117,15 +127,47 @@ def route_chat_strict(model: str, payload: Dict[str, Any]):
     if extra:
         kwargs["extra"] = extra
 
-    # --- TOGETHER ---
-    if provider == "Together":
-        return together_chat(norm_model, msgs, **kwargs)
-
-    # --- OPENROUTER ---
-    try:
-        return openrouter_chat(norm_model, msgs, **kwargs)
-    except RuntimeError as e:
-        msg = str(e).lower()
-        if "not a valid model id" in msg or "model_not_found" in msg:
-            return openrouter_chat(SAFE_FALLBACK_MODEL, msgs, **kwargs)
-        raise
+    purpose = payload.get("purpose") or current_purpose()
+    check_cancelled()
+    t0 = time.perf_counter()
+    with span("llm.route", model=norm_model, provider=provider, messages=len(msgs),
+              max_tokens=kwargs["max_tokens"], tools=bool(extra), purpose=purpose) as sp, \
+            purpose_scope(purpose):  # provedores decidem o streaming pelo propósito
+        try:
+            # --- TOGETHER ---
+            if provider == "Together":
+                out = together_chat(norm_model, msgs, **kwargs)
+            else:
+                # --- OPENROUTER ---
+                try:
+                    out = openrouter_chat(norm_model, msgs, **kwargs)
+                except RuntimeError as e:
+                    msg = str(e).lower()
+                    if "not a valid model id" in msg or "model_not_found" in msg:
+                        sp.set(fallback=SAFE_FALLBACK_MODEL)
+                        out = openrouter_chat(SAFE_FALLBACK_MODEL, msgs, **kwargs)
+                    else:
+                        raise
+        except Exception:
+            check_cancelled()  # erro causado pelo cancelamento (client fechado) não é falha do provedor
+            dt = time.perf_counter() - t0
+            record_usage(norm_model, provider.lower(), None, dt * 1000.0, purpose, error=True)
+            _LLM_REQS.labels(provider=provider.lower(), purpose=purpose, status="error").inc()
+            _LLM_LAT.labels(provider=provider.lower(), purpose=purpose).observe(dt)
+            raise
+        dt = time.perf_counter() - t0
+        rec = record_usage(out[1], out[2], out[0], dt * 1000.0, purpose)
+        _LLM_REQS.labels(provider=out[2], purpose=purpose, status="ok").inc()
+        _LLM_LAT.labels(provider=out[2], purpose=purpose).observe(dt)
+        _LLM_TOKENS.labels(provider=out[2], kind="prompt").inc(rec["prompt_tokens"])
+        _LLM_TOKENS.labels(provider=out[2], kind="completion").inc(rec["completion_tokens"])
+        job = current_job()
+        if rec["cost"]:
+            _LLM_COST.labels(provider=out[2]).inc(rec["cost"])
+            if job is not None:
+                job.cost += rec["cost"]
+        if not rec["priced"] and job is not None:
+            job.meta["unpriced_calls"] = job.meta.get("unpriced_calls", 0) + 1
+        sp.set(prompt_tokens=rec["prompt_tokens"], completion_tokens=rec["completion_tokens"],
+               cost=round(rec["cost"], 6))
+        return out
@@ -0,0 +1,126 @@
+# core/session.py
+"""
+Estado da sessão visto pelos serviços das personagens.
+
+- session_state(): o mapeamento que reply() lê/grava. Por padrão é st.session_state;
+  dentro de use_state(snap) (nesta thread) é o snapshot.
+- StateSnapshot.capture(keys): cópia só das chaves que o serviço declara
+  (BaseCharacter.state_keys), feita no script (thread da sessão). Leituras vêm da cópia,
+  gravações ficam em .written/.removed; valores alterados no lugar (dict lido e mutado)
+  também contam. apply() leva tudo isso para a sessão real depois.
+  Usado pela pré-geração especulativa: roda fora da sessão e só vale se for aproveitada.
+- Sem API interna do Streamlit: nada de trocar o session_state do ScriptRunContext.
+"""
+from __future__ import annotations
+
+import copy
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, MutableMapping, Optional, Set
+
+_TL = threading.local()
+_MISSING = object()
+
+
+class StateSnapshot:
+    """Mapeamento isolado: lê a cópia inicial e registra o que o serviço grava/remove."""
+
+    def __init__(self, base: Dict[str, Any], orig: Optional[Dict[str, Any]] = None):
+        self._base = base
+        self._orig = orig if orig is not None else {}  # cópia intocada, p/ detectar mutação no lugar
+        self.written: Dict[str, Any] = {}
+        self.removed: Set[str] = set()
+
+    @classmethod
+    def capture(cls, keys: Iterable[str], source: Optional[MutableMapping] = None) -> "StateSnapshot":
+        src = source if source is not None else session_state()
+        base: Dict[str, Any] = {}
+        orig: Dict[str, Any] = {}
+        for k in keys:
+            if k in src:
+                try:
+                    base[k] = copy.deepcopy(src[k])
+                    orig[k] = copy.deepcopy(src[k])
+                except Exception:
+                    base[k] = src[k]  # não copiável: só leitura
+        return cls(base, orig)
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self.written:
+            return self.written[key]
+        if key in self.removed:
+            raise KeyError(key)
+        return self._base[key]
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self.written[key] = value
+        self.removed.discard(key)
+
+    def __delitem__(self, key: str) -> None:
+        if key not in self:
+            raise KeyError(key)
+        self.written.pop(key, None)
+        self.removed.add(key)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self.written or (key in self._base and key not in self.removed)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self[key] if key in self else default
+
+    def setdefault(self, key: str, default: Any = None) -> Any:
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key: str, default: Any = _MISSING) -> Any:
+        if key in self:
+            value = self[key]
+            del self[key]
+            return value
+        if default is _MISSING:
+            raise KeyError(key)
+        return default
+
+    def _mutated(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {}
+        for k, v in self._orig.items():
+            if k in self.written or k in self.removed:
+                continue
+            try:
+                if self._base[k] != v:
+                    out[k] = self._base[k]
+            except Exception:
+                pass
+        return out
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.written or self.removed or self._mutated())
+
+    def apply(self, target: Optional[MutableMapping] = None) -> None:
+        """Leva gravações/remoções para a sessão (default: session_state() da thread atual)."""
+        tgt = target if target is not None else session_state()
+        for k in self.removed:
+            tgt.pop(k, None)
+        for k, v in {**self._mutated(), **self.written}.items():
+            tgt[k] = v
+
+
+def session_state() -> MutableMapping:
+    state = getattr(_TL, "state", None)
+    if state is not None:
+        return state
+    import streamlit as st
+    return st.session_state
+
+
+@contextmanager
+def use_state(state: Optional[StateSnapshot]) -> Iterator[None]:
+    """Nesta thread, session_state() devolve `state` (None = sessão real)."""
+    prev = getattr(_TL, "state", None)
+    _TL.state = state
+    try:
+        yield
+    finally:
+        _TL.state = prev
@@ -0,0 +1,159 @@
+# core/speculative.py
+"""
+Pré-geração especulativa do turno CONTINUAR (opt-in: SPECULATIVE_CONTINUE=1 ou toggle na UI).
+
+- start(fn, owner, sig, model): depois de cada resposta, dispara em background (core.jobs)
+  o reply() com o prompt exato do CONTINUAR, dentro de deferred_writes() — nada vai ao
+  banco (histórico, fatos, lore) até o resultado ser aproveitado.
+- take(spec, owner, sig, model): no clique, entrega o job se owner/modelo e a assinatura
+  do histórico ainda batem (hit: pronto ou em voo); senão cancela e conta miss.
+  Quem consome aplica job.meta["deferred"] com replay_writes().
+- discard(spec): outro prompt, recap ou troca de thread → cancela e conta discarded.
+- Só dispara com orçamento (SPEC_BUDGET_USD gastos por hora, usados ou não) e para modelos
+  saudáveis e baratos segundo core.usage: taxa de erro ≤ SPEC_MAX_ERROR_RATE e custo médio
+  por chamada ≤ SPEC_MAX_CALL_USD. Custo desconhecido (sem `cost` do provider nem
+  USAGE_PRICES) não é elegível; chamadas sem preço num job contam SPEC_MAX_CALL_USD cada.
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+from . import jobs, metrics
+from .repositories import deferred_writes
+from .usage import totals as usage_totals
+
+SPEC_ENABLED = os.getenv("SPECULATIVE_CONTINUE", "0").strip().lower() in {"1", "true", "yes", "on"}
+SPEC_BUDGET_USD = float(os.getenv("SPEC_BUDGET_USD", "0.05"))
+SPEC_MAX_CALL_USD = float(os.getenv("SPEC_MAX_CALL_USD", "0.01"))
+SPEC_MAX_ERROR_RATE = float(os.getenv("SPEC_MAX_ERROR_RATE", "0.2"))
+SPEC_SUFFIX = "#spec"  # owner próprio: o job não aparece como pendente do thread real
+
+_LOCK = threading.Lock()
+_SPEND: Deque[Tuple[float, float]] = deque()  # (ts, US$) dos jobs especulativos finalizados
+_STATS: Dict[str, float] = {"started": 0, "hit": 0, "hit_inflight": 0, "miss": 0, "discarded": 0,
+                            "skipped": 0, "wasted_usd": 0.0}
+
+_M_SPEC = metrics.counter("speculative_total", "Pré-gerações do CONTINUAR por resultado", ("result",))
+_M_WASTE = metrics.counter("speculative_wasted_usd_total", "Custo (USD) de pré-gerações descartadas")
+
+
+def enabled(session_flag: Optional[bool] = None) -> bool:
+    return SPEC_ENABLED if session_flag is None else bool(session_flag)
+
+
+def _count(result: str, n: float = 1) -> None:
+    with _LOCK:
+        _STATS[result] = _STATS.get(result, 0) + n
+    _M_SPEC.labels(result=result).inc(n)
+
+
+def spent_last_hour() -> float:
+    cutoff = time.time() - 3600.0
+    with _LOCK:
+        while _SPEND and _SPEND[0][0] < cutoff:
+            _SPEND.popleft()
+        return sum(c for _, c in _SPEND)
+
+
+def model_ok(model: str) -> Tuple[bool, str]:
+    """Saudável e barato o bastante, pelos agregados de uso desde o boot (chamadas 'main')."""
+    rows = [r for r in usage_totals()
+            if r["purpose"] == "main" and (r["model"] == model or r["model"].endswith(model.split("/", 1)[-1]))]
+    calls = sum(r["calls"] for r in rows)
+    if not calls:
+        return False, "sem histórico de uso"
+    if sum(r["errors"] for r in rows) / calls > SPEC_MAX_ERROR_RATE:
+        return False, "instável"
+    if sum(r.get("unpriced", 0) for r in rows):
+        return False, "custo desconhecido"
+    if sum(r["cost"] for r in rows) / calls > SPEC_MAX_CALL_USD:
+        return False, "caro"
+    return True, ""
+
+
+def _charged(job: "jobs.Job") -> float:
+    """Custo do job para o orçamento: chamadas sem preço valem o teto por chamada."""
+    return job.cost + SPEC_MAX_CALL_USD * job.meta.get("unpriced_calls", 0)
+
+
+def _on_done(job: "jobs.Job") -> None:
+    with _LOCK:
+        _SPEND.append((time.time(), _charged(job)))
+    if job.meta.get("discarded"):
+        _waste(_charged(job))
+
+
+def _waste(cost: float) -> None:
+    if cost:
+        with _LOCK:
+            _STATS["wasted_usd"] += cost
+        _M_WASTE.inc(cost)
+
+
+def start(fn: Callable[[], str], *, owner: str, sig: str, model: str) -> Optional[Dict[str, Any]]:
+    """Dispara a pré-geração se couber no orçamento. Devolve o `spec` para guardar na sessão."""
+    ok, _ = model_ok(model)
+    if not ok or spent_last_hour() >= SPEC_BUDGET_USD:
+        _count("skipped")
+        return None
+
+    def _run() -> str:
+        with deferred_writes() as buf:
+            job = jobs.current_job()
+            if job is not None:
+                job.meta["deferred"] = buf
+            return fn()
+
+    job_id = jobs.submit(_run, owner=owner + SPEC_SUFFIX, on_done=_on_done,
+                         speculative=True, model=model)
+    _count("started")
+    return {"job_id": job_id, "owner": owner, "sig": sig, "model": model}
+
+
+def discard(spec: Optional[Dict[str, Any]], result: str = "discarded") -> None:
+    if not spec:
+        return
+    job = jobs.get(spec.get("job_id"))
+    if job is not None:
+        job.meta["discarded"] = True
+        if job.done:
+            _waste(_charged(job))
+        else:
+            jobs.cancel(job.id)  # custo parcial entra em _on_done
+    _count(result)
+
+
+def take(spec: Optional[Dict[str, Any]], *, owner: str, sig: str, model: str) -> Optional["jobs.Job"]:
+    """Job pré-gerado (pronto ou em voo) se o contexto não mudou; senão None (miss)."""
+    if not spec:
+        return None
+    job = jobs.get(spec.get("job_id"))
+    if (job is None or job.status in ("error", "cancelled")
+            or (spec.get("owner"), spec.get("sig"), spec.get("model")) != (owner, sig, model)):
+        discard(spec, "miss")
+        return None
+    _count("hit" if job.done else "hit_inflight")
+    return job
+
+
+def spec_stats() -> Dict[str, Any]:
+    with _LOCK:
+        st = dict(_STATS)
+    hits = st["hit"] + st["hit_inflight"]
+    tried = hits + st["miss"] + st["discarded"]
+    return dict(st, hit_rate=(hits / tried) if tried else 0.0, spent_last_hour=spent_last_hour(),
+                budget_usd=SPEC_BUDGET_USD)
+
+
+def _spec_metrics():
+    st = spec_stats()
+    yield ("speculative_hit_rate", "gauge", "Fração de pré-gerações aproveitadas", {}, st["hit_rate"])
+    yield ("speculative_spent_usd_hour", "gauge", "Gasto (USD) com pré-gerações na última hora", {},
+           st["spent_last_hour"])
+
+
+metrics.register_collector(_spec_metrics)
@@ -1,5 +1,6 @@
 # core/textproc.py
 import re
+import unicodedata
 from typing import List
 
 # Split de sentenças seguro (evita dividir em abreviações simples e limpa espaços)
@@ -82,3 +83,31 @@ def formatar_roleplay_profissional(texto: str, max_frases_por_par: int = 2) -> s
     out = "\n\n".join(paras)
     out = re.sub(r"[ \t]+$", "", out, flags=re.MULTILINE)  # tira espaços à direita
     return out.strip()
+
+
+# ===================== Normalização para busca (PT-BR) =====================
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+# Palavras funcionais comuns (já sem acento); não carregam assunto na busca
+PT_STOPWORDS = frozenset("""
+a o as os um uma uns umas de do da dos das em no na nos nas por pelo pela pelos pelas
+para pra pro com sem sob sobre ate e ou mas se que quem qual quais cujo como quando onde
+ja nao sim mais menos muito muita muitos muitas tao ao aos a as esse essa esses essas
+este esta estes estas isso isto aquele aquela aquilo eu tu ele ela nos vos eles elas
+me te lhe nos vos lhes meu minha meus minhas teu tua seu sua seus suas nosso nossa
+foi ser era sao estou esta estao tem ter ha la ai aqui entao tambem so
+""".split())
+
+def fold_accents(text: str) -> str:
+    """Minúsculas e sem diacríticos ("Café Náutico" → "cafe nautico")."""
+    if not text:
+        return ""
+    nfkd = unicodedata.normalize("NFKD", text.lower())
+    return "".join(ch for ch in nfkd if not unicodedata.combining(ch))
+
+def search_tokens(text: str, drop_stopwords: bool = True) -> List[str]:
+    """Tokens de palavra normalizados (sem acento, minúsculos) para índices de busca."""
+    toks = _WORD_RE.findall(fold_accents(text))
+    if drop_stopwords:
+        toks = [t for t in toks if t not in PT_STOPWORDS]
+    return toks
@@ -3,7 +3,7 @@ from __future__ import annotations
 import os
 from typing import Any, Dict, List, Tuple
 
-import httpx
+from .jobs import current_job, should_stream, stream_completion
 
 DEFAULT_MODELS = [
     "together/meta-llama/Meta-Llama-3.1-405B-Instruct-Turbo",
@@ -57,24 +57,36 @@ def chat(
     if extra:
         body.update(extra)
 
+    import httpx  # import tardio: o SDK HTTP só carrega na 1ª chamada de LLM
+
     timeout = float(os.getenv("LLM_HTTP_TIMEOUT", "60"))
     try:
         with httpx.Client(timeout=timeout) as client:
-            r = client.post(TOGETHER_BASE_URL, json=body, headers=_headers())
-            if r.status_code >= 400:
-                try:
-                    err = r.json()
-                except Exception:
-                    err = {"text": r.text}
-                raise RuntimeError(
-                    f"Together {r.status_code}: {err.get('error') or err.get('message') or err}"
-                )
-            data = r.json()
-            used = data.get("model") or model_to_send
-            # normaliza só pra exibir
-            if not used.startswith("together/") and not used.startswith("deepseek-ai/"):
-                used = f"together/{used}"
-            return data, used, "together"
+            job = current_job()
+            if job is not None:
+                job.attach(client)  # cancelar o job fecha o client e aborta a requisição
+            try:
+                if job is not None and should_stream():
+                    data = stream_completion(client, TOGETHER_BASE_URL, _headers(), body, job, "Together")
+                else:
+                    r = client.post(TOGETHER_BASE_URL, json=body, headers=_headers())
+                    if r.status_code >= 400:
+                        try:
+                            err = r.json()
+                        except Exception:
+                            err = {"text": r.text}
+                        raise RuntimeError(
+                            f"Together {r.status_code}: {err.get('error') or err.get('message') or err}"
+                        )
+                    data = r.json()
+                used = data.get("model") or model_to_send
+                # normaliza só pra exibir
+                if not used.startswith("together/") and not used.startswith("deepseek-ai/"):
+                    used = f"together/{used}"
+                return data, used, "together"
+            finally:
+                if job is not None:
+                    job.detach(client)  # o client fechado não fica preso ao job
     except httpx.TimeoutException as e:
         raise RuntimeError("Together: timeout") from e
     except httpx.HTTPError as e:
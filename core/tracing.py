@@ -0,0 +1,234 @@
+# core/tracing.py
+"""
+Tracing leve por turno (sem dependências).
+
+- span("nome", **attrs): context manager; mede duração e aninha sob o span atual
+  da thread. Sem trace ativo, o custo é um getattr em thread-local.
+- traced("nome"): decorator de span filho (ex.: route_chat_strict, repositories);
+  traced("nome", root=True) abre o trace raiz do turno (reply() dos serviços).
+- Ao fechar o trace raiz: guarda em recent_traces() (memória) e anexa uma linha em
+  TRACE_DIR/traces.jsonl com rotação por tamanho (TRACE_MAX_BYTES, TRACE_BACKUPS).
+- waterfall(trace): linhas (profundidade, nome, início_ms, duração_ms, attrs) para a UI.
+- Dono: owner_scope(usuario_key) marca os traces abertos na thread; recent_traces(owner=...)
+  e get_trace(id) evitam mostrar a um usuário o turno de outro. last_trace_id() devolve o
+  último trace fechado nesta thread (o job guarda para a sessão).
+
+TRACE_ENABLED=0 desliga tudo (span/traced viram no-op).
+"""
+from __future__ import annotations
+
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional
+
+TRACE_ENABLED = os.getenv("TRACE_ENABLED", "1").strip().lower() not in {"0", "false", "no", "off"}
+TRACE_DIR = os.getenv("TRACE_DIR", "") or os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                                   ".cache", "traces")
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(5 * 1024 * 1024)))
+TRACE_BACKUPS = int(os.getenv("TRACE_BACKUPS", "3"))
+TRACE_MAX_SPANS = 500  # por trace (protege contra loops)
+
+_TL = threading.local()
+_RECENT: Deque[Dict[str, Any]] = deque(maxlen=50)
+_FILE_LOCK = threading.Lock()
+
+
+def _jsonable(v: Any) -> Any:
+    if isinstance(v, (str, int, float, bool)) or v is None:
+        return v
+    return str(v)[:200]
+
+
+class Span:
+    __slots__ = ("name", "attrs", "start", "end", "parent", "depth", "error")
+
+    def __init__(self, name: str, attrs: Dict[str, Any], parent: int, depth: int):
+        self.name = name
+        self.attrs = attrs
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.parent = parent
+        self.depth = depth
+        self.error = ""
+
+    def set(self, **attrs: Any) -> None:
+        self.attrs.update(attrs)
+
+
+class _NullSpan:
+    def set(self, **attrs: Any) -> None:
+        pass
+
+
+_NULL = _NullSpan()
+
+
+def current_trace() -> Optional[Dict[str, Any]]:
+    return getattr(_TL, "trace", None)
+
+
+@contextmanager
+def span(name: str, **attrs: Any) -> Iterator[Any]:
+    """Span filho do atual; no-op se não houver trace ativo nesta thread."""
+    tr = getattr(_TL, "trace", None)
+    if tr is None or len(tr["spans"]) >= TRACE_MAX_SPANS:
+        yield _NULL
+        return
+    stack: List[int] = tr["stack"]
+    sp = Span(name, attrs, stack[-1] if stack else -1, len(stack))
+    tr["spans"].append(sp)
+    stack.append(len(tr["spans"]) - 1)
+    try:
+        yield sp
+    except BaseException as e:
+        sp.error = f"{type(e).__name__}: {e}"[:200]
+        raise
+    finally:
+        sp.end = time.perf_counter()
+        stack.pop()
+
+
+@contextmanager
+def owner_scope(owner: str) -> Iterator[None]:
+    """Traces raiz abertos dentro do bloco (nesta thread) pertencem a `owner`."""
+    prev = getattr(_TL, "owner", None)
+    _TL.owner = owner
+    try:
+        yield
+    finally:
+        _TL.owner = prev
+
+
+def annotate_trace(**fields: Any) -> None:
+    """Campos do trace raiz ativo (ex.: character=...) — no-op sem trace."""
+    tr = getattr(_TL, "trace", None)
+    if tr is not None:
+        tr.update({k: v for k, v in fields.items() if k not in ("id", "spans", "stack")})
+
+
+def last_trace_id() -> Optional[str]:
+    return getattr(_TL, "last_id", None)
+
+
+@contextmanager
+def trace(name: str, **attrs: Any) -> Iterator[Any]:
+    """Trace raiz (um por turno). Aninhado em outro trace vira span."""
+    if not TRACE_ENABLED:
+        yield _NULL
+        return
+    if getattr(_TL, "trace", None) is not None:
+        with span(name, **attrs) as sp:
+            yield sp
+        return
+    tr = {"id": uuid.uuid4().hex[:12], "name": name, "ts": time.time(), "spans": [], "stack": [],
+          "owner": getattr(_TL, "owner", None) or "", "character": name.split(".", 1)[0]}
+    _TL.trace = tr
+    try:
+        with span(name, **attrs) as sp:
+            yield sp
+    finally:
+        _TL.trace = None
+        _TL.last_id = tr["id"]
+        _finish(tr)
+
+
+def traced(name: Optional[str] = None, root: bool = False) -> Callable:
+    """Decorator: span filho (sem trace ativo, não mede nada); root=True abre o trace do turno."""
+    def deco(fn: Callable) -> Callable:
+        label = name or fn.__qualname__
+        ctx = trace if root else span
+
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if getattr(_TL, "trace", None) is None and not root:
+                return fn(*args, **kwargs)
+            with ctx(label):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+def _to_dict(tr: Dict[str, Any]) -> Dict[str, Any]:
+    spans: List[Span] = tr["spans"]
+    t0 = spans[0].start if spans else 0.0
+    return {
+        "id": tr["id"],
+        "name": tr["name"],
+        "ts": tr["ts"],
+        "owner": tr.get("owner") or "",
+        "character": tr.get("character") or "",
+        "total_ms": round(((spans[0].end or spans[0].start) - t0) * 1000.0, 2) if spans else 0.0,
+        "spans": [{
+            "name": s.name,
+            "parent": s.parent,
+            "depth": s.depth,
+            "start_ms": round((s.start - t0) * 1000.0, 2),
+            "dur_ms": round(((s.end or s.start) - s.start) * 1000.0, 2),
+            "attrs": {k: _jsonable(v) for k, v in s.attrs.items()},
+            **({"error": s.error} if s.error else {}),
+        } for s in spans],
+    }
+
+
+def _rotate(path: str) -> None:
+    for i in range(TRACE_BACKUPS - 1, 0, -1):
+        src = f"{path}.{i}"
+        if os.path.exists(src):
+            os.replace(src, f"{path}.{i + 1}")
+    if TRACE_BACKUPS > 0:
+        os.replace(path, f"{path}.1")
+    else:
+        os.remove(path)
+
+
+def _append_jsonl(rec: Dict[str, Any]) -> None:
+    if not TRACE_DIR:
+        return
+    path = os.path.join(TRACE_DIR, "traces.jsonl")
+    line = json.dumps(rec, ensure_ascii=False) + "\n"
+    with _FILE_LOCK:
+        try:
+            os.makedirs(TRACE_DIR, exist_ok=True)
+            if os.path.exists(path) and os.path.getsize(path) + len(line) > TRACE_MAX_BYTES:
+                _rotate(path)
+            with open(path, "a", encoding="utf-8") as fh:
+                fh.write(line)
+        except OSError:
+            pass
+
+
+def _finish(tr: Dict[str, Any]) -> None:
+    rec = _to_dict(tr)
+    _RECENT.append(rec)
+    _append_jsonl(rec)
+
+
+def recent_traces(name_prefix: str = "", owner: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Traces mais recentes primeiro (opcionalmente filtrados por prefixo do nome e dono)."""
+    return [t for t in reversed(_RECENT)
+            if t["name"].startswith(name_prefix) and (owner is None or t.get("owner") == owner)]
+
+
+def get_trace(trace_id: Optional[str]) -> Optional[Dict[str, Any]]:
+    for t in reversed(_RECENT):
+        if t["id"] == trace_id:
+            return t
+    return None
+
+
+def last_trace(name_prefix: str = "") -> Optional[Dict[str, Any]]:
+    out = recent_traces(name_prefix)
+    return out[0] if out else None
+
+
+def waterfall(rec: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Spans em ordem de início, com fração do total (0..1) para desenhar barras."""
+    total = float(rec.get("total_ms") or 0.0) or 1.0
+    return [dict(s, off=s["start_ms"] / total, width=max(s["dur_ms"] / total, 0.002))
+            for s in rec.get("spans", [])]
@@ -36,7 +36,8 @@ def critic_review(model: str, system_guard: str, last_user: str, draft: str) ->
         "messages": [{"role": "user", "content": prompt}],
         "max_tokens": 220,
         "temperature": 0.0,
-        "top_p": 0.9
+        "top_p": 0.9,
+        "purpose": "critic",
     })
     return (data.get("choices", [{}])[0].get("message", {}) or {}).get("content", "") or ""
 
@@ -60,6 +61,7 @@ def polish(model: str, system_guard: str, last_user: str, draft: str, critic_not
         "messages": [{"role": "user", "content": prompt}],
         "max_tokens": max(512, min(2048, len(draft)//3 + 400)),
         "temperature": 0.3,
-        "top_p": 0.9
+        "top_p": 0.9,
+        "purpose": "polish",
     })
     return (data.get("choices", [{}])[0].get("message", {}) or {}).get("content", "") or draft
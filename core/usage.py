@@ -0,0 +1,219 @@
+# core/usage.py
+"""
+Contabilidade de tokens/custo por chamada de LLM (capturada em route_chat_strict).
+
+- record(): lê o bloco `usage` da resposta (prompt/completion tokens e, no OpenRouter,
+  `cost` em USD) + latência, modelo, provider, personagem e propósito da chamada.
+- Propósito: payload["purpose"] ou o contexto `with purpose("summary"):`
+  (main | summary | critic | polish | tool-iteration); default "main".
+- Personagem/turno/dono: `with turn_scope(owner, character):` (thread-local, como purpose;
+  não depende do tracing ligado) — recent_turns(owner=...) só mostra os turnos do usuário.
+  Fora de um turn_scope, caem no trace ativo (tr["character"] ou prefixo do nome, ex.:
+  "mary.reply" → "mary"; tr["owner"] via owner_scope).
+- Agregação em memória por (hora, personagem, modelo, propósito) e por turno;
+  flush periódico ($inc com upsert) na coleção USAGE_COLLECTION ("llm_metrics").
+- Sem custo informado pelo provider, usa USAGE_PRICES (JSON: {"modelo": [in, out]} USD/1M tokens);
+  sem nenhum dos dois o custo é desconhecido: rec["priced"]=False e totals() conta "unpriced".
+"""
+from __future__ import annotations
+
+import atexit
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from . import metrics
+from .tracing import current_trace
+
+try:
+    from core.database import get_col
+except Exception:
+    get_col = None
+
+USAGE_COLLECTION = os.getenv("USAGE_COLLECTION", "llm_metrics")
+USAGE_FLUSH_S = float(os.getenv("USAGE_FLUSH_S", "60"))
+USAGE_MAX_TURNS = 200
+PURPOSES = ("main", "summary", "critic", "polish", "tool-iteration")
+
+try:
+    _PRICES: Dict[str, List[float]] = json.loads(os.getenv("USAGE_PRICES", "") or "{}")
+except ValueError:
+    _PRICES = {}
+
+_TL = threading.local()
+_LOCK = threading.Lock()
+_PENDING: Dict[Tuple[str, str, str, str], Dict[str, float]] = {}
+_TOTALS: Dict[Tuple[str, str, str], Dict[str, float]] = {}  # (personagem, modelo, propósito) desde o boot
+_TURNS: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_STATE: Dict[str, Any] = {"last_flush": time.time(), "flushing": False, "flushed": 0, "last_error": ""}
+
+
+@contextmanager
+def purpose(name: str) -> Iterator[None]:
+    """Marca o propósito das chamadas de LLM feitas dentro do bloco (nesta thread)."""
+    prev = getattr(_TL, "purpose", None)
+    _TL.purpose = name
+    try:
+        yield
+    finally:
+        _TL.purpose = prev
+
+
+def current_purpose(default: str = "main") -> str:
+    return getattr(_TL, "purpose", None) or default
+
+
+@contextmanager
+def turn_scope(owner: str = "", character: str = "") -> Iterator[Dict[str, Any]]:
+    """Atribui as chamadas de LLM do bloco a um turno (dono/personagem) nesta thread."""
+    prev = getattr(_TL, "turn", None)
+    _TL.turn = {"id": uuid.uuid4().hex[:12], "owner": owner or "", "character": character or "", "ts": time.time()}
+    try:
+        yield _TL.turn
+    finally:
+        _TL.turn = prev
+
+
+def annotate_turn(**fields: Any) -> None:
+    """Completa o turno aberto (ex.: o pipeline sabe o personagem real)."""
+    turn = getattr(_TL, "turn", None)
+    if turn is not None:
+        turn.update({k: v for k, v in fields.items() if v})
+
+
+def _num(v: Any) -> float:
+    try:
+        return float(v or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _cost(model: str, usage: Dict[str, Any], pt: float, ct: float) -> Optional[float]:
+    if usage.get("cost") is not None:
+        return _num(usage.get("cost"))
+    price = _PRICES.get(model) or _PRICES.get(model.split("/", 1)[-1])
+    if price and len(price) >= 2:
+        return (pt * _num(price[0]) + ct * _num(price[1])) / 1_000_000.0
+    return None
+
+
+def _add(bucket: Dict[str, float], pt: float, ct: float, cost: float, ms: float, err: bool) -> None:
+    bucket["calls"] = bucket.get("calls", 0) + 1
+    bucket["prompt_tokens"] = bucket.get("prompt_tokens", 0) + pt
+    bucket["completion_tokens"] = bucket.get("completion_tokens", 0) + ct
+    bucket["cost"] = bucket.get("cost", 0.0) + cost
+    bucket["latency_ms"] = bucket.get("latency_ms", 0.0) + ms
+    bucket["errors"] = bucket.get("errors", 0) + (1 if err else 0)
+
+
+def record(model: str, provider: str, data: Optional[Dict[str, Any]], latency_ms: float,
+           purpose_name: Optional[str] = None, error: bool = False) -> Dict[str, Any]:
+    """Registra uma chamada. Retorna o registro normalizado (útil para spans/logs)."""
+    usage = (data or {}).get("usage") or {}
+    pt = _num(usage.get("prompt_tokens"))
+    ct = _num(usage.get("completion_tokens"))
+    cost = _cost(model or "", usage, pt, ct)
+    priced = cost is not None
+    cost = cost or 0.0
+    tr = current_trace()
+    scope = getattr(_TL, "turn", None)
+    character = ((scope or {}).get("character")
+                 or ((tr.get("character") or tr["name"].split(".", 1)[0]) if tr else "") or "-")
+    turn_src = scope or ({"id": tr["id"], "owner": tr.get("owner") or "", "ts": tr["ts"]} if tr else None)
+    purp = purpose_name or current_purpose()
+    rec = {"model": model, "provider": provider, "character": character, "purpose": purp,
+           "prompt_tokens": int(pt), "completion_tokens": int(ct), "cost": cost,
+           "latency_ms": round(latency_ms, 1), "error": bool(error), "priced": priced}
+    hour = time.strftime("%Y-%m-%dT%H", time.gmtime())
+    with _LOCK:
+        _add(_PENDING.setdefault((hour, character, model or "?", purp), {}), pt, ct, cost, latency_ms, error)
+        tot = _TOTALS.setdefault((character, model or "?", purp), {})
+        _add(tot, pt, ct, cost, latency_ms, error)
+        tot["unpriced"] = tot.get("unpriced", 0) + (0 if priced or error else 1)
+        if turn_src:
+            turn = _TURNS.get(turn_src["id"])
+            if turn is None:
+                turn = _TURNS[turn_src["id"]] = {"id": turn_src["id"], "character": character,
+                                                 "owner": turn_src["owner"], "ts": turn_src["ts"], "by_purpose": {}}
+                while len(_TURNS) > USAGE_MAX_TURNS:
+                    _TURNS.popitem(last=False)
+            _add(turn, pt, ct, cost, latency_ms, error)
+            _add(turn["by_purpose"].setdefault(purp, {}), pt, ct, cost, latency_ms, error)
+        due = time.time() - _STATE["last_flush"] >= USAGE_FLUSH_S and not _STATE["flushing"]
+        if due:
+            _STATE["flushing"] = True
+    if due:
+        threading.Thread(target=flush, name="usage-flush", daemon=True).start()
+    return rec
+
+
+def flush() -> int:
+    """Grava os agregados pendentes ($inc por hora/personagem/modelo/propósito). Retorna buckets gravados."""
+    with _LOCK:
+        pending = dict(_PENDING)
+        _PENDING.clear()
+        _STATE["last_flush"] = time.time()
+    n = 0
+    done = set()
+    try:
+        if pending and callable(get_col):
+            col = get_col(USAGE_COLLECTION)
+            for key, b in pending.items():
+                hour, character, model, purp = key
+                col.update_one(
+                    {"hour": hour, "character": character, "model": model, "purpose": purp},
+                    {"$inc": {k: v for k, v in b.items()}},
+                    upsert=True,
+                )
+                done.add(key)
+                n += 1
+    except Exception as e:
+        _STATE["last_error"] = f"{type(e).__name__}: {e}"
+        with _LOCK:  # devolve só o que não foi gravado ($inc repetido contaria em dobro)
+            for k, b in pending.items():
+                if k in done:
+                    continue
+                tgt = _PENDING.setdefault(k, {})
+                for f, v in b.items():
+                    tgt[f] = tgt.get(f, 0) + v
+    finally:
+        _STATE["flushed"] += n
+        _STATE["flushing"] = False
+    return n
+
+
+atexit.register(flush)
+
+
+def recent_turns(character: Optional[str] = None, limit: int = 30,
+                 owner: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Turnos mais antigos primeiro (para gráficos de tendência); owner = usuario_key do turno."""
+    with _LOCK:
+        rows = [dict(t, by_purpose={k: dict(v) for k, v in t["by_purpose"].items()}) for t in _TURNS.values()
+                if (character is None or t["character"] == character) and (owner is None or t["owner"] == owner)]
+    return rows[-limit:]
+
+
+def totals() -> List[Dict[str, Any]]:
+    with _LOCK:
+        return [dict(b, character=c, model=m, purpose=p) for (c, m, p), b in _TOTALS.items()]
+
+
+def usage_stats() -> Dict[str, Any]:
+    with _LOCK:
+        return {"pending_buckets": len(_PENDING), "turns": len(_TURNS),
+                **{k: v for k, v in _STATE.items() if k != "flushing"}}
+
+
+def _usage_metrics():
+    st = usage_stats()
+    yield ("usage_pending_buckets", "gauge", "Agregados de uso aguardando flush", {}, st["pending_buckets"])
+    yield ("usage_flushed_buckets_total", "counter", "Agregados de uso gravados", {}, st["flushed"])
+
+
+metrics.register_collector(_usage_metrics)
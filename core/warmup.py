@@ -0,0 +1,128 @@
+# core/warmup.py
+"""
+Aquecimento do processo logo após o deploy (uma vez por processo, thread daemon).
+
+Tira do 1º turno do usuário o custo de inicialização única:
+- tokenizer: tiktoken baixa/carrega o BPE cl100k no 1º toklen();
+- db: 1ª conexão do pool Mongo (DNS SRV + TLS) via database.warm_pool();
+- http: import do httpx (carregado tarde pelos provedores);
+- personas: get_persona() de cada personagem do catálogo;
+- services: characters.registry.get_service() de cada personagem (importa os módulos).
+
+start_warmup() é idempotente; main.py chama via st.cache_resource. warmup_status()
+devolve o estado por etapa (pendente|rodando|ok|erro, ms) para o painel de diagnóstico.
+WARMUP=0 desliga.
+"""
+from __future__ import annotations
+
+import importlib
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from . import metrics
+
+WARMUP_ENABLED = os.getenv("WARMUP", "1").strip().lower() not in {"0", "false", "no", "off"}
+
+_LOCK = threading.Lock()
+_STATE: Dict[str, Any] = {"thread": None, "started": 0.0, "finished": 0.0}
+_STEPS: Dict[str, Dict[str, Any]] = {}
+
+_M_STEP = metrics.histogram("warmup_step_seconds", "Duração das etapas do warm-up", ("step",))
+
+
+def _tokenizer() -> None:
+    from .tokens import toklen
+    toklen("aquecimento do tokenizer")
+
+
+def _db() -> None:
+    from .database import get_backend, warm_pool
+    if get_backend() == "mongo" and not warm_pool():
+        raise RuntimeError("Mongo indisponível")
+
+
+def _http() -> None:
+    importlib.import_module("httpx")
+
+
+def _catalog() -> List[str]:
+    from characters.registry import list_characters
+    return [c.lower() for c in list_characters()]
+
+
+def _personas() -> None:
+    for name in _catalog():
+        mod = importlib.import_module(f"characters.{name}.persona")
+        fn = getattr(mod, "get_persona", None)
+        if callable(fn):
+            fn()
+
+
+def _services() -> None:
+    from characters.registry import get_service
+    for name in _catalog():
+        get_service(name)
+
+
+STEPS: List[Tuple[str, Callable[[], None]]] = [
+    ("tokenizer", _tokenizer),
+    ("db", _db),
+    ("http", _http),
+    ("personas", _personas),
+    ("services", _services),
+]
+
+
+def _run() -> None:
+    for name, fn in STEPS:
+        step = _STEPS[name]
+        step["state"] = "rodando"
+        t0 = time.perf_counter()
+        try:
+            fn()
+            step["state"] = "ok"
+        except Exception as e:
+            step.update(state="erro", error=f"{type(e).__name__}: {e}"[:200])
+        dt = time.perf_counter() - t0
+        step["ms"] = round(dt * 1000.0, 1)
+        _M_STEP.labels(step=name).observe(dt)
+    _STATE["finished"] = time.time()
+
+
+def start_warmup() -> bool:
+    """Dispara o aquecimento em background (só na 1ª chamada do processo)."""
+    if not WARMUP_ENABLED:
+        return False
+    with _LOCK:
+        if _STATE["thread"] is not None:
+            return False
+        for name, _ in STEPS:
+            _STEPS[name] = {"state": "pendente", "ms": 0.0}
+        _STATE["started"] = time.time()
+        th = threading.Thread(target=_run, name="warmup", daemon=True)
+        _STATE["thread"] = th
+        th.start()
+        return True
+
+
+def is_ready() -> bool:
+    return bool(_STEPS) and all(s["state"] in ("ok", "erro") for s in _STEPS.values())
+
+
+def warmup_status() -> Dict[str, Any]:
+    return {
+        "enabled": WARMUP_ENABLED,
+        "ready": is_ready(),
+        "started": _STATE["started"],
+        "total_ms": round((_STATE["finished"] - _STATE["started"]) * 1000.0, 1) if _STATE["finished"] else 0.0,
+        "steps": {k: dict(v) for k, v in _STEPS.items()},
+    }
+
+
+def _warmup_metrics():
+    yield ("warmup_ready", "gauge", "1 quando o warm-up do processo terminou", {}, 1 if is_ready() else 0)
+
+
+metrics.register_collector(_warmup_metrics)
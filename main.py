@@ -7,16 +7,33 @@ import hmac
 import hashlib
 import inspect
 import traceback
+import threading
 from pathlib import Path
 from typing import Optional, List, Tuple, Dict
 import streamlit as st
 import base64
 import re
-from pymongo import MongoClient
 from datetime import datetime
 import html
 import importlib
 from core.nsfw import nsfw_enabled
+from core import json_log
+from core import jobs
+from core import speculative
+from core.database import end_turn_db_calls, reset_db_calls
+from core.repositories import defer_write, replay_writes
+from core.session import StateSnapshot, session_state, use_state
+from core.tracing import last_trace_id, owner_scope
+from core.usage import turn_scope
+try:
+    from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+except Exception:  # Streamlit antigo
+    add_script_run_ctx = lambda *a, **k: None  # noqa: E731
+    get_script_run_ctx = lambda: None  # noqa: E731
+try:
+    from streamlit.runtime.scriptrunner.script_run_context import SCRIPT_RUN_CONTEXT_ATTR_NAME as _CTX_ATTR
+except Exception:
+    _CTX_ATTR = "streamlit_script_run_ctx"
 from core.repositories import get_fact
 
 import streamlit as st
@@ -33,6 +50,24 @@ try:
     ensure_indexes()
 except Exception:
     pass
+try:
+    # compactação/retenção da memória longa (opt-in: só com LORE_COMPACT_INTERVAL_S > 0; uma thread por processo)
+    from core.memoria_compaction import start_background_compaction
+    start_background_compaction()
+except Exception:
+    pass
+try:
+    # métricas Prometheus: METRICS_PORT (HTTP /metrics) e/ou METRICS_TEXTFILE; uma vez por processo
+    from core.metrics import start_metrics_exporter
+    start_metrics_exporter()
+except Exception:
+    pass
+try:
+    # invalidação de cache por change streams (CACHE_WATCH=1, backend Mongo com replica set)
+    from core.change_watcher import start_change_watcher
+    start_change_watcher()
+except Exception:
+    pass
 
 ROOT = Path(__file__).resolve().parent
 if str(ROOT) not in sys.path:
@@ -82,18 +117,44 @@ def _encode_file_b64(p: Path) -> str:
     with p.open("rb") as f:
         return base64.b64encode(f.read()).decode("utf-8")
 
-def set_background(image_path: Path, *, darken: float = 0.90, blur_px: int = 0,
-                   attach_fixed: bool = True, size_mode: str = "cover") -> None:
-    if not image_path or not image_path.exists():
-        return
-    ext = image_path.suffix.lower()
-    mime = {".jpg": "jpeg", ".jpeg": "jpeg", ".png": "png", ".webp": "webp", ".gif": "gif"}.get(ext, "jpeg")
-    b64 = _encode_file_b64(image_path)
+# "classe" de viewport por modo: cover precisa cobrir a tela; contain só caber nela
+_BG_VIEWPORT = {
+    "cover": (int(os.getenv("BG_MAX_WIDTH", "1920")), int(os.getenv("BG_MAX_HEIGHT", "1080"))),
+    "contain": (int(os.getenv("BG_MAX_WIDTH", "1920")) * 2 // 3, int(os.getenv("BG_MAX_HEIGHT", "1080"))),
+}
+_BG_WEBP_QUALITY = int(os.getenv("BG_WEBP_QUALITY", "78"))
+
+def _bg_image_b64(path: str, size_mode: str, blur_px: int) -> Tuple[str, str]:
+    """(mime, base64): reduz para o viewport, aplica o blur na imagem e reencoda em WebP."""
+    try:
+        import io
+        from PIL import Image, ImageFilter  # opcional
+        with Image.open(path) as im:
+            im = im.convert("RGB")
+            vw, vh = _BG_VIEWPORT.get(size_mode, _BG_VIEWPORT["cover"])
+            w, h = im.size
+            scale = max(vw / w, vh / h) if size_mode == "cover" else min(vw / w, vh / h)
+            if scale < 1.0:
+                im = im.resize((max(1, int(w * scale)), max(1, int(h * scale))), Image.LANCZOS)
+            if blur_px:
+                # blur "assado" na imagem: evita filter: blur() na camada fixa a cada repaint
+                im = im.filter(ImageFilter.GaussianBlur(blur_px))
+            buf = io.BytesIO()
+            im.save(buf, format="WEBP", quality=_BG_WEBP_QUALITY, method=4)
+        return "webp", base64.b64encode(buf.getvalue()).decode("utf-8")
+    except Exception:
+        # sem Pillow (ou imagem que ele não abre): arquivo original, como antes
+        p = Path(path)
+        mime = {".jpg": "jpeg", ".jpeg": "jpeg", ".png": "png", ".webp": "webp", ".gif": "gif"}.get(p.suffix.lower(), "jpeg")
+        return mime, _encode_file_b64(p)
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def _background_css(path: str, mtime: float, darken: float, blur_px: int, size_mode: str, attach_fixed: bool) -> str:
+    """CSS pronto por (path, mtime, darken, blur, size_mode): reruns só reenviam a string em cache."""
+    mime, b64 = _bg_image_b64(path, size_mode, blur_px)
+    blur_css = 0 if mime == "webp" else blur_px
     att = "fixed" if attach_fixed else "scroll"
-    darken = max(0.0, min(0.9, float(darken)))
-    blur_px = max(0, min(40, int(blur_px)))
-    size_mode = size_mode if size_mode in ("cover", "contain") else "cover"
-    st.markdown(f"""
+    return f"""
     <style>
     .stApp {{ background: transparent !important; }}
     .block-container {{ position: relative; z-index: 1; }}
@@ -101,13 +162,26 @@ def set_background(image_path: Path, *, darken: float = 0.90, blur_px: int = 0,
       content: ""; position: fixed; inset: 0;
       background-image: url("data:image/{mime};base64,{b64}");
       background-position: center center; background-repeat: no-repeat;
-      background-size: {size_mode}; background-attachment: {att}; filter: blur({blur_px}px); z-index: 0;
+      background-size: {size_mode}; background-attachment: {att};{f" filter: blur({blur_css}px);" if blur_css else ""} z-index: 0;
     }}
     .stApp::after {{
       content: ""; position: fixed; inset: 0; background: rgba(0,0,0,{darken}); z-index: 0; pointer-events: none;
     }}
     </style>
-    """, unsafe_allow_html=True)
+    """
+
+def set_background(image_path: Path, *, darken: float = 0.90, blur_px: int = 0,
+                   attach_fixed: bool = True, size_mode: str = "cover") -> None:
+    if not image_path or not image_path.exists():
+        return
+    darken = max(0.0, min(0.9, float(darken)))
+    blur_px = max(0, min(40, int(blur_px)))
+    size_mode = size_mode if size_mode in ("cover", "contain") else "cover"
+    try:
+        css = _background_css(str(image_path), image_path.stat().st_mtime, darken, blur_px, size_mode, bool(attach_fixed))
+    except Exception:
+        return
+    st.markdown(css, unsafe_allow_html=True)
 
 # ========== GATE OPCIONAL (senha) ==========
 def _check_scrypt(pwd: str) -> bool:
@@ -243,10 +317,21 @@ try:
 except Exception:
     pass
 
+# Warm-up (tokenizer, pool do Mongo, personas, services) — uma vez por processo, em background
+@st.cache_resource(show_spinner=False)
+def _warmup() -> bool:
+    try:
+        from core.warmup import start_warmup
+        return start_warmup()
+    except Exception:
+        return False
+
+_warmup()
+
 # Repositório (histórico/fatos) — safe fallback
 try:
     from core.repositories import (
-        get_history_docs, get_history_docs_multi,
+        get_history_docs, get_history_docs_cached, get_history_docs_multi, get_history_page, get_history_since,
         set_fact, get_fact, get_facts, delete_fact,
         delete_user_history, delete_last_interaction, delete_all_user_data,
         register_event, list_events,
@@ -254,7 +339,10 @@ try:
     )
 except Exception:
     def get_history_docs(_u: str, limit: int = 400): return []
+    def get_history_docs_cached(_u: str, limit: int = 400): return []
     def get_history_docs_multi(_keys: List[str], limit: int = 400): return []
+    def get_history_page(_keys: List[str], before=None, limit: int = 40): return []
+    def get_history_since(_keys: List[str], after, limit: int = 200, after_id=None): return []
     def set_fact(*a, **k): ...
     def get_fact(_u: str, _k: str, default=None): return default
     def get_facts(_u: str): return {}
@@ -276,6 +364,13 @@ st.sidebar.markdown("---")
 st.sidebar.subheader("🗄️ Banco de Dados")
 bk, info = db_status()
 st.sidebar.caption(f"Backend: **{bk}** — {info}")
+try:
+    from core.warmup import warmup_status
+    _wu = warmup_status()
+    if _wu["enabled"] and _wu["steps"]:
+        st.sidebar.caption("Aquecimento: " + (f"✅ pronto em {_wu['total_ms']:.0f} ms" if _wu["ready"] else "⏳ em andamento…"))
+except Exception:
+    pass
 
 cur_backend = get_backend()
 choice_backend = st.sidebar.radio(
@@ -290,6 +385,16 @@ if choice_backend != cur_backend:
     st.sidebar.success(f"Backend ajustado para **{choice_backend}**.")
     st.rerun()
 
+if choice_backend == "mongo":
+    try:
+        from core.change_watcher import watcher_stats
+        _ws = watcher_stats()
+        if _ws["running"] or _ws["last_error"]:
+            st.sidebar.caption(f"Watcher de cache: {'ativo' if _ws['running'] else 'parado'} · "
+                               f"{_ws['invalidations']} invalidações · {_ws['last_error'] or 'ok'}")
+    except Exception:
+        pass
+
 if st.sidebar.button("🔍 Testar conexão DB"):
     kind, ok, detail = ping_db()
     (st.sidebar.success if ok else st.sidebar.error)(f"{kind}: {detail}")
@@ -387,13 +492,26 @@ st.session_state.setdefault("history_loaded_for", "")
 st.session_state.setdefault("_active_key", "")
 
 # ========== CONTROLES TOPO ==========
+def _prefetch_character() -> None:
+    """on_change do seletor: roda antes do rerun, então o contexto do novo personagem
+    (facts, histórico recente, lore) já vai carregando enquanto o resto da página monta."""
+    uid = str(st.session_state.get("user_id", "")).strip()
+    ch = str(st.session_state.get("character", "")).strip().lower()
+    if not (uid and ch):
+        return
+    try:
+        from core.prefetch import prefetch
+        prefetch(f"{uid}::{ch}", extra_keys=[uid] if ch == "mary" else [])
+    except Exception:
+        pass
+
 c1, c2 = st.columns([2, 2])
 with c1:
     st.text_input("👤 Usuário", key="user_id", placeholder="Seu nome ou identificador")
 with c2:
     names = list_characters()
     default_idx = names.index("Mary") if "Mary" in names else 0
-    st.selectbox("🎭 Personagem", names, index=default_idx, key="character")
+    st.selectbox("🎭 Personagem", names, index=default_idx, key="character", on_change=_prefetch_character)
 
 def _label_model(mid: str) -> str:
     prov = _provider_for(mid)
@@ -430,6 +548,7 @@ def _mongo():
         if not (mongo_user and mongo_pass and mongo_cluster):
             return None
         uri = f"mongodb+srv://{mongo_user}:{mongo_pass}@{mongo_cluster}/?retryWrites=true&w=majority"
+        from pymongo import MongoClient  # só quando o log JSON precisa gravar
         client = MongoClient(uri, serverSelectionTimeoutMS=5000)
         db = client["roleplay_mary"]
         coll = db["interacoes"]
@@ -439,35 +558,35 @@ def _mongo():
         st.error(f"❌ Erro ao conectar MongoDB: {e}")
         return None
 
-def _save_json_response_to_mongo(data: dict, *, user: str, personagem: str, modelo: str) -> None:
-    """Salva resposta JSON estruturada no MongoDB com cache de conexão."""
+def _log_json_response(text: str) -> None:
+    """Agenda o log da resposta JSON (fila assíncrona, idempotente por hash do conteúdo)."""
+    data = json_log.parse_json_response(text)
+    if data is None:
+        return
     try:
-        coll = _mongo()
-        if not coll:
-            st.warning("⚠️ Credenciais do Mongo ausentes em st.secrets.")
-            return
-        doc = {
-            "usuario": user,
-            "personagem": personagem,
-            "fala": (data.get("fala") or "").strip(),
-            "pensamento": (data.get("pensamento") or "").strip(),
-            "acao": (data.get("acao") or "").strip(),
-            "meta": (data.get("meta") or "").strip(),
-            "timestamp": datetime.now().isoformat(timespec="seconds"),
-            "modelo": modelo,
-            "modo_json": True,
-        }
-        coll.insert_one(doc)
-    except Exception as e:
-        st.error(f"❌ Erro ao salvar no MongoDB: {e}")
+        json_log.enqueue(
+            _mongo(), data,
+            user=st.session_state.get("user_name") or st.session_state.get("usuario") or "desconhecido",
+            personagem=(st.session_state.get("character") or "desconhecida").strip(),
+            modelo=st.session_state.get("model") or st.session_state.get("current_model") or "desconhecido",
+        )
+    except Exception:
+        pass
+
+_CAPTION_STYLE = "font-size:.875rem;opacity:.65;margin:.25rem 0"
 
-def render_assistant_bubbles(markdown_text: str) -> None:
+def _build_segments(markdown_text: str) -> List[Tuple[str, str]]:
     """
-    Renderiza respostas da assistente. Se vier JSON válido (schema: fala/pensamento/acao/meta),
-    formata; caso contrário, renderiza Markdown normal.
+    HTML pronto de uma resposta: [("html", ...) | ("md", bloco de código)].
+    HTML consecutivo vira um único segmento → 1 st.markdown por mensagem no caso comum.
     """
-    if not markdown_text:
-        return
+    segs: List[Tuple[str, str]] = []
+
+    def _html(chunk: str) -> None:
+        if segs and segs[-1][0] == "html":
+            segs[-1] = ("html", segs[-1][1] + chunk)
+        else:
+            segs.append(("html", chunk))
 
     # 1) Tenta JSON estruturado
     try:
@@ -480,28 +599,14 @@ def render_assistant_bubbles(markdown_text: str) -> None:
             meta = str(data.get("meta", "") or "").strip()
 
             if fala:
-                safe_fala = html.escape(fala).replace("\n", "<br>")
-                st.markdown(f"<div class='assistant-paragraph'><b>{safe_fala}</b></div>", unsafe_allow_html=True)
+                _html(f"<div class='assistant-paragraph'><b>{html.escape(fala).replace(chr(10), '<br>')}</b></div>")
             if pensamento:
-                safe_pense = html.escape(pensamento).replace("\n", "<br>")
-                st.markdown(f"<div class='assistant-paragraph'><em>{safe_pense}</em></div>", unsafe_allow_html=True)
-            if acao:
-                safe_acao = html.escape(acao).replace("\n", "<br>")
-                st.caption(safe_acao)
-            if meta:
-                safe_meta = html.escape(meta).replace("\n", "<br>")
-                st.caption(safe_meta)
-
-            # Log Mongo (personagem atual)
-            try:
-                _user = st.session_state.get("user_name") or st.session_state.get("usuario") or "desconhecido"
-                _person = (st.session_state.get("character") or "desconhecida").strip()
-                _model = st.session_state.get("model") or st.session_state.get("current_model") or "desconhecido"
-                _save_json_response_to_mongo(data, user=_user, personagem=_person, modelo=_model)
-            except Exception:
-                pass
+                _html(f"<div class='assistant-paragraph'><em>{html.escape(pensamento).replace(chr(10), '<br>')}</em></div>")
+            for extra in (acao, meta):
+                if extra:
+                    _html(f"<div style='{_CAPTION_STYLE}'>{html.escape(extra).replace(chr(10), '<br>')}</div>")
 
-            return
+            return segs
     except Exception:
         pass
 
@@ -509,12 +614,33 @@ def render_assistant_bubbles(markdown_text: str) -> None:
     parts = re.split(r"(```[\\s\\S]*?```)", markdown_text)
     for part in parts:
         if part.startswith("```") and part.endswith("```"):
-            st.markdown(part)
+            segs.append(("md", part))
         else:
             paras = [p.strip() for p in re.split(r"\n\s*\n", part) if p.strip()]
             for p in paras:
-                safe = html.escape(p).replace("\n", "<br>")
-                st.markdown(f"<div class='assistant-paragraph'>{safe}</div>", unsafe_allow_html=True)
+                _html(f"<div class='assistant-paragraph'>{html.escape(p).replace(chr(10), '<br>')}</div>")
+    return segs
+
+@st.cache_data(show_spinner=False, max_entries=2048)
+def _assistant_segments(markdown_text: str) -> List[Tuple[str, str]]:
+    """_build_segments com cache por conteúdo (só mensagens finalizadas)."""
+    return _build_segments(markdown_text)
+
+def render_assistant_bubbles(markdown_text: str, partial: bool = False) -> None:
+    """
+    Renderiza respostas da assistente. Se vier JSON válido (schema: fala/pensamento/acao/meta),
+    formata; caso contrário, renderiza Markdown normal. HTML em cache por conteúdo;
+    partial=True (texto em streaming) não passa pelo cache — cada poll seria uma entrada
+    descartável empurrando as mensagens reais para fora.
+    """
+    if not markdown_text:
+        return
+    segs = _build_segments(markdown_text) if partial else _assistant_segments(markdown_text)
+    for kind, chunk in segs:
+        if kind == "html":
+            st.markdown(chunk, unsafe_allow_html=True)
+        else:
+            st.markdown(chunk)
 
 def _user_keys_for_history(user_id: str, character_name: str) -> List[str]:
     ch = (character_name or "").strip().lower()
@@ -523,32 +649,118 @@ def _user_keys_for_history(user_id: str, character_name: str) -> List[str]:
         return [primary, user_id]
     return [primary]
 
+HISTORY_LOAD_LIMIT = 400  # teto do sync incremental; acima disso recarrega só a janela recente
+CHAT_PAGE_TURNS = int(os.getenv("CHAT_PAGE_TURNS", "20"))  # turnos visíveis por página do transcript
+
+def _docs_to_pairs(docs: List[dict], char: str) -> List[Tuple[str, str]]:
+    hist: List[Tuple[str, str]] = []
+    resposta_key = f"resposta_{char.strip().lower()}"
+    for d in docs:
+        u = (d.get("mensagem_usuario") or "").strip()
+        a = (d.get(resposta_key)
+             or d.get("resposta_adelle")  # compatibilidade Adelle
+             or d.get("resposta_mary") or "").strip()
+        if u:
+            hist.append(("user", u))
+        if a:
+            hist.append(("assistant", a))
+    return hist
+
+def _history_snapshot(key: str) -> Optional[dict]:
+    """Estado sincronizado por thread: pares vindos do banco + high-water mark ((ts, _id) do último doc)."""
+    return st.session_state.setdefault("_hist_threads", {}).get(key)
+
+
+def _hw_mark(doc: dict) -> Tuple:
+    """High-water mark (ts, _id): o _id desempata docs gravados no mesmo instante."""
+    return (doc.get("ts"), doc.get("_id"))
+
+
+def _publish_snapshot(snap: dict) -> None:
+    st.session_state["history_oldest_ts"] = snap["oldest"]
+    st.session_state["history_has_older"] = snap["has_older"]
+
+
 def _reload_history(force: bool = False):
+    """
+    Sync incremental: a 1ª carga de um thread traz só a janela recente (CHAT_PAGE_TURNS);
+    as seguintes buscam apenas docs depois da marca (ts, _id) e os anexam. Turnos locais
+    ainda não sincronizados (o job acabou de responder) dão lugar à versão do banco.
+    Histórico zerado no mesmo thread (apagar/resetar) = recarga completa.
+    """
     user_id = str(st.session_state["user_id"])
     char = str(st.session_state["character"])
     key = f"{user_id}|{char}|{get_backend()}"
     if not force and st.session_state["history_loaded_for"] == key:
         return
+    threads = st.session_state.setdefault("_hist_threads", {})
+    hist = st.session_state["history"]
+    same_thread = st.session_state.get("history_for") == key
+    if same_thread and not hist:
+        threads.pop(key, None)
+    snap = threads.get(key)
     try:
         keys = _user_keys_for_history(user_id, char)
-        docs = get_history_docs_multi(keys, limit=400) or []
-        hist: List[Tuple[str, str]] = []
-
-        resposta_key = f"resposta_{char.strip().lower()}"
-        for d in docs:
-            u = (d.get("mensagem_usuario") or "").strip()
-            a = (d.get(resposta_key)
-                 or d.get("resposta_adelle")  # compatibilidade Adelle
-                 or d.get("resposta_mary") or "").strip()
-            if u:
-                hist.append(("user", u))
-            if a:
-                hist.append(("assistant", a))
+        if snap is not None:
+            if not same_thread:  # voltou para um thread já visto nesta sessão
+                hist = list(snap["pairs"])
+                st.session_state["history_synced_n"] = len(hist)
+            hw_ts, hw_id = snap["hw"]
+            new_docs = ([] if hw_ts is None else
+                        get_history_since(keys, hw_ts, limit=HISTORY_LOAD_LIMIT, after_id=hw_id) or [])
+            if hw_ts is None or len(new_docs) >= HISTORY_LOAD_LIMIT:
+                # doc legado sem ts no topo (sem marca confiável) ou muito atrasado: janela recente
+                snap = None
+            elif new_docs:
+                new_pairs = _docs_to_pairs(new_docs, char)
+                n = int(st.session_state.get("history_synced_n", len(snap["pairs"])))
+                hist = hist[:n] + new_pairs
+                snap["pairs"] = snap["pairs"] + new_pairs
+                snap["hw"] = _hw_mark(new_docs[-1])
+                st.session_state["history_synced_n"] = len(hist)
+        if snap is None:
+            docs = get_history_page(keys, limit=CHAT_PAGE_TURNS) or []  # os N mais recentes, em ordem asc
+            hist = _docs_to_pairs(docs, char)
+            snap = threads[key] = {
+                "pairs": list(hist),
+                "hw": _hw_mark(docs[-1]) if docs else (datetime.min, None),
+                "oldest": docs[0].get("ts") if docs else None,
+                "has_older": len(docs) >= CHAT_PAGE_TURNS,
+            }
+            st.session_state["history_synced_n"] = len(hist)
         st.session_state["history"] = hist
+        st.session_state["history_for"] = key
         st.session_state["history_loaded_for"] = key
+        _publish_snapshot(snap)
     except Exception as e:
         _safe_error("Não foi possível carregar o histórico.", e)
 
+def _load_older_history() -> None:
+    """Amplia a janela visível; se ela já cobre tudo em memória, busca a página anterior no banco."""
+    step = CHAT_PAGE_TURNS * 2
+    hist = st.session_state["history"]
+    visible = int(st.session_state.get("chat_visible", step))
+    if visible < len(hist):
+        st.session_state["chat_visible"] = visible + step
+        return
+    snap = _history_snapshot(str(st.session_state.get("history_for") or ""))
+    if snap is None or snap["oldest"] is None or not snap["has_older"]:
+        return
+    try:
+        keys = _user_keys_for_history(str(st.session_state["user_id"]), str(st.session_state["character"]))
+        docs = get_history_page(keys, before=snap["oldest"], limit=CHAT_PAGE_TURNS) or []
+    except Exception as e:
+        _safe_error("Não foi possível carregar mensagens anteriores.", e)
+        return
+    older = _docs_to_pairs(docs, str(st.session_state["character"]))
+    st.session_state["history"] = older + hist
+    st.session_state["history_synced_n"] = int(st.session_state.get("history_synced_n", 0)) + len(older)
+    snap["pairs"] = older + snap["pairs"]
+    snap["oldest"] = docs[0].get("ts") if docs else None
+    snap["has_older"] = len(docs) >= CHAT_PAGE_TURNS
+    _publish_snapshot(snap)
+    st.session_state["chat_visible"] = visible + step
+
 # ========== Boot da First Message ==========
 try:
     user_id = str(st.session_state.get("user_id", "")).strip()
@@ -557,7 +769,7 @@ try:
         char_key = f"{user_id}::{char.lower()}"
         docs_exist = False
         try:
-            existing = get_history_docs(char_key) or []
+            existing = get_history_docs_cached(char_key) or []  # aquecido pelo prefetch
             docs_exist = len(existing) > 0
         except Exception:
             existing = []
@@ -590,6 +802,8 @@ if st.session_state["_active_key"] != _current_active:
     st.session_state["_active_key"] = _current_active
     st.session_state["history"] = []
     st.session_state["history_loaded_for"] = ""
+    st.session_state["chat_visible"] = CHAT_PAGE_TURNS * 2
+    speculative.discard(st.session_state.pop("_spec", None))
     _reload_history(force=True)
 # ========== Auto-seed: Mary ==========
 try:
@@ -1155,11 +1369,50 @@ st.session_state["verbatim_ultimos"] = st.sidebar.slider(
     "Turnos verbatim (pares recentes)", 4, 18, st.session_state["verbatim_ultimos"]
 )
 
+# ========== Uso de tokens / custo (core.usage) ==========
+try:
+    from core.usage import recent_turns
+    _turns = recent_turns(owner=_current_active, limit=30)  # só os turnos deste usuário/personagem
+    if _turns:
+        st.sidebar.markdown("---")
+        st.sidebar.subheader("📈 Tokens e custo por turno")
+        _last = _turns[-1]
+        st.sidebar.caption(
+            f"Último: {int(_last['prompt_tokens'])} in + {int(_last['completion_tokens'])} out · "
+            f"US$ {_last['cost']:.4f} · {int(_last['calls'])} chamadas ("
+            + ", ".join(f"{k}: {int(v['prompt_tokens'] + v['completion_tokens'])}" for k, v in _last["by_purpose"].items())
+            + ")"
+        )
+        st.sidebar.line_chart({
+            "prompt": [t["prompt_tokens"] for t in _turns],
+            "completion": [t["completion_tokens"] for t in _turns],
+        }, height=140)
+        if any(t["cost"] for t in _turns):
+            st.sidebar.line_chart({"US$/turno": [round(t["cost"], 6) for t in _turns]}, height=110)
+except Exception:
+    pass
+
+# Pré-geração especulativa do CONTINUAR (opt-in)
+st.sidebar.checkbox("⚡ Pré-gerar CONTINUAR", key="spec_continue", value=speculative.SPEC_ENABLED,
+                    help="Gera o próximo CONTINUAR em segundo plano (com limite de gasto por hora).")
+if st.session_state.get("spec_continue"):
+    _ss = speculative.spec_stats()
+    st.sidebar.caption(f"Acertos: {_ss['hit_rate']:.0%} ({int(_ss['hit'] + _ss['hit_inflight'])}/"
+                       f"{int(_ss['started'])}) · US$ {_ss['spent_last_hour']:.4f}/h de {_ss['budget_usd']:.2f}")
+
 # ========== Carrega & Render histórico ==========
 _reload_history()
 
-_last_role, _last_content = None, None
-for role, content in st.session_state["history"]:
+# só as últimas N mensagens (O(visível) por rerun); o resto sob demanda
+_hist_all = st.session_state["history"]
+_visible_n = int(st.session_state.setdefault("chat_visible", CHAT_PAGE_TURNS * 2))
+_start = max(0, len(_hist_all) - _visible_n)
+if _start > 0 or st.session_state.get("history_has_older"):
+    _older = _start // 2 if _start else "mais"
+    st.button(f"⬆️ Carregar anteriores ({_older})", key="load_older_history", on_click=_load_older_history)
+
+_last_role, _last_content = _hist_all[_start - 1] if _start else (None, None)
+for role, content in _hist_all[_start:]:
     if role == _last_role and content == _last_content:
         continue
     _last_role, _last_content = role, content
@@ -1208,9 +1461,55 @@ with st.expander("🔧 Diagnóstico LLM"):
         except Exception as e:
             _safe_error("LLM ping falhou.", e)
 
+    # ----- Waterfall do último turno (core.tracing) -----
+    try:
+        from core.tracing import get_trace, recent_traces, waterfall, TRACE_DIR
+        # só traces deste usuário/thread: o deque é do processo (todas as sessões)
+        _traces = recent_traces(owner=_current_active)
+        _tr = get_trace(st.session_state.get("_last_trace_id")) or (_traces[0] if _traces else None)
+        if _tr is not None:
+            st.markdown(f"**Último turno:** `{_tr['name']}` · {_tr['total_ms']:.0f} ms · {len(_tr['spans'])} spans")
+            _rows = []
+            for _sp in waterfall(_tr):
+                _attrs = ", ".join(f"{k}={v}" for k, v in _sp["attrs"].items())
+                _err = " ⚠️" if _sp.get("error") else ""
+                _rows.append(
+                    "<div style='display:flex;align-items:center;font:12px monospace;margin:1px 0'>"
+                    f"<div style='width:38%;padding-left:{_sp['depth'] * 10}px;white-space:nowrap;overflow:hidden;"
+                    f"text-overflow:ellipsis' title='{html.escape(_attrs, quote=True)}'>{html.escape(_sp['name'])}{_err}</div>"
+                    "<div style='width:47%;position:relative;height:10px;background:rgba(128,128,128,.12)'>"
+                    f"<div style='position:absolute;left:{_sp['off'] * 100:.2f}%;width:{_sp['width'] * 100:.2f}%;"
+                    "height:10px;background:#4c9be8'></div></div>"
+                    f"<div style='width:15%;text-align:right'>{_sp['dur_ms']:.0f} ms</div></div>"
+                )
+            st.markdown("".join(_rows), unsafe_allow_html=True)
+            st.caption(f"Traces anteriores: {max(0, len(_traces) - 1)} em memória · JSONL em `{TRACE_DIR}/traces.jsonl`")
+    except Exception as e:
+        st.caption(f"Tracing indisponível: {type(e).__name__}")
+
+    # ----- Chamadas ao banco no último turno (core.database) -----
+    _dbc = st.session_state.get("_db_calls_turn")
+    if _dbc:
+        st.caption(f"Banco no último turno: {_dbc['total']} chamadas · "
+                   + ", ".join(f"{k}: {v}" for k, v in sorted(_dbc["by_op"].items())))
+
+    # ----- Warm-up do processo (core.warmup) -----
+    try:
+        from core.warmup import warmup_status
+        _wu = warmup_status()
+        if _wu["steps"]:
+            _icons = {"ok": "✅", "erro": "❌", "rodando": "⏳", "pendente": "·"}
+            st.markdown("**Warm-up:** " + " · ".join(
+                f"{_icons.get(_s['state'], '?')} {_n} {_s['ms']:.0f} ms" for _n, _s in _wu["steps"].items()))
+            for _n, _s in _wu["steps"].items():
+                if _s.get("error"):
+                    st.caption(f"{_n}: {_s['error']}")
+    except Exception as e:
+        st.caption(f"Warm-up indisponível: {type(e).__name__}")
+
 # ========== Helper de chamada segura ==========
 def _safe_reply_call(_service, *, user: str, model: str, prompt: str) -> str:
-    st.session_state["prompt"] = prompt
+    session_state()["prompt"] = prompt
     fn = getattr(_service, "reply", None)
     if not callable(fn):
         raise RuntimeError("Service atual não expõe reply().")
@@ -1231,7 +1530,7 @@ def _safe_reply_call(_service, *, user: str, model: str, prompt: str) -> str:
 st.session_state.setdefault("_pending_prompt", None)
 st.session_state.setdefault("_pending_auto", False)
 st.session_state.setdefault("_is_generating", False)
-st.session_state.setdefault("_job_uid", None)
+st.session_state.setdefault("_job_id", None)
 st.session_state.setdefault("_cont_clicked", False)
 st.session_state.setdefault("_recap_clicked", False)
 
@@ -1240,25 +1539,112 @@ _ph = st.session_state.get("suggestion_placeholder", "")
 _default_ph = f"Fale com {st.session_state['character']}"
 _dyn_ph = f"💡 Sugestão: {_ph}" if _ph else _default_ph
 
+_CONTINUE_PROMPT = (
+    "CONTINUAR: Prossiga a cena exatamente de onde a última resposta parou. "
+    "Mantenha LOCAL_ATUAL, personagens presentes e tom. Não resuma; avance ação e diálogo em 1ª pessoa."
+)
+
+
+def _history_sig() -> str:
+    """Assinatura do contexto do próximo turno (thread + tamanho + última mensagem)."""
+    hist = st.session_state["history"]
+    raw = f"{_current_active}|{len(hist)}|{hist[-1] if hist else ''}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _make_reply_fn(prompt: str, isolated: bool = False):
+    """
+    fn() para core.jobs: reply() do serviço atual com o contexto desta sessão.
+    isolated=True (pré-geração): o serviço roda sobre um core.session.StateSnapshot com
+    só as chaves que declara (state_keys), copiado aqui no script; o que ele gravar na UI
+    (prompt, sugestão, última resposta...) vira escrita adiada, aplicada só se o resultado
+    for aproveitado. Turno normal: o serviço grava direto (com os próprios try/except), e
+    leituras do mesmo turno já veem o que foi gravado.
+    O contexto do script é removido da thread do pool ao fim de cada job.
+    """
+    _svc, _uid, _model = service, str(st.session_state["user_id"]), str(st.session_state["model"])
+    _ctx = get_script_run_ctx()
+    _owner = _current_active
+    _char = str(st.session_state["character"]).lower()
+    _state = StateSnapshot.capture(getattr(_svc, "state_keys", ()), st.session_state) if isolated else None
+
+    def _fn() -> str:
+        _th = threading.current_thread()
+        if _ctx is not None:
+            add_script_run_ctx(_th, _ctx)
+        reset_db_calls()  # contador por thread: o turno inteiro roda nesta thread do pool
+        try:
+            # trace/uso do turno ficam marcados com o thread deste usuário (uso mesmo sem tracing)
+            with owner_scope(_owner), turn_scope(_owner, _char), use_state(_state):
+                # pré-geração: speculative.start já adia as escritas (replay no aproveitamento)
+                text = _safe_reply_call(_svc, user=_uid, model=_model, prompt=prompt)
+        finally:
+            if _ctx is not None:  # a thread volta ao pool sem a sessão (não vaza para o próximo job)
+                try:
+                    delattr(_th, _CTX_ATTR)
+                except AttributeError:
+                    pass
+        _job = jobs.current_job()
+        if _job is not None:
+            _job.meta["trace_id"] = last_trace_id()
+            _job.meta["db_calls"] = end_turn_db_calls()
+        if _state is not None and _state.changed:
+            defer_write(_state.apply)  # replay no script: session_state() = sessão real
+        return text
+    return _fn
+
+
+def _flag(name: str) -> None:
+    st.session_state[name] = True
+
+
+_bc1, _bc2, _ = st.columns([1, 1, 4])
+_bc1.button("🔁 Continuar", key="btn_continuar", on_click=_flag, args=("_cont_clicked",),
+            disabled=bool(st.session_state.get("_is_generating")))
+_bc2.button("🧭 Recap", key="btn_recap", on_click=_flag, args=("_recap_clicked",),
+            disabled=bool(st.session_state.get("_is_generating")))
+
 # Chat input
 try:
     user_prompt = st.chat_input(_default_ph, placeholder=_dyn_ph, key="chat_msg")
 except TypeError:
     user_prompt = st.chat_input(_dyn_ph, key="chat_msg")
 
+# Refresh da página: reencontra job em andamento/finalizado deste thread
+if st.session_state.get("_job_id") and jobs.get(st.session_state["_job_id"]) is None:
+    st.session_state["_job_id"] = None  # processo reiniciado: o job se perdeu
+    st.session_state["_is_generating"] = False
+if not st.session_state.get("_job_id"):
+    _orphan = jobs.active_job(_current_active)
+    if _orphan is not None:
+        st.session_state["_job_id"] = _orphan.id
+        st.session_state["_is_generating"] = True
+    elif st.session_state.get("_jobs_checked_for") != _current_active:
+        st.session_state["_jobs_checked_for"] = _current_active  # 1 consulta por sessão/thread
+        _done = jobs.pending_result(_current_active)
+        if _done:
+            jobs.mark_consumed(_done["job_id"])
+            _reload_history(force=True)  # o serviço já persistiu o turno
+
 # 1) Captura do envio do usuário
 if user_prompt and not st.session_state.get("_is_generating"):
     st.session_state["_pending_prompt"] = user_prompt
     st.session_state["_pending_auto"] = False
+    speculative.discard(st.session_state.pop("_spec", None))
 
 # 2) Botão CONTINUAR cria job
 if st.session_state.get("_cont_clicked") and not st.session_state.get("_is_generating"):
-    st.session_state["_pending_prompt"] = (
-        "CONTINUAR: Prossiga a cena exatamente de onde a última resposta parou. "
-        "Mantenha LOCAL_ATUAL, personagens presentes e tom. Não resuma; avance ação e diálogo em 1ª pessoa."
-    )
-    st.session_state["_pending_auto"] = True
     st.session_state["_cont_clicked"] = False
+    _spec_job = speculative.take(st.session_state.pop("_spec", None), owner=_current_active,
+                                 sig=_history_sig(), model=str(st.session_state["model"]))
+    if _spec_job is not None:
+        # hit: resposta já pronta (ou em voo) — vira o job corrente, sem nova chamada
+        st.session_state["history"].append(("user", "🔁 Continuar"))
+        st.session_state["_job_id"] = _spec_job.id
+        st.session_state["_is_generating"] = True
+    else:
+        st.session_state["_pending_prompt"] = _CONTINUE_PROMPT
+        st.session_state["_pending_auto"] = True
 
 # 3) Botão RECAP curto
 if st.session_state.get("_recap_clicked") and not st.session_state.get("_is_generating"):
@@ -1268,52 +1654,121 @@ if st.session_state.get("_recap_clicked") and not st.session_state.get("_is_gene
     )
     st.session_state["_pending_auto"] = False
     st.session_state["_recap_clicked"] = False
+    speculative.discard(st.session_state.pop("_spec", None))
+
+# 4) Processa job (em background: o rerun não fica preso esperando o provedor)
+_JOB_POLL_S = float(os.getenv("JOB_POLL_S", "0.5"))
+_fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+
+
+def _job_error_text(job: "jobs.Job") -> str:
+    tb = job.meta.get("traceback", "")
+    if APP_ENV == "prod":
+        st.session_state["last_traceback"] = tb
+        return "❌ Ocorreu um erro de geração. Tente novamente em instantes."
+    return f"Erro durante a geração:\n\n**{job.error}**\n\n```\n{tb}\n```"
+
+
+def _finish_job(job: "jobs.Job") -> None:
+    """Aplica o resultado do job à sessão (uma vez) e libera a fila."""
+    st.session_state["_job_id"] = None
+    st.session_state["_is_generating"] = False
+    jobs.mark_consumed(job.id)
+    if job.meta.get("trace_id"):
+        st.session_state["_last_trace_id"] = job.meta["trace_id"]
+    if job.meta.get("db_calls"):
+        st.session_state["_db_calls_turn"] = job.meta["db_calls"]
+    st.session_state["_job_notices"] = list(job.meta.get("notices") or [])
+    hist = st.session_state["history"]
+    if job.status == "cancelled":
+        # o serviço grava o turno só depois da geração: tira o turno do usuário pendente
+        if hist and hist[-1][0] == "user":
+            hist.pop()
+        st.session_state["_job_notice"] = "⏹️ Geração cancelada."
+        return
+    text = job.text if job.status == "done" else _job_error_text(job)
+    if job.status == "done" and job.meta.get("deferred"):
+        # pré-geração aproveitada: agora sim grava o turno (uma escrita com falha não derruba as outras)
+        failed = replay_writes(job.meta["deferred"])
+        if failed:
+            st.session_state["_job_notices"].append(
+                {"kind": "warning", "text": "⚠️ Parte do turno não foi salva: " + "; ".join(failed)})
+    if text:
+        last = hist[-1] if hist else None
+        if last != ("assistant", text):
+            hist.append(("assistant", text))
+        _log_json_response(text)
+    if job.status == "done" and speculative.enabled(st.session_state.get("spec_continue")):
+        st.session_state["_spec"] = speculative.start(
+            _make_reply_fn(_CONTINUE_PROMPT, isolated=True), owner=_current_active,
+            sig=_history_sig(), model=str(st.session_state["model"]))
+
+
+def _render_notices(notices) -> None:
+    """Avisos que o serviço emitiu dentro do job (core.jobs.notify)."""
+    for n in list(notices or []):
+        n = dict(n)
+        try:
+            getattr(st, n.pop("kind", "caption"))(n.pop("text", ""), **n)
+        except Exception:
+            pass
+
+
+def _job_view() -> None:
+    job = jobs.get(st.session_state.get("_job_id"))
+    if job is None:
+        return
+    if job.done:
+        _finish_job(job)
+        st.rerun()
+    with st.chat_message("assistant", avatar="💚"):
+        _render_notices(job.meta.get("notices"))
+        if job.partial:
+            render_assistant_bubbles(job.partial + " ▌", partial=True)
+        else:
+            st.caption("Gerando…" if job.status == "running" else "Na fila…")
+        if st.button("⏹️ Cancelar", key=f"cancel_{job.id}"):
+            jobs.cancel(job.id)
+
+
+_job_panel = _fragment(run_every=_JOB_POLL_S)(_job_view) if _fragment else None
 
-# 4) Processa job
 _has_job = bool(st.session_state.get("_pending_prompt"))
 if _has_job and not st.session_state.get("_is_generating"):
-    st.session_state["_is_generating"] = True
-    st.session_state["_job_uid"] = f"job-{time.time():.6f}"
-
     final_prompt = str(st.session_state["_pending_prompt"])
     auto_continue = bool(st.session_state["_pending_auto"])
+    st.session_state["_pending_prompt"] = None
+    st.session_state["_pending_auto"] = False
 
     # Render turno do usuário
     with st.chat_message("user"):
         st.markdown("🔁 **Continuar**" if auto_continue else final_prompt)
     st.session_state["history"].append(("user", "🔁 Continuar" if auto_continue else final_prompt))
 
-    # Geração protegida
-    try:
-        with st.spinner("Gerando…"):
-            try:
-                text = _safe_reply_call(
-                    service,
-                    user=str(st.session_state["user_id"]),
-                    model=str(st.session_state["model"]),
-                    prompt=final_prompt,
-                )
-            except Exception as e:
-                tb = traceback.format_exc()
-                if APP_ENV == "prod":
-                    text = "❌ Ocorreu um erro de geração. Tente novamente em instantes."
-                    st.session_state["last_traceback"] = tb
-                else:
-                    text = f"Erro durante a geração:\n\n**{e.__class__.__name__}** — {e}\n\n```\n{tb}\n```"
-
-        # Append garantido
-        if text:
-            last = st.session_state["history"][-1] if st.session_state["history"] else None
-            if last != ("assistant", text):
-                st.session_state["history"].append(("assistant", text))
-
-        # Render da assistente
-        with st.chat_message("assistant", avatar="💚"):
-            render_assistant_bubbles(text)
-
-    finally:
-        # Limpeza SEMPRE
-        st.session_state["_pending_prompt"] = None
-        st.session_state["_pending_auto"] = False
-        st.session_state["_job_uid"] = None
-        st.session_state["_is_generating"] = False
+    st.session_state["_job_id"] = jobs.submit(
+        _make_reply_fn(final_prompt), owner=_current_active, prompt=final_prompt, auto=auto_continue,
+        character=str(st.session_state["character"]), model=str(st.session_state["model"]),
+    )
+    st.session_state["_is_generating"] = True
+
+_notice = st.session_state.pop("_job_notice", None)
+if _notice:
+    st.caption(_notice)
+_render_notices(st.session_state.pop("_job_notices", None))
+
+if st.session_state.get("_job_id"):
+    if _job_panel is not None:
+        _job_panel()
+    else:
+        # Streamlit sem fragments: espera aqui mesmo, mas ainda mostrando o parcial
+        _job = jobs.get(st.session_state["_job_id"])
+        _ph_msg = st.empty()
+        while _job is not None and not _job.done:
+            with _ph_msg.container():
+                with st.chat_message("assistant", avatar="💚"):
+                    render_assistant_bubbles((_job.partial or "Gerando…") + " ▌", partial=True)
+            time.sleep(_JOB_POLL_S)
+        _ph_msg.empty()
+        if _job is not None:
+            _finish_job(_job)
+            st.rerun()
@@ -1,11 +1,26 @@
 # pages/3_Sala_Conjunta.py
 
 from __future__ import annotations
+import importlib
+import os
 import streamlit as st
-from typing import List, Dict, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, List, Dict, Optional, Tuple
 
-from core.service_router import route_chat_strict
-from core.repositories import save_interaction
+from core.service_router import route_chat_strict, list_models
+from core.repositories import save_interaction, get_facts_cached
+from core.tracing import owner_scope, trace
+from core.usage import turn_scope
+
+try:
+    from core.memoria_longa import topk as lore_topk
+except Exception:
+    def lore_topk(*_, **__):
+        return []
+
+PERSONAGENS = ["Mary", "Laura", "Adelle", "Nerith"]  # ordem da cena montada
+SILENCIO = "<<silêncio>>"
+FANOUT_MAX_TOKENS = int(os.getenv("JOINT_FANOUT_MAX_TOKENS", "600"))
 
 
 # =========================
@@ -33,6 +48,9 @@ def _init_state():
         )
     if "joint_temp" not in st.session_state:
         st.session_state["joint_temp"] = 0.75
+    st.session_state.setdefault("joint_fanout", False)
+    st.session_state.setdefault("joint_present", PERSONAGENS[:])
+    st.session_state.setdefault("joint_models", {})
 
 
 # =========================
@@ -125,17 +143,177 @@ Nerith:
     """.strip()
 
 
+# =========================
+# Fan-out: uma chamada por personagem
+# =========================
+
+def _persona_text(nome: str) -> str:
+    try:
+        mod = importlib.import_module(f"characters.{nome.lower()}.persona")
+        return str(mod.get_persona()[0] or "")
+    except Exception:
+        return ""
+
+
+def _fact(facts: Dict, dotted: str) -> object:
+    """Chave rasa ou pontilhada (set_fact grava 'mary.rs.v2' aninhado), como FactsSnapshot.get."""
+    if dotted in facts:
+        return facts[dotted]
+    cur: object = facts
+    for part in dotted.split("."):
+        if not isinstance(cur, dict) or part not in cur:
+            return None
+        cur = cur[part]
+    return cur
+
+
+def _flatten(facts: Dict, prefix: str = "") -> List[Tuple[str, object]]:
+    out: List[Tuple[str, object]] = []
+    for k, v in facts.items():
+        key = f"{prefix}{k}"
+        if isinstance(v, dict):
+            out.extend(_flatten(v, key + "."))
+        elif isinstance(v, (str, int, float, bool)) and str(v).strip():
+            out.append((key, v))
+    return out
+
+
+def resolver_presentes(presentes: Optional[List[str]]) -> List[str]:
+    """Presentes na ordem da cena; seleção vazia = todas (mesma lista para geração e UI)."""
+    return [n for n in PERSONAGENS if n in (presentes or PERSONAGENS)]
+
+
+def _memoria_personagem(user_id: str, nome: str, user_msg: str) -> str:
+    """Contexto próprio da personagem (mesma chave dos services): resumo, fatos e lore."""
+    n = nome.lower()
+    key = f"{user_id}::{n}"
+    try:
+        facts = get_facts_cached(key) or {}
+    except Exception:
+        facts = {}
+    resumo = str(_fact(facts, f"{n}.rs.v2") or _fact(facts, f"{n}.rolling_summary") or "").strip()
+    linhas = [f"- {k}: {v}" for k, v in _flatten(facts)
+              if ".rs.v2" not in k and "rolling_summary" not in k][:25]
+    try:
+        lore = [str(d.get("texto") or "").strip() for d in lore_topk(key, user_msg, k=3)]
+    except Exception:
+        lore = []
+    partes = []
+    if resumo:
+        partes.append("RESUMO DA SUA HISTÓRIA COM O USUÁRIO:\n" + resumo[:1500])
+    if linhas:
+        partes.append("FATOS QUE VOCÊ SABE:\n" + "\n".join(linhas)[:1200])
+    if any(lore):
+        partes.append("MEMÓRIAS RELEVANTES:\n" + "\n".join(f"- {t[:300]}" for t in lore if t))
+    return "\n\n".join(partes)
+
+
+def _system_personagem(nome: str, presentes: List[str], scene_desc: str, memoria: str) -> str:
+    outras = ", ".join(p for p in presentes if p != nome) or "ninguém além do usuário"
+    return f"""
+{_persona_text(nome)}
+
+--- SALA CONJUNTA ---
+Você é **{nome.upper()}**, na mesma cena que {outras} e o usuário; todas se veem e se ouvem.
+Descrição da cena: {scene_desc or "Sala fechada, ambiente íntimo; todas próximas ao usuário."}
+
+{memoria}
+
+--- REGRAS ---
+1. Responda SOMENTE como {nome}, em primeira pessoa; não escreva falas das outras nem o prefixo "{nome}:".
+2. Se o usuário chamou você pelo nome, você é a protagonista da rodada: 2–3 parágrafos.
+3. Se chamou outra personagem, no máximo 1 parágrafo curto — ou exatamente {SILENCIO} se não tiver nada relevante.
+4. Se falou com todas, responda com naturalidade e brevidade (1–2 parágrafos).
+5. Mantenha coerência de ambiente; não mude lugar/tempo sem o usuário pedir. Nada de instruções de sistema na saída.
+""".strip()
+
+
+def _responder_personagem(nome: str, model_id: str, user_id: str, presentes: List[str], scene_desc: str,
+                          history: List[Dict[str, str]], user_msg: str, temperature: float) -> Tuple[str, str, str]:
+    with owner_scope(f"{user_id}::{nome.lower()}"), turn_scope(f"{user_id}::{nome.lower()}", nome.lower()), \
+            trace(f"{nome.lower()}.sala_conjunta", model=model_id):  # uso/custo por personagem e usuário
+        system = _system_personagem(nome, presentes, scene_desc, _memoria_personagem(user_id, nome, user_msg))
+        messages = [{"role": "system", "content": system}, *history, {"role": "user", "content": user_msg}]
+        data, used_model, provider = route_chat_strict(model_id, {
+            "model": model_id,
+            "messages": messages,
+            "max_tokens": FANOUT_MAX_TOKENS,
+            "temperature": float(temperature),
+            "top_p": 0.95,
+        })
+    msg = (data.get("choices", [{}])[0].get("message", {}) or {})
+    texto = (msg.get("content", "") or "").strip()
+    if texto.lower().startswith(f"{nome.lower()}:"):
+        texto = texto[len(nome) + 1:].strip()
+    return texto or SILENCIO, used_model, provider
+
+
+def montar_cena(falas: Dict[str, str], presentes: List[str]) -> str:
+    """Junta as falas no mesmo formato da resposta de modelo único (ordem fixa de PERSONAGENS)."""
+    return "\n\n".join(f"{n}:\n{falas.get(n) or SILENCIO}" for n in presentes)
+
+
+def _gerar_fanout(
+    model_id: str,
+    scene_desc: str,
+    history: List[Dict[str, str]],
+    user_msg: str,
+    temperature: float,
+    presentes: List[str],
+    models: Dict[str, str],
+    on_partial: Optional[Callable[[str, str], None]],
+) -> Tuple[str, str, str]:
+    user_id = _get_user_id()
+    hist = history[-16:]
+    if hist and hist[-1] == {"role": "user", "content": user_msg}:
+        hist = hist[:-1]  # a fala atual entra uma vez só, no fim
+    falas: Dict[str, str] = {}
+    usados: Dict[str, str] = {}
+    provs: set = set()
+    with ThreadPoolExecutor(max_workers=max(1, len(presentes)), thread_name_prefix="sala") as ex:
+        futs = {
+            ex.submit(_responder_personagem, n, models.get(n) or model_id, user_id, presentes,
+                      scene_desc, hist, user_msg, temperature): n
+            for n in presentes
+        }
+        for fut in as_completed(futs):  # na thread do script: o callback pode mexer na UI
+            n = futs[fut]
+            try:
+                falas[n], usados[n], prov = fut.result()
+                provs.add(prov)
+            except Exception as e:
+                falas[n], usados[n] = f"[sem resposta: {type(e).__name__}]", models.get(n) or model_id
+            if on_partial is not None:
+                on_partial(n, falas[n])
+    used = ",".join(f"{n.lower()}={usados[n]}" for n in presentes)
+    return montar_cena(falas, presentes), used, "fanout:" + "+".join(sorted(provs))
+
+
 def gerar_resposta_conjunta(
     model_id: str,
     scene_desc: str,
     history: List[Dict[str, str]],
     user_msg: str,
     temperature: float = 0.75,
+    fanout: bool = False,
+    presentes: Optional[List[str]] = None,
+    models: Optional[Dict[str, str]] = None,
+    on_partial: Optional[Callable[[str, str], None]] = None,
 ) -> Tuple[str, str, str]:
     """
     Usa um ÚNICO modelo para controlar Mary, Laura, Adelle e Nerith
     na mesma cena compartilhada.
+
+    fanout=True: uma chamada por personagem presente, em paralelo, cada uma com o
+    próprio contexto (persona, fatos, rolling summary, lore) e modelo opcional em
+    `models`; a latência é a da mais lenta. on_partial(nome, texto) é chamado
+    (na thread do script) assim que cada uma termina.
     """
+    if fanout:
+        return _gerar_fanout(model_id, scene_desc, history, user_msg, temperature,
+                             resolver_presentes(presentes),
+                             models or {}, on_partial)
+
     system_block = _build_system_block(scene_desc)
 
     messages: List[Dict[str, str]] = []
@@ -209,7 +387,25 @@ with st.expander("⚙️ Ajustes da Sala Conjunta", expanded=False):
         value=float(st.session_state.get("joint_temp", 0.75)),
         step=0.05,
     )
+    fanout = st.toggle(
+        "Modo paralelo (uma chamada por personagem, com a memória de cada uma)",
+        value=bool(st.session_state["joint_fanout"]),
+    )
+    if fanout:
+        presentes_sel = st.multiselect("Presentes na cena", PERSONAGENS,
+                                       default=st.session_state["joint_present"] or PERSONAGENS)
+        modelos: Dict[str, str] = {}
+        for nome in presentes_sel:
+            opts = [""] + [m for m in list_models() if m != model_id]
+            atual = st.session_state["joint_models"].get(nome, "")
+            modelos[nome] = st.selectbox(
+                f"Modelo — {nome}", opts, index=opts.index(atual) if atual in opts else 0,
+                format_func=lambda m: m or f"(modelo ativo: {model_id})", key=f"joint_model_{nome}",
+            )
+        st.session_state["joint_present"] = presentes_sel
+        st.session_state["joint_models"] = {k: v for k, v in modelos.items() if v}
 st.session_state["joint_temp"] = float(temp)
+st.session_state["joint_fanout"] = bool(fanout)
 
 # Entrada do usuário
 user_msg = st.chat_input(
@@ -221,6 +417,17 @@ if user_msg:
     # Adiciona turno do usuário no histórico local
     st.session_state["joint_history"].append({"role": "user", "content": user_msg})
 
+    # Fan-out: cada personagem aparece assim que termina (placeholders na ordem da cena)
+    fanout_on = bool(st.session_state["joint_fanout"])
+    if fanout_on:
+        st.markdown(f"**Você:** {user_msg}")
+        slots = {n: st.empty() for n in resolver_presentes(st.session_state["joint_present"])}
+        for n, ph in slots.items():
+            ph.markdown(f"{n}:\n\n_…_")
+
+        def _show_partial(nome: str, texto: str) -> None:
+            slots[nome].markdown(f"{nome}:\n\n{texto}")
+
     # Chama engine conjunta
     resposta, used_model, provider = gerar_resposta_conjunta(
         model_id=model_id,
@@ -228,6 +435,10 @@ if user_msg:
         history=st.session_state["joint_history"],
         user_msg=user_msg,
         temperature=float(st.session_state["joint_temp"]),
+        fanout=fanout_on,
+        presentes=st.session_state["joint_present"],
+        models=st.session_state["joint_models"],
+        on_partial=_show_partial if fanout_on else None,
     )
 
     # Adiciona resposta no histórico